@@ -4,6 +4,24 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_wtf.csrf import CSRFProtect
 from dotenv import load_dotenv
 from extensions import db, migrate
+from search import catalog_search, search_cli
+from ratings import ratings_cli
+from stats import stats_cli
+from tasks import background_tasks
+from covers import covers_cli, cover_url
+from storage import UploadRequest, upload_storage, storage_cli
+from jobs import jobs_cli
+from catalog import catalog_cli
+from exports import export_cli
+from fines import fines_cli, format_amount
+from schema import schema_cli
+from metrics import request_metrics
+from httpcache import cache_fragment
+from passwords import password_hasher
+from provisioning import users_cli
+from recommendations import recommendations_cli
+from popularity import popularity_counter, popularity_cli
+from suggest import suggestions, suggest_cli
 from blueprints.auth import auth_bp
 from blueprints.main import main_bp
 
@@ -12,9 +30,10 @@ load_dotenv()
 
 def create_app():
     app = Flask(__name__)
+    app.request_class = UploadRequest  # uploads stream to disk while the form is parsed
     
     # Security middleware
-    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
     
     # Configuration from environment variables with fallbacks
     app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
@@ -36,11 +55,51 @@ def create_app():
     app.config["BOOK_COVER_FOLDER"] = os.path.join(app.config["UPLOAD_FOLDER"], "covers")
     app.config["BOOK_PDF_FOLDER"] = os.path.join(app.config["UPLOAD_FOLDER"], "pdfs")
     app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024  # 50 MB
+    # Cover variants are named by content hash, so browsers may keep them for a year
+    app.config["COVER_VARIANT_MAX_AGE"] = 365 * 24 * 3600
     
     # Allowed file extensions
     app.config['ALLOWED_IMAGE_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
     app.config['ALLOWED_PDF_EXTENSIONS'] = {'pdf'}
 
+    # PDF delivery: "direct", "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd); see delivery.py
+    app.config["PDF_DELIVERY"] = os.environ.get("PDF_DELIVERY", "direct")
+    app.config["PDF_ACCEL_PREFIX"] = os.environ.get("PDF_ACCEL_PREFIX", "/protected/pdfs/")
+    app.config["PDF_CACHE_MAX_AGE"] = 3600  # browsers revalidate cached PDFs after an hour
+
+    # Catalog pagination: "keyset" (cursor tokens) or "offset" (page numbers)
+    app.config["CATALOG_PAGINATION"] = os.environ.get("CATALOG_PAGINATION", "keyset")
+    app.config["CATALOG_COUNT_LIMIT"] = 1000  # count at most this many matches per page view
+    app.config["ADMIN_STATS_TTL"] = 60  # seconds the admin dashboard numbers may lag behind
+
+    # Overdue fines, in minor currency units (paise); see fines.py
+    app.config["FINE_PER_DAY"] = int(os.environ.get("FINE_PER_DAY", 500))
+    app.config["FINE_MAX_PER_LOAN"] = None  # no cap
+    app.config["FINE_CURRENCY"] = os.environ.get("FINE_CURRENCY", "₹")
+
+    # Request instrumentation; see metrics.py
+    app.config["SLOW_REQUEST_MS"] = int(os.environ.get("SLOW_REQUEST_MS", 500))
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")  # bearer token for a Prometheus scraper
+
+    # Password hashing on a process pool (0 workers hashes inline); see passwords.py
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    if "PASSWORD_HASH_WORKERS" in os.environ:
+        app.config["PASSWORD_HASH_WORKERS"] = int(os.environ["PASSWORD_HASH_WORKERS"])
+
+    # "Readers also borrowed", rebuilt by `flask recommendations rebuild`; see recommendations.py
+    app.config["RECOMMENDATIONS_TOP_K"] = 8  # neighbours stored and shown per book
+    app.config["RECOMMENDATIONS_MIN_CO_BORROWERS"] = 2  # a single shared reader is coincidence
+    app.config["RECOMMENDATIONS_MAX_BASKET"] = 500  # readers with more loans are left out
+    app.config["RECOMMENDATIONS_BLOCK_PAIRS"] = 5_000_000  # bounds the rebuild's memory (~12 bytes each)
+
+    # "Trending" catalog sort; see popularity.py
+    app.config["TRENDING_HALF_LIFE_DAYS"] = float(os.environ.get("TRENDING_HALF_LIFE_DAYS", 7))
+    app.config["POPULARITY_FLUSH_SECONDS"] = 60  # how often each worker writes its event counts
+
+    # Search box typeahead, an in-memory prefix index per worker; see suggest.py
+    app.config["SUGGEST_LIMIT"] = 8  # titles and authors suggested per keystroke
+    app.config["SUGGEST_REFRESH_SECONDS"] = int(os.environ.get("SUGGEST_REFRESH_SECONDS", 900))
+
     # Create upload directories
     for p in [app.config["UPLOAD_FOLDER"], app.config["BOOK_COVER_FOLDER"], app.config["BOOK_PDF_FOLDER"]]:
         os.makedirs(p, exist_ok=True)
@@ -48,6 +107,13 @@ def create_app():
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
+    catalog_search.init_app(app)
+    background_tasks.init_app(app)
+    upload_storage.init_app(app)
+    request_metrics.init_app(app)
+    password_hasher.init_app(app)
+    popularity_counter.init_app(app)
+    suggestions.init_app(app)
     
     # Initialize CSRF protection
     csrf = CSRFProtect()
@@ -57,6 +123,27 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
 
+    # CLI commands
+    app.cli.add_command(search_cli)
+    app.cli.add_command(ratings_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(covers_cli)
+    app.cli.add_command(storage_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(catalog_cli)
+    app.cli.add_command(export_cli)
+    app.cli.add_command(fines_cli)
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(recommendations_cli)
+    app.cli.add_command(popularity_cli)
+    app.cli.add_command(suggest_cli)
+
+    # Template helpers
+    app.add_template_global(cover_url)
+    app.add_template_global(format_amount)
+    app.add_template_global(cache_fragment)
+
     return app
 
 # Run the app
@@ -0,0 +1,118 @@
+"""
+Concurrency benchmark for the borrow/return path.
+
+Hundreds of users borrow the same book at once through the real /borrow and
+/return routes, then everyone who got a copy returns it at once. The run
+fails if a copy is oversold or a return is lost.
+
+    python benchmarks/borrow_concurrency.py --borrowers 300 --copies 25
+    python benchmarks/borrow_concurrency.py --database-url mysql+pymysql://...
+
+Without --database-url a throwaway SQLite file is used. Against an existing
+database the benchmark only adds its own users, book and loans, and removes
+them afterwards.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--borrowers", type=int, default=300, help="concurrent users borrowing the book")
+    parser.add_argument("--copies", type=int, default=25, help="copies of the book in stock")
+    parser.add_argument("--threads", type=int, default=64, help="worker threads issuing requests")
+    parser.add_argument("--database-url", help="database to run against (default: temporary SQLite file)")
+    return parser.parse_args()
+
+
+def run(args):
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "borrow_bench.db")
+
+    from app import create_app
+    from extensions import db
+    from models import User, Book, Borrowing
+
+    app = create_app()
+    app.config.update(WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.metadata.create_all(db.engine, tables=[User.__table__, Book.__table__, Borrowing.__table__])
+        run_tag = f"bench{int(time.time())}"
+        users = [
+            User(username=f"{run_tag}_{i}", email=f"{run_tag}_{i}@bench.local", password_hash="!", role="user")
+            for i in range(args.borrowers)
+        ]
+        book = Book(title=f"Benchmark book {run_tag}", author="Bench", total_copies=args.copies, available_copies=args.copies)
+        db.session.add_all(users + [book])
+        db.session.commit()
+        user_ids, book_id = [u.id for u in users], book.id
+        backend = db.engine.url.get_backend_name()
+
+    def request_as(user_id, path):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"], sess["role"] = user_id, "user"
+        started = time.perf_counter()
+        status = client.get(path).status_code
+        return status, time.perf_counter() - started
+
+    def phase(paths):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(lambda up: request_as(*up), paths))
+        elapsed = time.perf_counter() - started
+        errors = sum(1 for status, _ in results if status >= 500)
+        latencies = sorted(latency for _, latency in results)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        return elapsed, errors, p95
+
+    borrow_time, borrow_errors, borrow_p95 = phase([(uid, f"/borrow/{book_id}") for uid in user_ids])
+
+    with app.app_context():
+        loans = Borrowing.query.filter_by(book_id=book_id).all()
+        available_after_borrow = db.session.get(Book, book_id).available_copies
+        loan_ids = [(loan.user_id, loan.id) for loan in loans]
+
+    # Every borrower returns twice, concurrently, to provoke double returns.
+    return_time, return_errors, return_p95 = phase([(uid, f"/return/{lid}") for uid, lid in loan_ids * 2])
+
+    with app.app_context():
+        available_after_return = db.session.get(Book, book_id).available_copies
+        returned = Borrowing.query.filter_by(book_id=book_id, is_returned=True).count()
+        Borrowing.query.filter_by(book_id=book_id).delete()
+        Book.query.filter_by(id=book_id).delete()
+        User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+    expected_loans = min(args.borrowers, args.copies)
+    print(f"database            {backend}")
+    print(f"borrowers/copies    {args.borrowers}/{args.copies} on {args.threads} threads")
+    print(f"borrow phase        {borrow_time:.2f}s  {args.borrowers / borrow_time:.0f} req/s  p95 {borrow_p95 * 1000:.1f} ms  5xx {borrow_errors}")
+    print(f"return phase        {return_time:.2f}s  {2 * len(loan_ids) / max(return_time, 1e-9):.0f} req/s  p95 {return_p95 * 1000:.1f} ms  5xx {return_errors}")
+    print(f"loans recorded      {len(loan_ids)} (expected {expected_loans})")
+    print(f"copies after borrow {available_after_borrow} (expected {args.copies - expected_loans})")
+    print(f"copies after return {available_after_return} (expected {args.copies}), loans returned {returned}")
+
+    ok = (
+        len(loan_ids) == expected_loans
+        and available_after_borrow == args.copies - expected_loans
+        and available_after_return == args.copies
+        and returned == expected_loans
+        and borrow_errors == return_errors == 0
+    )
+    print("PASS: no oversell, no lost updates" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
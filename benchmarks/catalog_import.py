@@ -0,0 +1,81 @@
+"""
+Throughput benchmark for `flask catalog import`.
+
+Generates a CSV of synthetic books (with a share of duplicate ISBNs and
+invalid rows) and imports it with catalog.import_catalog, reporting
+records per second.
+
+    python benchmarks/catalog_import.py --records 1000000
+    python benchmarks/catalog_import.py --database-url mysql+pymysql://... --batch-size 10000
+
+Without --database-url a throwaway SQLite file is used. Against an existing
+database the imported books are removed again afterwards.
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=200_000, help="rows in the generated file")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per INSERT and commit")
+    parser.add_argument("--database-url", help="database to run against (default: temporary SQLite file)")
+    return parser.parse_args()
+
+
+def write_csv(path, records, tag):
+    with open(path, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["title", "author", "isbn", "genre", "publication_year", "total_copies"])
+        for i in range(records):
+            if i % 1000 == 999:
+                writer.writerow(["", "Nobody", "", "", "", ""])  # invalid: no title
+                continue
+            isbn = f"{tag}{i % (records - records // 100):08d}"  # the last 1% repeat earlier ISBNs
+            writer.writerow([f"Benchmark book {i}", f"Author {i % 5000}", isbn, "Fiction", 1950 + i % 70, 1 + i % 3])
+
+
+def run(args):
+    workdir = tempfile.mkdtemp()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "import_bench.db")
+
+    from app import create_app
+    from extensions import db
+    from models import Book, User
+    from catalog import import_catalog
+
+    tag = f"B{int(time.time()) % 100000:05d}"
+    path = os.path.join(workdir, "books.csv")
+    started = time.perf_counter()
+    write_csv(path, args.records, tag)
+    print(f"Generated {args.records:,} records in {time.perf_counter() - started:.1f}s")
+
+    app = create_app()
+    with app.app_context():
+        db.metadata.create_all(db.engine, tables=[User.__table__, Book.__table__])
+        print(f"Importing into {db.engine.url.get_backend_name()} in batches of {args.batch_size:,}")
+        stats = import_catalog(
+            path, batch_size=args.batch_size,
+            progress=lambda s: print(f"\r  {s}", end="", flush=True),
+        )
+        print()
+        elapsed = stats.finished - stats.started
+        print(f"{stats.inserted:,} books in {elapsed:.1f}s; "
+              f"1M records would take about {1_000_000 / stats.rate / 60:.1f} minutes")
+        if args.database_url:
+            Book.query.filter(Book.isbn.like(f"{tag}%")).delete(synchronize_session=False)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    run(parse_args())
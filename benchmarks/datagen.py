@@ -0,0 +1,263 @@
+"""
+Deterministic synthetic data for load testing.
+
+Fills an empty database with users, books, borrowings and reviews shaped
+like a busy library: a few books and readers account for most loans, most
+loans are returned, recent ones are still out, and ratings lean positive.
+The same --seed and counts always produce the same rows, with dates
+relative to the time of the run.
+
+    python benchmarks/datagen.py                                  # 1% scale into ./synthetic.db
+    python benchmarks/datagen.py --scale 1 --database-url mysql+pymysql://...
+
+--scale 1 is 100k users, 1M books, 10M borrowings and 1M reviews; any count
+can also be set on its own. Rows go in with multi-row INSERTs and a commit
+per batch; memory grows only by a few bytes per book and user. Every account
+has the password "synthetic". The target database must be empty.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FULL_SCALE = {"users": 100_000, "books": 1_000_000, "borrowings": 10_000_000, "reviews": 1_000_000}
+PASSWORD = "synthetic"
+
+CATEGORIES = [
+    "Adventure", "Classic", "Fantasy", "Historical Fiction", "Horror", "Mystery", "Romance", "Science Fiction",
+    "Thriller", "Biography", "Business", "Computer Science", "Education", "Health", "History", "Law", "Politics",
+    "Psychology", "Science", "Self-Help", "Technology", "Travel",
+]
+GENRES = ["Young Adult", "Dystopian", "Literary", "Short Stories", "Poetry", "Textbook", "Reference", "Memoir",
+          "Graphic Novel", "Anthology", "Essays", "Handbook"]
+BOOK_TYPES = (["Physical"] * 7) + (["E-Book"] * 3)
+STAR_WEIGHTS = [5, 7, 15, 35, 38]  # share of 1..5 star ratings
+TITLE_WORDS = (
+    "shadow river empire garden silent winter glass city secret last night house stone code fire light ocean "
+    "journey machine history theory practice guide modern ancient lost hidden broken golden iron paper world "
+    "memory star kingdom forest song letter island road mind data law design market health science"
+).split()
+FIRST_NAMES = ("Aarav Ananya Rohan Priya Vikram Sara Arjun Meera Kabir Isha John Emily Robert Maria David Laura "
+               "Ahmed Fatima Chen Yuki Omar Leila Ivan Nadia").split()
+LAST_NAMES = ("Sharma Gupta Iyer Banerjee Khan Reddy Das Mehta Smith Johnson Williams Brown Garcia Müller Rossi "
+              "Tanaka Kim Novak Haddad Silva Okafor Petrov").split()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=float, default=0.01, help="fraction of the full-size dataset")
+    for name, full in FULL_SCALE.items():
+        parser.add_argument(f"--{name}", type=int, help=f"{name} to create (default: {full:,} x scale)")
+    parser.add_argument("--days", type=int, default=730, help="history covered by the loans")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="rows per INSERT and commit")
+    parser.add_argument("--database-url", help="database to fill (default: ./synthetic.db)")
+    return parser.parse_args()
+
+
+def counts_for(args):
+    return {name: getattr(args, name) if getattr(args, name) is not None else max(int(full * args.scale), 1)
+            for name, full in FULL_SCALE.items()}
+
+
+def _isbn13(number):
+    digits = f"979{number:09d}"
+    check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return digits + str(check)
+
+
+def _skewed(rng, n, power):
+    """An index in [0, n) where low indices are much likelier: ``power`` 1 is uniform."""
+    return min(int(n * rng.random() ** power), n - 1)
+
+
+class _Writer:
+    """Buffers rows for one table and writes them a batch at a time."""
+
+    def __init__(self, db, table, batch_size, label):
+        from sqlalchemy import insert
+        self.db, self.statement, self.batch_size, self.label = db, insert(table), batch_size, label
+        self.rows, self.written, self.started = [], 0, time.perf_counter()
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.db.session.execute(self.statement, self.rows)
+            self.db.session.commit()
+            self.written += len(self.rows)
+            self.rows = []
+            rate = self.written / max(time.perf_counter() - self.started, 1e-9)
+            print(f"\r  {self.label}: {self.written:,} ({rate:,.0f}/s)", end="", flush=True)
+
+    def close(self):
+        self.flush()
+        print()
+        return self.written
+
+
+def generate(db, counts, seed=1, days=730, batch_size=10_000, now=None):
+    """
+    Insert ``counts`` users, books, borrowings and reviews into empty tables,
+    then bring the derived columns (available copies, borrow and rating
+    counters, daily stats, trending scores, the search index) in line with them.
+    Returns the number of rows written per table.
+    """
+    from werkzeug.security import generate_password_hash
+    from models import Book, Borrowing, Review, User
+    from ratings import rebuild_rating_aggregates
+    from search import catalog_search
+    from stats import rebuild_borrow_counts, rollup
+    from inventory import LOAN_PERIOD
+    from popularity import rebuild_popularity
+
+    if db.session.query(User.id).first() is not None:
+        raise SystemExit("The users table isn't empty; datagen only fills an empty database.")
+    now = now or datetime.utcnow().replace(microsecond=0)
+    n_users, n_books = counts["users"], counts["books"]
+    written = {}
+
+    # ---- users: id 1 is the admin, 1% are publishers, sign-ups grow over time
+    rng = random.Random(f"{seed}:users")
+    password_hash = generate_password_hash(PASSWORD)
+    span = days + 365
+    user_created = array("d")  # seconds before ``now``; keeps loans after sign-up
+    publishers = []
+    writer = _Writer(db, User.__table__, batch_size, "users")
+    for user_id in range(1, n_users + 1):
+        if user_id == 1:
+            role, username = "admin", "admin"
+        elif user_id % 100 == 2:
+            role, username = "publisher", f"publisher{user_id}"
+            publishers.append(user_id)
+        else:
+            role, username = "user", f"reader{user_id}"
+        age = span * 86400 * (1 - rng.random() ** 0.5)
+        user_created.append(age)
+        writer.add(dict(
+            id=user_id, username=username, email=f"{username}@synthetic.local", password_hash=password_hash,
+            role=role, is_active=rng.random() > 0.02, created_at=now - timedelta(seconds=age),
+        ))
+    written["users"] = writer.close()
+    publishers = publishers or [1]
+
+    # ---- books: prolific authors and publishers, mostly recent editions
+    rng = random.Random(f"{seed}:books")
+    copies = bytearray(n_books + 1)
+    n_authors = max(n_books // 8, 1)
+    writer = _Writer(db, Book.__table__, batch_size, "books")
+    for book_id in range(1, n_books + 1):
+        author = _skewed(rng, n_authors, 2)
+        copies[book_id] = 1 + _skewed(rng, 5, 2)
+        words = rng.sample(TITLE_WORDS, rng.randint(2, 4))
+        writer.add(dict(
+            id=book_id, title=" ".join(words).title() + f" {book_id}",
+            author=f"{FIRST_NAMES[author % len(FIRST_NAMES)]} {LAST_NAMES[author // len(FIRST_NAMES) % len(LAST_NAMES)]}"
+                   f" {author}",
+            isbn=_isbn13(book_id), description=f"A book about {', '.join(rng.sample(TITLE_WORDS, 5))}.",
+            category=CATEGORIES[_skewed(rng, len(CATEGORIES), 1.5)], genre=rng.choice(GENRES),
+            book_type=rng.choice(BOOK_TYPES), publisher_id=publishers[_skewed(rng, len(publishers), 2)],
+            publication_year=2025 - _skewed(rng, 75, 2.5), total_copies=copies[book_id],
+            available_copies=copies[book_id], created_at=now - timedelta(seconds=rng.random() * span * 86400),
+        ))
+    written["books"] = writer.close()
+
+    # ---- borrowings and reviews: heavy readers, popular books, a user borrows a book at most once
+    rng = random.Random(f"{seed}:loans")
+    weights = [rng.paretovariate(1.5) for _ in range(n_users)]
+    per_weight = counts["borrowings"] / sum(weights)
+    cap = max(n_books // 2, 1)
+    open_loans = bytearray(n_books + 1)
+    review_chance = min(counts["reviews"] / max(counts["borrowings"], 1), 1.0)  # reviews are of books borrowed
+    loans = _Writer(db, Borrowing.__table__, batch_size, "borrowings")
+    reviews = _Writer(db, Review.__table__, batch_size, "reviews")
+    share, assigned, loan_id = 0.0, 0, 0
+    for user_id in range(1, n_users + 1):
+        share += weights[user_id - 1] * per_weight
+        wanted = min(round(share) - assigned, cap)
+        assigned += wanted
+        joined = user_created[user_id - 1]
+        seen = set()
+        while len(seen) < wanted:
+            book_id = 1 + _skewed(rng, n_books, 3)
+            if book_id in seen:
+                continue
+            seen.add(book_id)
+            borrowed = now - timedelta(seconds=rng.random() * min(joined, days * 86400))
+            age_days = (now - borrowed).days
+            still_out = rng.random() < (0.7 if age_days < 14 else 0.3 if age_days < 30 else 0.01)
+            if still_out and open_loans[book_id] >= copies[book_id]:
+                still_out = False  # every copy is already out
+            returned = None
+            if still_out:
+                open_loans[book_id] += 1
+            else:
+                returned = min(borrowed + timedelta(days=rng.randint(1, 20), seconds=rng.randint(0, 86399)), now)
+            loan_id += 1
+            loans.add(dict(
+                id=loan_id, user_id=user_id, book_id=book_id, borrowed_date=borrowed,
+                due_date=borrowed + LOAN_PERIOD, returned_date=returned, is_returned=not still_out,
+                open_loan=True if still_out else None,
+            ))
+            if rng.random() < review_chance:
+                rating = rng.choices(range(1, 6), STAR_WEIGHTS)[0]
+                reviews.add(dict(
+                    user_id=user_id, book_id=book_id, rating=rating,
+                    content=f"{rating} stars: {' '.join(rng.sample(TITLE_WORDS, 6))}.",
+                    created_at=min(borrowed + timedelta(hours=rng.randint(1, 480)), now),
+                ))
+    written["borrowings"] = loans.close()
+    written["reviews"] = reviews.close()
+
+    # ---- derived columns, rebuilt by the app's own repair jobs where it has them
+    started = time.perf_counter()
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(db.text("ANALYZE"))  # without statistics SQLite picks poor plans for the updates below
+        db.session.commit()
+    books, borrowings = Book.__table__, Borrowing.__table__
+    out_now = (
+        db.select(db.func.count())
+        .where(borrowings.c.book_id == books.c.id, borrowings.c.is_returned.is_(False))
+        .scalar_subquery()
+    )
+    db.session.execute(books.update().values(available_copies=books.c.total_copies - out_now))
+    db.session.commit()
+    rebuild_borrow_counts()
+    rebuild_rating_aggregates()
+    db.session.commit()
+    rollup(days=days, today=now.date())
+    rebuild_popularity(now=now)
+    catalog_search.rebuild()
+    db.session.commit()
+    print(f"  counters, daily stats, trending scores and search index rebuilt in {time.perf_counter() - started:.1f}s")
+    return written
+
+
+def run(args):
+    os.environ["DATABASE_URL"] = args.database_url or "sqlite:///" + os.path.abspath("synthetic.db")
+
+    from app import create_app
+    from extensions import db
+
+    counts = counts_for(args)
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        print(f"Generating into {db.engine.url.get_backend_name()}: "
+              + ", ".join(f"{n:,} {name}" for name, n in counts.items()))
+        started = time.perf_counter()
+        written = generate(db, counts, seed=args.seed, days=args.days, batch_size=args.batch_size)
+        print(f"{sum(written.values()):,} rows in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,105 @@
+"""
+Benchmark for PDF delivery: how long a request keeps an app worker busy.
+
+For each PDF_DELIVERY mode it times a full download, a repeat view that
+revalidates with If-None-Match / If-Modified-Since, and a 1 MB range request
+like the ones in-browser viewers make. The time is measured from dispatch
+until the worker has produced the last byte of the body. The test client
+reads at memory speed, so the last column also estimates occupancy for a
+reader on a --client-mbps link, where a direct download holds the worker
+for the whole transfer. With the offload modes, nginx or Apache streams
+the file outside the worker.
+
+    python benchmarks/pdf_delivery.py --size-mb 50 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=50, help="size of the generated PDF")
+    parser.add_argument("--repeat", type=int, default=5, help="requests per scenario")
+    parser.add_argument("--client-mbps", type=float, default=20.0, help="reader bandwidth for the estimate column")
+    return parser.parse_args()
+
+
+def occupancy(client, path, headers=None):
+    """Seconds until the response body is exhausted, plus status and body size."""
+    started = time.perf_counter()
+    response = client.get(path, headers=headers or {})
+    size = len(response.get_data())
+    return time.perf_counter() - started, response, size
+
+
+def run(args):
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "pdf_bench.db")
+
+    from app import create_app
+    from extensions import db
+    from models import User, Book
+
+    from storage import upload_storage
+
+    app = create_app()
+    app.config["BOOK_PDF_FOLDER"] = workdir
+    upload_storage.init_app(app)
+    source = os.path.join(workdir, "benchmark.pdf")
+    with open(source, "wb") as fh:
+        fh.write(b"%PDF-1.7\n")
+        fh.write(os.urandom(args.size_mb * 1024 * 1024))
+
+    with app.app_context():
+        with open(source, "rb") as fh:
+            pdf_name, _ = upload_storage.pdfs.save(fh, "pdf")
+        db.metadata.create_all(db.engine, tables=[User.__table__, Book.__table__])
+        reader = User(username="bench_reader", email="reader@bench.local", password_hash="!", role="user")
+        book = Book(title="Benchmark", author="Bench", pdf_file=pdf_name)
+        db.session.add_all([reader, book])
+        db.session.commit()
+        user_id, book_id = reader.id, book.id
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"], sess["role"] = user_id, "user"
+    url = f"/download/book/{book_id}?view=true"
+
+    print(f"PDF size {args.size_mb} MB, {args.repeat} requests per scenario (median worker time)\n")
+    link_label = f"@{args.client_mbps:g} Mbit/s"
+    print(f"{'mode':<12}{'scenario':<22}{'status':>7}{'body bytes':>14}{'worker ms':>12}{link_label:>16}")
+    for mode in ("direct", "x-sendfile", "x-accel"):
+        app.config["PDF_DELIVERY"] = mode
+        _, first, _ = occupancy(client, url)
+        validators = {}
+        if first.headers.get("ETag"):
+            validators["If-None-Match"] = first.headers["ETag"]
+        if first.headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = first.headers["Last-Modified"]
+        scenarios = [
+            ("full view", {}),
+            ("repeat view (304)", validators),
+            ("1 MB range", {"Range": "bytes=0-1048575"}),
+        ]
+        for name, headers in scenarios:
+            timings = []
+            for _ in range(args.repeat):
+                elapsed, response, size = occupancy(client, url, headers)
+                timings.append(elapsed)
+            worker_ms = statistics.median(timings) * 1000
+            over_link_ms = worker_ms + size * 8 / (args.client_mbps * 1e6) * 1000
+            print(f"{mode:<12}{name:<22}{response.status_code:>7}{size:>14,}{worker_ms:>12.2f}{over_link_ms:>16.1f}")
+    print("\nx-sendfile/x-accel responses carry no body: the front-end server streams the file,")
+    print("answering ranges and revalidation itself, while the worker is already free.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,240 @@
+"""
+Query-plan regression check for the page routes.
+
+Seeds a database, requests every read-only page as the right kind of user,
+captures each SELECT the route issues and runs EXPLAIN on it. Exits with
+status 1 if any query reads a whole table (beyond --min-rows rows) instead
+of using an index, so an index regression fails CI before it ships.
+
+    python benchmarks/query_plans.py
+    python benchmarks/query_plans.py --database-url mysql+pymysql://... --verbose
+
+Without --database-url a throwaway SQLite file is used. Against MySQL, point
+it at an empty scratch database: it creates the tables and seeds them.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CATEGORIES = ["Law", "Design", "Education", "Health Sciences", "Management & Commerce", "General"]
+GENRES = [f"Genre {i}" for i in range(20)]
+BOOK_TYPES = ["Physical", "E-Book", "Audio"]
+ADMIN_ID, PUBLISHER_ID, READER_ID = 1, 2, 3
+
+# (label, role, path[, {table: why a scan is acceptable there}[, app config for this case]]);
+# {book}, {cursor} and {title} are filled in after seeding
+CASES = [
+    ("catalog", "user", "/"),
+    ("catalog next page", "user", "/?after={cursor}"),
+    ("catalog by category", "user", "/?category=Law"),
+    ("catalog by genre", "user", "/?genre=Genre+3"),
+    ("catalog by type", "user", "/?book_type=E-Book"),
+    ("catalog by category and genre", "user", "/?category=Law&genre=Genre+3"),
+    ("catalog available only", "user", "/?status=available", {
+        "books": "most books have a copy in, so no index narrows this; the count stops at CATALOG_COUNT_LIMIT rows",
+    }),
+    ("catalog offset pages", "user", "/?page=3", {}, {"CATALOG_PAGINATION": "offset"}),
+    ("catalog most borrowed", "user", "/?sort=most_borrowed"),
+    ("catalog most borrowed by category", "user", "/?sort=most_borrowed&category=Law"),
+    ("catalog trending", "user", "/?sort=trending", {
+        "book_popularity": "all top lists are ranked in one pass over the rollup, once per flush interval",
+    }),
+    ("catalog trending by category", "user", "/?sort=trending&category=Law&status=available"),
+    ("catalog search", "user", "/?search={title}"),
+    ("book detail", "user", "/book/{book}"),
+    ("own borrowing history", "user", "/borrowing-history"),
+    ("own overdue loans", "user", "/borrowing-history?status=overdue"),
+    ("publisher dashboard", "publisher", "/publisher/dashboard"),
+    ("publisher dashboard by borrows", "publisher", "/publisher/dashboard?sort=borrows"),
+    ("publisher dashboard page 3", "publisher", "/publisher/dashboard?page=3"),
+    ("admin dashboard", "admin", "/admin/dashboard"),
+    ("admin borrowing history", "admin", "/borrowing-history"),
+    ("admin history by user", "admin", "/borrowing-history?user=reader"),
+    ("admin history by book", "admin", "/borrowing-history?book={book}"),
+    ("admin history by title", "admin", "/borrowing-history?book=Book+1"),
+    ("admin history date range", "admin", "/borrowing-history?from=2024-01-01&to=2024-02-01"),
+    ("admin overdue report", "admin", "/admin/overdue"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=5000, help="books to seed")
+    parser.add_argument("--borrowings", type=int, default=20000, help="loans to seed")
+    parser.add_argument("--min-rows", type=int, default=100, help="tables smaller than this may be scanned")
+    parser.add_argument("--database-url", help="database to run against (default: temporary SQLite file)")
+    parser.add_argument("--verbose", action="store_true", help="print every captured query and its plan")
+    return parser.parse_args()
+
+
+def seed(db, args):
+    from sqlalchemy import insert
+    from models import Book, Borrowing, Review, User
+    rng = random.Random(17)
+    now = datetime.utcnow()
+    users = [
+        dict(username="admin", email="admin@plans.local", password_hash="!", role="admin"),
+        dict(username="publisher", email="publisher@plans.local", password_hash="!", role="publisher"),
+        dict(username="reader", email="reader@plans.local", password_hash="!", role="user"),
+    ] + [
+        dict(username=f"user{i}", email=f"user{i}@plans.local", password_hash="!",
+             role="publisher" if i % 25 == 0 else "user", created_at=now - timedelta(days=rng.randint(0, 900)))
+        for i in range(500)
+    ]
+    db.session.execute(insert(User.__table__), users)
+    db.session.execute(insert(Book.__table__), [
+        dict(title=f"Book {i}", author=f"Author {i % 700}", isbn=f"PLAN{i:08d}", description="",
+             category=rng.choice(CATEGORIES), genre=rng.choice(GENRES), book_type=rng.choice(BOOK_TYPES),
+             publisher_id=PUBLISHER_ID if i % 4 == 0 else rng.randint(4, 500), publication_year=2000,
+             total_copies=3, available_copies=rng.randint(0, 3), borrow_count=rng.randint(0, 50),
+             created_at=now - timedelta(minutes=i))
+        for i in range(args.books)
+    ])
+    pairs = set()
+    while len(pairs) < args.borrowings:
+        pairs.add((READER_ID if len(pairs) % 50 == 0 else rng.randint(4, len(users)), rng.randint(1, args.books)))
+    loans = []
+    for user_id, book_id in pairs:
+        borrowed = datetime(2024, 1, 1) + timedelta(hours=rng.randint(0, 24 * 700))
+        returned = rng.random() < 0.8
+        loans.append(dict(user_id=user_id, book_id=book_id, borrowed_date=borrowed, due_date=borrowed + timedelta(days=14),
+                          is_returned=returned, returned_date=borrowed + timedelta(days=7) if returned else None,
+                          open_loan=None if returned else True))
+    db.session.execute(insert(Borrowing.__table__), loans)
+    db.session.execute(insert(Review.__table__), [
+        dict(user_id=rng.randint(4, len(users)), book_id=rng.randint(1, 50), rating=rng.randint(1, 5), content="ok")
+        for _ in range(2000)
+    ])
+    db.session.commit()
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(db.text("ANALYZE"))  # give the planner real statistics, as production would have
+        db.session.commit()
+
+
+class QueryCapture:
+    """Collects the SELECT statements sent while it is active."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.queries, self.active = [], False
+        event.listen(engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and not executemany and statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            self.queries.append((statement, parameters))
+
+
+def _base_table(name, tables):
+    # SQLAlchemy aliases joined tables as e.g. "users_1"
+    if name in tables:
+        return name
+    stripped = re.sub(r"_\d+$", "", name)
+    return stripped if stripped in tables else None
+
+
+def full_scans(connection, statement, parameters, large_tables):
+    """``(tables read in full, plan lines)`` for one statement."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        lines = [row[3] for row in plan]
+        scanned = []
+        for line in lines:
+            match = re.match(r"SCAN (\w+)(?: AS (\w+))?$", line)
+            if match and _base_table(match.group(1), large_tables):
+                scanned.append(_base_table(match.group(1), large_tables))
+        return scanned, lines
+    plan = connection.exec_driver_sql("EXPLAIN " + statement, parameters).mappings().all()
+    lines = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {row.get('Extra') or ''}"
+             for row in plan]
+    scanned = [_base_table(row["table"] or "", large_tables) for row in plan
+               if row["type"] == "ALL" and _base_table(row["table"] or "", large_tables)]
+    return scanned, lines
+
+
+def max_borrowed_date(db):
+    from models import Borrowing
+    return db.session.query(db.func.max(Borrowing.borrowed_date)).scalar()
+
+
+def run(args):
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "query_plans.db")
+
+    from app import create_app
+    from extensions import db
+    from models import Book
+    from pagination import encode_cursor
+    from popularity import rebuild_popularity
+    from search import catalog_search
+
+    app = create_app()
+    # The typeahead index is built by reading every book once per worker (suggest.py), on
+    # the first request; that scan is by design, so don't let it land in a route's queries
+    app.config.update(WTF_CSRF_ENABLED=False, SUGGEST_PRELOAD=False)
+    with app.app_context():
+        db.create_all()
+        seed(db, args)
+        catalog_search.rebuild()  # built once at deploy time, not by a route
+        db.session.commit()
+        rebuild_popularity(now=max_borrowed_date(db))
+        large_tables = {
+            table.name for table in db.metadata.sorted_tables
+            if db.session.execute(db.select(db.func.count()).select_from(table)).scalar() >= args.min_rows
+        }
+        newest = Book.query.order_by(Book.created_at.desc(), Book.id.desc()).offset(8).first()
+        values = {"book": 7, "title": "Book+42", "cursor": encode_cursor([newest.created_at, newest.id])}
+        capture = QueryCapture(db.engine)
+
+    # Requests run outside that app context, so each gets its own (and its own flask.g)
+    client = app.test_client()
+    user_ids = {"admin": ADMIN_ID, "publisher": PUBLISHER_ID, "user": READER_ID}
+    failures, seen = 0, set()
+    for label, role, path, *extra in CASES:
+        allowed, overrides = (list(extra) + [{}, {}])[:2]
+        with client.session_transaction() as sess:
+            sess["user_id"], sess["role"] = user_ids[role], role
+        saved = {name: app.config[name] for name in overrides}
+        app.config.update(overrides)
+        capture.queries, capture.active = [], True
+        try:
+            status = client.get(path.format(**values)).status_code
+        finally:
+            capture.active = False
+            app.config.update(saved)
+
+        problems = []
+        with app.app_context(), db.engine.connect() as connection:
+            for statement, parameters in capture.queries:
+                scanned, lines = full_scans(connection, statement, parameters, large_tables)
+                if args.verbose and statement not in seen:
+                    print(f"  {' '.join(statement.split())[:160]}")
+                    for line in lines:
+                        print(f"      {line}")
+                seen.add(statement)
+                scanned = [table for table in scanned if table not in allowed]
+                if scanned:
+                    problems.append((statement, scanned, lines))
+        ok = status < 400 and not problems
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {label:<34} HTTP {status}  {len(capture.queries):>2} queries")
+        for statement, scanned, lines in problems:
+            print(f"       full scan of {', '.join(sorted(set(scanned)))}: {' '.join(statement.split())[:200]}")
+            for line in lines:
+                print(f"         {line}")
+
+    print(f"\n{len(CASES) - failures} of {len(CASES)} routes use indexes for every query.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
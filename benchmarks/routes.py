@@ -0,0 +1,210 @@
+"""
+Latency and throughput benchmark for the page routes.
+
+Drives each read-only route of the main blueprint through the Flask test
+client from several threads at once, as the kind of user that would open
+it, and reports requests per second and p50/p95/p99 latency per route.
+
+    python benchmarks/routes.py --output before.json
+    python benchmarks/routes.py --output after.json --compare before.json
+    python benchmarks/routes.py --database-url sqlite:///synthetic.db --concurrency 16
+
+Without --database-url a throwaway SQLite file is filled by datagen.py at
+--scale. An empty database given with --database-url is filled the same
+way; one that already has data (e.g. from datagen.py) is used as it is.
+--output writes the results as JSON (with the commit and dataset sizes) so
+runs on different commits can be compared with --compare.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# (label, role or None for anonymous, path[, app config for this route]); placeholders are filled from the data.
+# Left out: GET routes that change data (/borrow, /return), need stored files
+# (/download) or stream whole tables (/admin/export), /admin/metrics, and
+# /admin/manage-users, whose template defines its blocks twice and fails to render.
+ROUTES = [
+    ("catalog", "user", "/"),
+    ("catalog offset page 5", "user", "/?page=5", {"CATALOG_PAGINATION": "offset"}),
+    ("catalog by category", "user", "/?category={category}"),
+    ("catalog trending", "user", "/?sort=trending"),
+    ("catalog trending by category", "user", "/?sort=trending&category={category}"),
+    ("catalog most borrowed", "user", "/?sort=most_borrowed"),
+    ("catalog most borrowed by cat", "user", "/?sort=most_borrowed&category={category}"),
+    ("catalog search", "user", "/?search={word}"),
+    ("book detail", "user", "/book/{book}"),
+    ("borrowing history", "user", "/borrowing-history"),
+    ("login form", None, "/login"),
+    ("register form", None, "/register"),
+    ("publisher dashboard", "publisher", "/publisher/dashboard"),
+    ("add book form", "publisher", "/add-book"),
+    ("edit book form", "publisher", "/edit-book/{own_book}"),
+    ("admin dashboard", "admin", "/admin/dashboard"),
+    ("all borrowing history", "admin", "/borrowing-history"),
+    ("overdue report", "admin", "/admin/overdue"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests per route first")
+    parser.add_argument("--concurrency", type=int, default=8, help="threads issuing requests")
+    parser.add_argument("--scale", type=float, default=0.01, help="dataset size when generating (see datagen.py)")
+    parser.add_argument("--only", help="run only routes whose label contains this")
+    parser.add_argument("--database-url", help="database to run against (default: temporary SQLite file)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    return parser.parse_args()
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)] if ordered else 0.0
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pick_subjects(db):
+    """The users, book and search terms the routes are requested with."""
+    from models import Book, Borrowing, User
+    first = {role: db.session.query(User.id).filter_by(role=role).order_by(User.id).limit(1).scalar()
+             for role in ("admin", "publisher")}
+    reader = db.session.query(Borrowing.user_id).order_by(Borrowing.id.desc()).limit(1).scalar()
+    book = db.session.query(Book).order_by(Book.borrow_count.desc()).limit(1).first()
+    own_book = db.session.query(Book.id).filter_by(publisher_id=first["publisher"]).limit(1).scalar()
+    return {
+        "users": {"admin": first["admin"], "publisher": first["publisher"], "user": reader},
+        "values": {"book": book.id, "own_book": own_book, "category": book.category,
+                   "word": book.title.split()[0]},
+    }
+
+
+def dataset_size(db):
+    from models import Book, Borrowing, Review, User
+    return {model.__tablename__: db.session.query(db.func.count(model.id)).scalar()
+            for model in (User, Book, Borrowing, Review)}
+
+
+def bench_route(app, role, user_id, path, args):
+    local = threading.local()
+
+    def get(_):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+            if role is not None:
+                with client.session_transaction() as sess:
+                    sess["user_id"], sess["role"] = user_id, role
+        started = time.perf_counter()
+        status = client.get(path).status_code
+        return status, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(get, range(args.warmup)))
+        started = time.perf_counter()
+        results = list(pool.map(get, range(args.requests)))
+        elapsed = time.perf_counter() - started
+    latencies = sorted(latency for _, latency in results)
+    return {
+        "path": path,
+        "requests": len(results),
+        "errors": sum(1 for status, _ in results if status >= 400),
+        "status": sorted({status for status, _ in results}),
+        "rps": round(len(results) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)},
+    }
+
+
+def print_comparison(results, baseline):
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} ({baseline['timestamp']}):")
+    print(f"{'route':<26} {'req/s was, change':>17} {'p95 ms was, change':>19}")
+    for label, now in results["routes"].items():
+        before = baseline["routes"].get(label)
+        if before is None:
+            continue
+        rps_change = (now["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0
+        p95_change = (now["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0
+        print(f"{label:<26} {before['rps']:>8.0f} {rps_change:>+7.1f}%  {before['p95_ms']:>9.1f} {p95_change:>+7.1f}%")
+
+
+def run(args):
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "routes_bench.db")
+
+    from app import create_app
+    from extensions import db
+    from models import User
+    import datagen
+
+    logging.getLogger("metrics").setLevel(logging.ERROR)  # the slow-request log would drown the report
+    app = create_app()
+    app.config.update(WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        if db.session.query(User.id).first() is None:
+            counts = {name: max(int(full * args.scale), 1) for name, full in datagen.FULL_SCALE.items()}
+            print("Generating data: " + ", ".join(f"{n:,} {name}" for name, n in counts.items()))
+            datagen.generate(db, counts)
+        subjects = pick_subjects(db)
+        results = {
+            "commit": _commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "database": db.engine.url.get_backend_name(),
+            "python": platform.python_version(),
+            "dataset": dataset_size(db),
+            "concurrency": args.concurrency,
+            "routes": {},
+        }
+
+    print(f"\n{results['database']}, " + ", ".join(f"{n:,} {t}" for t, n in results["dataset"].items())
+          + f"; {args.requests} requests per route on {args.concurrency} threads")
+    print(f"{'route':<26} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for label, role, path, *overrides in ROUTES:
+        if args.only and args.only not in label:
+            continue
+        user_id = subjects["users"].get(role)
+        overrides = overrides[0] if overrides else {}
+        saved = {name: app.config[name] for name in overrides}
+        app.config.update(overrides)
+        try:
+            stats = bench_route(app, role, user_id, path.format(**subjects["values"]), args)
+        finally:
+            app.config.update(saved)
+        results["routes"][label] = stats
+        print(f"{label:<26} {stats['rps']:>8.0f} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+              f"{stats['p99_ms']:>8.1f} {stats['errors']:>7}")
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        with open(args.compare) as fh:
+            print_comparison(results, json.load(fh))
+    return 1 if any(stats["errors"] for stats in results["routes"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,138 @@
+"""
+Memory and per-keystroke latency of the search box typeahead (suggest.py).
+
+Builds the title and author prefix indexes from the books table, then types
+a sample of real titles and authors one character at a time, timing each
+completion lookup: first with nothing remembered, then again, then with a
+full overlay of recently edited books, and finally end to end through
+/api/suggest with the Flask test client.
+
+    python benchmarks/suggest.py                        # 1M books in a throwaway SQLite file
+    python benchmarks/suggest.py --database-url sqlite:///synthetic.db
+
+Without --database-url, or with an empty database, the books are made by
+datagen.py (--books of them, with as many borrowings); a database that
+already has books is used as it is.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=1_000_000, help="books to generate into an empty database")
+    parser.add_argument("--samples", type=int, default=2000, help="titles and authors typed per round")
+    parser.add_argument("--max-chars", type=int, default=15, help="characters typed of each")
+    parser.add_argument("--requests", type=int, default=2000, help="keystrokes sent through /api/suggest")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the sample")
+    parser.add_argument("--database-url", help="database to run against (default: temporary SQLite file)")
+    return parser.parse_args()
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)] if ordered else 0.0
+
+
+def report(label, timings):
+    ordered = sorted(timings)
+    print(f"{label:<34} {len(ordered):>8,} {percentile(ordered, 50) * 1000:>8.3f} {percentile(ordered, 95) * 1000:>8.3f}"
+          f" {percentile(ordered, 99) * 1000:>8.3f} {ordered[-1] * 1000 if ordered else 0:>8.3f}")
+
+
+def keystrokes(words, max_chars):
+    """Every prefix of every word, as typed."""
+    return [word[:n] for word in words for n in range(1, min(len(word), max_chars) + 1)]
+
+
+def time_lookups(suggestions, prefixes):
+    timings = []
+    for prefix in prefixes:
+        started = time.perf_counter()
+        suggestions.suggest(prefix)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run(args):
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "suggest_bench.db")
+
+    from app import create_app
+    from extensions import db
+    from models import Book
+    from suggest import suggestions
+    import datagen
+
+    app = create_app()
+    app.config.update(SUGGEST_PRELOAD=False, SUGGEST_REFRESH_SECONDS=10 ** 9)
+    with app.app_context():
+        db.create_all()
+        if db.session.query(Book.id).first() is None:
+            counts = {"users": 1000, "books": args.books, "borrowings": args.books, "reviews": 1000}
+            print("Generating data: " + ", ".join(f"{n:,} {name}" for name, n in counts.items()))
+            datagen.generate(db, counts)
+
+        started = time.perf_counter()
+        suggestions.rebuild()
+        build_seconds = time.perf_counter() - started
+        stats = suggestions.stats()
+        # Again under tracemalloc (slower) for the memory the index keeps and the build's peak
+        tracemalloc.start()
+        suggestions.rebuild()
+        kept, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"\n{db.engine.url.get_backend_name()}: {stats['titles']:,} titles, {stats['authors']:,} authors")
+        print(f"built in {build_seconds:.1f}s; index {stats['bytes'] / 2 ** 20:.1f} MiB "
+              f"({stats['bytes'] / max(stats['titles'] + stats['authors'], 1):.0f} bytes an entry), "
+              f"{kept / 2 ** 20:.1f} MiB allocated after the build, {peak / 2 ** 20:.1f} MiB at its peak")
+
+        rng = random.Random(args.seed)
+        ids = rng.sample(range(1, db.session.query(db.func.max(Book.id)).scalar() + 1), args.samples)
+        sample = db.session.query(Book.title, Book.author).filter(Book.id.in_(ids)).all()
+        words = [title for title, _ in sample] + [author for _, author in sample]
+        rng.shuffle(words)
+        prefixes = keystrokes(words, args.max_chars)
+
+        print(f"\n{'lookup':<34} {'count':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        report("first time", time_lookups(suggestions, prefixes))
+        warm = time_lookups(suggestions, prefixes)
+        report("again", warm)
+        for low, high in ((1, 2), (3, 5), (6, args.max_chars)):
+            report(f"  {low}-{high} characters",
+                   [t for prefix, t in zip(prefixes, warm) if low <= len(prefix) <= high])
+
+        # Edited books sit in the overlay, checked by a scan, until the next rebuild
+        overlay = app.config["SUGGEST_MAX_OVERLAY"]
+        for book_id, title, author in db.session.query(Book.id, Book.title, Book.author).limit(overlay):
+            suggestions.index_book(Book(id=book_id, title=title + " (revised)", author=author, borrow_count=0))
+        report(f"with {overlay:,} edited books", time_lookups(suggestions, prefixes))
+
+    client = app.test_client()
+    with app.app_context():
+        from models import User
+        user = User.query.first()
+    with client.session_transaction() as session:
+        session.update(user_id=user.id, role=user.role, username=user.username)
+    timings = []
+    for prefix in prefixes[:args.requests]:
+        started = time.perf_counter()
+        response = client.get("/api/suggest", query_string={"q": prefix})
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    report("GET /api/suggest", timings)
+
+
+if __name__ == "__main__":
+    run(parse_args())
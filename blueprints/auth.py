@@ -1,10 +1,30 @@
+from collections import namedtuple
 from functools import wraps
-from flask import session, redirect, url_for, flash
+from flask import session, redirect, url_for, flash, g, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from extensions import db
 from flask import Blueprint, render_template
+from cache import TTLCache
+from models import User
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+# What views and templates need to know about the logged-in user. It is cached
+# across requests, so it holds plain values rather than a session-bound User.
+Principal = namedtuple("Principal", "id username email role is_active")
+
+_MISSING_USER = object()
+
+@auth_bp.record_once
+def _init_principal_cache(state):
+    app = state.app
+    app.config.setdefault("USER_CACHE_TTL", 30)  # seconds; bounds staleness across workers
+    app.config.setdefault("USER_CACHE_SIZE", 10000)
+    app.extensions["principal_cache"] = TTLCache(
+        maxsize=app.config["USER_CACHE_SIZE"], ttl=app.config["USER_CACHE_TTL"]
+    )
+
 @auth_bp.route('/login')
 def login():
     # Your login logic
@@ -14,31 +34,80 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if "user_id" not in session:
             flash("You must be logged in to access this page.", "danger")
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
+        if get_current_user() is None:
+            # Deleted or deactivated since logging in
+            session.clear()
+            flash("Your session has expired. Please log in again.", "danger")
+            return redirect(url_for("main.login"))
         return f(*args, **kwargs)
     return decorated_function
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if session.get("role") != "admin":
+        user = get_current_user()
+        if user is None or user.role != "admin":
             flash("Admins only!", "danger")
-            return redirect(url_for("index"))  # Changed from "home" to "index"
+            return redirect(url_for("main.index"))  # Changed from "home" to "index"
         return f(*args, **kwargs)
     return decorated_function
 
 def publisher_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if session.get("role") != "publisher":
+        user = get_current_user()
+        if user is None or user.role != "publisher":
             flash("Publishers only!", "danger")
-            return redirect(url_for("index"))  # Changed from "home" to "index"
+            return redirect(url_for("main.index"))  # Changed from "home" to "index"
         return f(*args, **kwargs)
     return decorated_function
 
+def _load_principal(user_id):
+    cache = current_app.extensions["principal_cache"]
+    principal = cache.get(user_id)
+    if principal is None:
+        user = db.session.get(User, user_id)
+        principal = _MISSING_USER if user is None else Principal(
+            user.id, user.username, user.email, user.role, user.is_active is not False
+        )
+        cache.set(user_id, principal)
+    if principal is _MISSING_USER or not principal.is_active:
+        return None
+    return principal
+
 def get_current_user():
-    if "user_id" in session:
-        # Import here to avoid circular imports
-        from models import User
-        return User.query.get(session["user_id"])
-    return None
\ No newline at end of file
+    """
+    The logged-in user as a Principal, or None. Resolved once per request and
+    kept on flask.g; across requests it comes from a short-lived cache.
+    """
+    if "current_user" not in g:
+        user_id = session.get("user_id")
+        g.current_user = _load_principal(user_id) if user_id is not None else None
+    return g.current_user
+
+def invalidate_user(user_id):
+    """Drop a user's cached principal in this process, e.g. after a role change."""
+    if has_app_context() and "principal_cache" in current_app.extensions:
+        current_app.extensions["principal_cache"].delete(user_id)
+        if g.get("current_user") is not None and g.current_user.id == user_id:
+            g.pop("current_user")
+
+# Any committed change to a user (role, is_active, deletion) invalidates their
+# cached principal. Waiting for the commit stops another request from caching
+# the old row while the change is still in flight.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, user):
+    session = db.inspect(user).session
+    if session is not None:
+        session.info.setdefault("changed_user_ids", set()).add(user.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        invalidate_user(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("changed_user_ids", None)
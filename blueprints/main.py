@@ -1,15 +1,54 @@
-import os
 import re
 from datetime import datetime, timedelta
-from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app, send_from_directory)
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app, abort,
+                   stream_with_context, Response, make_response)
 from werkzeug.utils import secure_filename
+from sqlalchemy.orm import joinedload
 from extensions import db
 from .auth import login_required, admin_required, publisher_required, get_current_user
 from models import User, Book, Category, Borrowing, Review
+from search import catalog_search
+from suggest import suggestions
+from facets import get_facets, facets_key
+from cache import versions
+from pagination import keyset_paginate
+import inventory
+from inventory import BorrowResult, ReturnResult
+from stats import dashboard_counts, dashboard_series
+from delivery import send_pdf
+from covers import schedule_cover_processing, send_variant
+from catalog import normalize_isbn
+from jobs import enqueue_job, recent_jobs
+from storage import upload_storage, release as release_blob
+import exports
+import recommendations
+import popularity
+from popularity import popularity_counter
+from tasks import background_tasks
+from provisioning import UserProvisioner, read_user_csv, upload_lines, report_csv
+from httpcache import PageValidators
+from metrics import request_metrics, PROMETHEUS_CONTENT_TYPE
+from passwords import (password_hasher, HashingBusy, login_blocked_for, record_login_failure,
+                       clear_login_failures)
 
 main_bp = Blueprint("main", __name__)
 
+# Catalog sort orders and their keyset columns; "trending" pages through popularity's precomputed lists
+CATALOG_SORTS = {
+    'newest': (Book.created_at, Book.id),
+    'most_borrowed': (Book.borrow_count, Book.id),
+    'trending': None,
+}
+
+# Sortable columns of the publisher dashboard's book table
+PUBLISHER_BOOK_SORTS = {
+    'newest': Book.created_at,
+    'title': Book.title,
+    'available': Book.available_copies,
+    'borrows': Book.borrow_count,
+    'rating': db.case((Book.rating_count > 0, Book.rating_sum * 1.0 / Book.rating_count), else_=0),
+}
+
 def allowed_file(filename, allowed_extensions):
     """Checks if a file has an allowed extension."""
     return '.' in filename and \
@@ -36,12 +75,12 @@ def index():
     selected_genre = request.args.get('genre', '')
     selected_book_type = request.args.get('book_type', '')
     selected_status = request.args.get('status', '')
+    selected_sort = request.args.get('sort', 'newest')
+    if selected_sort not in CATALOG_SORTS:
+        selected_sort = 'newest'
 
     query = Book.query
 
-    if search_query:
-        search_term = f"%{search_query}%"
-        query = query.filter(db.or_(Book.title.ilike(search_term), Book.author.ilike(search_term)))
     if selected_category:
         query = query.filter_by(category=selected_category)
     if selected_genre:
@@ -51,18 +90,68 @@ def index():
     if selected_status == 'available':
         query = query.filter(Book.available_copies > 0)
 
-    books_pagination = query.order_by(Book.created_at.desc()).paginate(page=page, per_page=9, error_out=False)
-    categories = [cat[0] for cat in db.session.query(Book.category).distinct().all() if cat[0]]
-    genres = [g[0] for g in db.session.query(Book.genre).distinct().all() if g[0]]
-    book_types = [bt[0] for bt in db.session.query(Book.book_type).distinct().all() if bt[0]]
-
-    return render_template(
+    # Browsing uses keyset cursors so deep pages cost the same as page 1 (trending always
+    # does). Search results are relevance-ranked, so they keep page numbers and ignore the sort.
+    cursor_mode = not search_query and (
+        selected_sort == 'trending' or current_app.config["CATALOG_PAGINATION"] == "keyset")
+    if cursor_mode and selected_sort == 'trending':
+        books_pagination = popularity.trending_page(
+            query, selected_category or None, per_page=9,
+            after=request.args.get('after'), before=request.args.get('before'),
+        )
+    elif cursor_mode:
+        books_pagination = keyset_paginate(
+            query, CATALOG_SORTS[selected_sort], per_page=9,
+            after=request.args.get('after'), before=request.args.get('before'),
+            count_limit=current_app.config["CATALOG_COUNT_LIMIT"],
+        )
+    else:
+        if search_query:
+            # Ranked by relevance; see search.py for the per-database backends
+            query = catalog_search.apply(query, search_query)
+        else:
+            query = query.order_by(*[column.desc() for column in CATALOG_SORTS[selected_sort]])
+        books_pagination = query.paginate(page=page, per_page=9, error_out=False)
+    facet_filters = {
+        "category": selected_category, "genre": selected_genre,
+        "book_type": selected_book_type, "status": selected_status,
+    }
+    facets = get_facets(search_query, facet_filters)
+    filters_key = (facets_key(search_query, facet_filters), search_query, tuple(sorted(facet_filters.items())),
+                   selected_sort)
+
+    # The page is fully described by its books' versions, the pager and the facets
+    validators = PageValidators(
+        "catalog", sorted(request.args.items(multi=True)), [(book.id, book.version) for book in books_pagination.items],
+        books_pagination.total, getattr(books_pagination, 'total_is_estimate', False),
+        books_pagination.has_prev, books_pagination.has_next, filters_key,
+    )
+    if validators.fresh:
+        return validators.not_modified()
+    return validators.apply(make_response(render_template(
         "index.html",
-        current_user=user, books=books_pagination, search=search_query,
-        categories=categories, genres=genres, book_types=book_types,
+        current_user=user, books=books_pagination, search=search_query, cursor_mode=cursor_mode,
+        filter_args={k: v for k, v in request.args.items() if k not in ('page', 'after', 'before')},
+        categories=facets["category"], genres=facets["genre"], book_types=facets["book_type"],
         selected_category=selected_category, selected_genre=selected_genre,
-        selected_book_type=selected_book_type, selected_status=selected_status,
+        selected_book_type=selected_book_type, selected_status=selected_status, selected_sort=selected_sort,
+        filters_key=filters_key,
+    )))
+
+@main_bp.route("/api/suggest")
+@login_required
+def suggest():
+    """Title and author completions for the catalog search box, as JSON; see suggest.py."""
+    limit = min(max(request.args.get('limit', current_app.config["SUGGEST_LIMIT"], type=int), 1), 20)
+    result = suggestions.suggest(request.args.get('q', ''), limit)
+    response = jsonify(
+        titles=[{"id": book_id, "title": title, "url": url_for('main.book_detail', book_id=book_id)}
+                for book_id, title in result["titles"]],
+        authors=result["authors"],
     )
+    # Every keystroke is a request; the same prefix typed again within a minute needn't be
+    response.headers["Cache-Control"] = "private, max-age=60"
+    return response
 
 @main_bp.route("/register", methods=["GET", "POST"])
 def register():
@@ -94,7 +183,11 @@ def register():
             flash("Passwords do not match.", "danger")
             return render_template("register.html", form_data=request.form)
 
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashingBusy:
+            flash("We're handling a lot of sign-ins right now. Please try again in a moment.", "warning")
+            return render_template("register.html", form_data=request.form), 503
         new_user = User(username=username, email=email, password_hash=hashed_password, role=role)
         db.session.add(new_user)
         db.session.commit()
@@ -108,10 +201,30 @@ def register():
 def login():
     if request.method == "POST":
         email = request.form.get("email")
-        password = request.form.get("password")
-        user = User.query.filter_by(email=email).first()
+        password = request.form.get("password") or ""
+
+        # Refuse before hashing anything, so guessing can't tie up the hash workers
+        wait = login_blocked_for(email, request.remote_addr)
+        if wait:
+            flash("Too many failed sign-in attempts. Please wait a few minutes and try again.", "danger")
+            response = make_response(render_template("login.html"), 429)
+            response.headers["Retry-After"] = str(int(wait) + 1)
+            return response
 
-        if user and check_password_hash(user.password_hash, password):
+        user = User.query.filter_by(email=email).first()
+        try:
+            verified = user is not None and password_hasher.verify(user.password_hash, password)
+            if verified and password_hasher.needs_rehash(user.password_hash):
+                password_hasher.upgrade(user.id, user.password_hash, password)
+        except HashingBusy:
+            flash("We're handling a lot of sign-ins right now. Please try again in a moment.", "warning")
+            return render_template("login.html"), 503
+
+        if verified:
+            clear_login_failures(email)
+            if user.is_active is False:
+                flash("This account has been deactivated.", "danger")
+                return render_template("login.html")
             session["user_id"] = user.id
             session["username"] = user.username
             session["role"] = user.role
@@ -125,6 +238,7 @@ def login():
             else: # This handles the 'user' role
                 return redirect(url_for("main.index"))
         else:
+            record_login_failure(email, request.remote_addr)
             flash("Invalid email or password. Please try again.", "danger")
     
     return render_template("login.html")
@@ -149,13 +263,9 @@ def user_dashboard():
 @main_bp.route("/admin/dashboard")
 @admin_required
 def admin_dashboard():
-    stats = {
-        "total_books": Book.query.count(),
-        "total_users": User.query.filter(User.role != 'admin').count(),
-        "total_publishers": User.query.filter_by(role="publisher").count(),
-        "total_borrowed": Borrowing.query.filter_by(is_returned=False).count()
-    }
-    return render_template("admin_dashboard.html", current_user=get_current_user(), **stats)
+    stats = dashboard_counts()
+    series = dashboard_series()
+    return render_template("admin_dashboard.html", current_user=get_current_user(), **stats, **series)
 
 # In main.py
 
@@ -163,29 +273,41 @@ def admin_dashboard():
 @publisher_required
 def publisher_dashboard():
     user = get_current_user()
-    
-    # ✅ FIXED: Query for the books published by this user
-    published_books = Book.query.filter_by(publisher_id=user.id).order_by(Book.created_at.desc()).all()
 
-    # Basic stats
-    published_books_count = len(published_books)
-    available_copies = db.session.query(db.func.sum(Book.available_copies)).filter(Book.publisher_id == user.id).scalar() or 0
-    
-    # Query for borrows of this publisher's books
-    borrows_query = Borrowing.query.join(Book).filter(Book.publisher_id == user.id)
-    borrowed_count = borrows_query.count()
-    
-    # Average rating calculation
-    avg_rating = db.session.query(db.func.avg(Review.rating)).join(Book).filter(Book.publisher_id == user.id).scalar() or 0
-    
+    # All headline stats in one aggregate over the publisher's books; borrow and
+    # rating totals come from the counters maintained on each book.
+    totals = db.session.query(
+        db.func.count(Book.id), db.func.sum(Book.available_copies), db.func.sum(Book.borrow_count),
+        db.func.sum(Book.rating_sum), db.func.sum(Book.rating_count),
+    ).filter(Book.publisher_id == user.id).one()
+    published_books_count, available_copies, borrowed_count, rating_sum, rating_count = (int(v or 0) for v in totals)
+    avg_rating = rating_sum / rating_count if rating_count else 0
+
+    sort = request.args.get('sort', 'newest')
+    if sort not in PUBLISHER_BOOK_SORTS:
+        sort = 'newest'
+    direction = 'asc' if request.args.get('dir') == 'asc' else 'desc'
+    sort_column = PUBLISHER_BOOK_SORTS[sort]
+    order = sort_column.asc() if direction == 'asc' else sort_column.desc()
+    books_page = (
+        Book.query.filter_by(publisher_id=user.id)
+        .order_by(order, Book.id.desc())
+        .paginate(page=request.args.get('page', 1, type=int), per_page=25, error_out=False, count=False)
+    )
+    books_page.total = published_books_count
+
     return render_template(
         "publisher_dashboard.html",
         current_user=user,
-        books=published_books, 
+        books=books_page.items,
+        books_page=books_page,
+        sort=sort,
+        direction=direction,
+        jobs=recent_jobs(user.id),
         published_books_count=published_books_count, 
         borrowed_count=borrowed_count,
-        available_copies=int(available_copies),
-        average_rating=float(avg_rating if avg_rating else 0)
+        available_copies=available_copies,
+        average_rating=float(avg_rating)
     )
 
 #==============================================================================
@@ -230,13 +352,13 @@ def add_book():
         pdf_file = request.files.get('pdf_file')
         cover_filename, pdf_filename = None, None
 
+        # The files were streamed to disk and hashed while the form was parsed (storage.UploadRequest),
+        # so saving them is a rename. Stored by content hash, so identical uploads share one file.
         if cover_image and allowed_file(cover_image.filename, current_app.config['ALLOWED_IMAGE_EXTENSIONS']):
-            cover_filename = secure_filename(cover_image.filename)
-            cover_image.save(os.path.join(current_app.config['BOOK_COVER_FOLDER'], cover_filename))
+            cover_filename, _ = upload_storage.covers.save(cover_image.stream, cover_image.filename.rsplit('.', 1)[1])
 
         if pdf_file and allowed_file(pdf_file.filename, current_app.config['ALLOWED_PDF_EXTENSIONS']):
-            pdf_filename = secure_filename(pdf_file.filename)
-            pdf_file.save(os.path.join(current_app.config['BOOK_PDF_FOLDER'], pdf_filename))
+            pdf_filename, _ = upload_storage.pdfs.save(pdf_file.stream, 'pdf')
 
         total_copies = int(request.form.get('total_copies', 1))
         new_book = Book(
@@ -244,12 +366,21 @@ def add_book():
             description=request.form.get('description'), category=request.form.get('category'),
             genre=request.form.get('genre'), total_copies=total_copies,
             available_copies=total_copies, publication_year=int(request.form.get('publication_year')),
-            isbn=request.form.get('isbn'), publisher_id=get_current_user().id,
+            isbn=normalize_isbn(request.form.get('isbn')), publisher_id=get_current_user().id,
             cover_image=cover_filename, pdf_file=pdf_filename
         )
         db.session.add(new_book)
+        db.session.flush()
+        catalog_search.index_book(new_book)
+        suggestions.index_book(new_book)
         db.session.commit()
-        flash('Book added successfully!', 'success')
+        versions.bump("catalog")
+        # Validation, page count and previews happen off the request; see the dashboard for progress
+        if pdf_filename:
+            enqueue_job("pdf", new_book.id)
+        if cover_filename:
+            schedule_cover_processing(new_book.id)
+        flash('Book added successfully! Its files are being processed in the background.', 'success')
         return redirect(url_for('main.publisher_dashboard'))
     return render_template('book_form.html', current_user=get_current_user())
 
@@ -264,8 +395,12 @@ def edit_book(book_id):
     if request.method == 'POST':
         book.title = request.form.get('title')
         book.author = request.form.get('author')
+        book.isbn = normalize_isbn(request.form.get('isbn'))
         # ... (full update logic would go here)
+        catalog_search.index_book(book)
+        suggestions.index_book(book)
         db.session.commit()
+        versions.bump("catalog")
         flash(f"'{book.title}' has been successfully updated.", "success")
         return redirect(url_for('main.publisher_dashboard'))
     return render_template('edit_book.html', book=book, current_user=get_current_user())
@@ -277,11 +412,78 @@ def delete_book(book_id):
     if book.publisher_id != get_current_user().id:
         flash("You are not authorized to delete this book.", "danger")
         return redirect(url_for('main.publisher_dashboard'))
+    cover_key, pdf_key = book.cover_image, book.pdf_file
+    catalog_search.remove_book(book.id)
+    suggestions.remove_book(book.id)
     db.session.delete(book)
     db.session.commit()
+    versions.bump("catalog")
+    # Drop the files too, unless another book shares them
+    if cover_key:
+        release_blob("covers", cover_key)
+    if pdf_key:
+        release_blob("pdfs", pdf_key)
     flash(f"Book '{book.title}' has been successfully deleted.", "success")
     return redirect(url_for('main.publisher_dashboard'))
 
+@main_bp.route("/admin/export/<dataset>.<fmt>")
+@admin_required
+def export_data(dataset, fmt):
+    """Stream a dataset as CSV or JSON Lines; ?from=, ?to=, ?status= filter it and ?gzip=1 compresses it."""
+    if dataset not in exports.DATASETS or fmt not in exports.FORMATS:
+        abort(404)
+    status = request.args.get('status') or None
+    if status and status not in exports.STATUSES[dataset]:
+        abort(400)
+    columns, rows = exports.export_rows(
+        dataset, _parse_date(request.args.get('from')), _parse_date(request.args.get('to')), status,
+    )
+    chunks = exports.render(columns, rows, fmt)
+    filename = f"{dataset}-{datetime.utcnow():%Y%m%d}.{fmt}"
+    if request.args.get('gzip'):
+        body, mimetype, filename = exports.gzip_chunks(chunks), 'application/gzip', filename + '.gz'
+    else:
+        body, mimetype = chunks, exports.FORMATS[fmt]
+    # The rows are fetched while the response is written, so the request context has to stay up
+    response = current_app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass chunks through as they are produced
+    return response
+
+@main_bp.route("/admin/users/import", methods=["GET", "POST"])
+@admin_required
+def import_users():
+    """Create accounts from an uploaded CSV; the response is the report of rejected rows, streamed as it's made."""
+    if request.method == "POST":
+        upload = request.files.get('users_file')
+        if not upload or not upload.filename:
+            flash("Choose a CSV file to import.", "danger")
+            return redirect(url_for('main.import_users'))
+        try:
+            records = read_user_csv(upload_lines(upload.stream))
+        except (ValueError, UnicodeDecodeError) as exc:
+            flash(f"Can't read that file: {exc}", "danger")
+            return redirect(url_for('main.import_users'))
+        provisioner = UserProvisioner(default_role=request.form.get('role') or 'user')
+        # The upload and the database session are used while the report is written
+        response = current_app.response_class(stream_with_context(report_csv(provisioner, records)), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename="user-import-{datetime.utcnow():%Y%m%d-%H%M%S}.csv"'
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    return render_template("import_users.html", current_user=get_current_user())
+
+def _metrics_response():
+    return Response(request_metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@main_bp.route("/admin/metrics")
+def metrics():
+    # A Prometheus scraper authenticates with METRICS_TOKEN; otherwise admins only
+    if request_metrics.token_matches(request.headers.get('Authorization')):
+        return _metrics_response()
+    return admin_required(_metrics_response)()
+
 #==============================================================================
 # USER ACTION ROUTES
 #==============================================================================
@@ -290,21 +492,27 @@ def delete_book(book_id):
 @login_required
 def book_detail(book_id):
     book = Book.query.get_or_404(book_id)
-    reviews = Review.query.filter_by(book_id=book.id).order_by(Review.created_at.desc()).all()
-    
-    # Calculate average rating
-    if reviews:
-        average_rating = sum(r.rating for r in reviews) / len(reviews)
-    else:
-        average_rating = 0
-        
-    return render_template(
+    also_borrowed = recommendations.also_borrowed(book.id)
+    # Edits, borrows, returns and new reviews all bump book.version; the neighbours change on their own
+    validators = PageValidators("book", book.id, book.version, [(b.id, b.version) for b in also_borrowed],
+                                last_modified=book.updated_at)
+    if validators.fresh:
+        return validators.not_modified()
+    # Run by the template only if the cached review list is out of date
+    reviews = (
+        Review.query.options(joinedload(Review.user))
+        .filter_by(book_id=book.id).order_by(Review.created_at.desc())
+    )
+
+    # The average comes from the aggregates stored on the book (see models.Book)
+    return validators.apply(make_response(render_template(
         "book_detail.html", 
         book=book, 
         reviews=reviews,
-        average_rating=average_rating,
+        average_rating=book.average_rating,
+        also_borrowed=also_borrowed,
         current_user=get_current_user()
-    )
+    )))
 
 @main_bp.route("/book/<int:book_id>/review", methods=["POST"])
 @login_required
@@ -324,6 +532,9 @@ def submit_review(book_id):
     if not rating or not content:
         flash("Both rating and review content are required.", "danger")
         return redirect(url_for('main.book_detail', book_id=book_id))
+    if rating not in ("1", "2", "3", "4", "5"):
+        flash("Rating must be between 1 and 5.", "danger")
+        return redirect(url_for('main.book_detail', book_id=book_id))
 
     new_review = Review(
         user_id=user.id,
@@ -331,8 +542,10 @@ def submit_review(book_id):
         rating=int(rating),
         content=content
     )
+    # The book's rating aggregates are updated in the same transaction by a Review event
     db.session.add(new_review)
     db.session.commit()
+    popularity_counter.record("review", book_id)
 
     flash("Your review has been submitted successfully!", "success")
     return redirect(url_for('main.book_detail', book_id=book_id))
@@ -347,49 +560,122 @@ def download_book(book_id):
     
     # Check if the user wants to view the file in the browser
     view_in_browser = request.args.get('view') == 'true'
+    if request.range is None:  # a PDF viewer fetches the rest of the file in Range requests
+        popularity_counter.record("download", book.id)
 
-    return send_from_directory(
-        current_app.config['BOOK_PDF_FOLDER'], 
-        book.pdf_file, 
-        as_attachment=(not view_in_browser)
+    return send_pdf(
+        book.pdf_file, as_attachment=(not view_in_browser),
+        download_name=f"{secure_filename(book.title) or 'book'}.pdf",
     )
+
+@main_bp.route("/covers/variants/<path:filename>")
+def cover_variant(filename):
+    return send_variant(filename)
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
 @main_bp.route("/borrowing-history")
 @login_required
 def borrowing_history():
     user = get_current_user()
-    query = Borrowing.query
-    if user.role != 'admin':
+    now = datetime.utcnow()
+    # Eager-load what the template shows so a page is one query, not 2N+1
+    query = Borrowing.query.options(joinedload(Borrowing.book))
+    if user.role == 'admin':
+        query = query.options(joinedload(Borrowing.user))
+        user_filter = request.args.get('user', '').strip()
+        book_filter = request.args.get('book', '').strip()
+        if user_filter:
+            matching_users = db.select(User.id).where(db.or_(User.username == user_filter, User.email == user_filter))
+            query = query.filter(Borrowing.user_id.in_(matching_users))
+        if book_filter:
+            if book_filter.isdigit():
+                query = query.filter(Borrowing.book_id == int(book_filter))
+            else:
+                # Prefix match so ix_books_title can be used
+                matching_books = db.select(Book.id).where(Book.title.ilike(f"{book_filter}%"))
+                query = query.filter(Borrowing.book_id.in_(matching_books))
+    else:
         query = query.filter_by(user_id=user.id)
-    borrowed_books = query.order_by(Borrowing.borrowed_date.desc()).all()
-    return render_template("borrowing_history.html", current_user=user, borrowed_books=borrowed_books, now=datetime.utcnow())
+
+    status = request.args.get('status', '')
+    if status == 'borrowed':
+        query = query.filter_by(is_returned=False)
+    elif status == 'returned':
+        query = query.filter_by(is_returned=True)
+    elif status == 'overdue':
+        query = query.filter_by(is_returned=False).filter(Borrowing.due_date < now)
+    date_from = _parse_date(request.args.get('from'))
+    date_to = _parse_date(request.args.get('to'))
+    if date_from:
+        query = query.filter(Borrowing.borrowed_date >= date_from)
+    if date_to:
+        query = query.filter(Borrowing.borrowed_date < date_to + timedelta(days=1))
+
+    borrowings_page = keyset_paginate(
+        query, (Borrowing.borrowed_date, Borrowing.id), per_page=25,
+        after=request.args.get('after'), before=request.args.get('before'),
+    )
+    # The running balance kept on the user row, rather than a sum over the fine ledger
+    fines_balance = db.session.query(User.fines_balance).filter_by(id=user.id).scalar() if user.role == 'user' else 0
+    return render_template(
+        "borrowing_history.html", current_user=user, now=now, fines_balance=fines_balance,
+        borrowed_books=borrowings_page.items, borrowings_page=borrowings_page,
+        filter_args={k: v for k, v in request.args.items() if k not in ('after', 'before')},
+    )
+
+@main_bp.route("/admin/overdue")
+@admin_required
+def overdue_report():
+    now = datetime.utcnow()
+    # A range of ix_borrowings_open_due, most overdue first
+    query = (
+        Borrowing.query.options(joinedload(Borrowing.book), joinedload(Borrowing.user))
+        .filter(Borrowing.is_returned.is_(False), Borrowing.due_date < now)
+    )
+    overdue_page = keyset_paginate(
+        query, (Borrowing.due_date, Borrowing.id), per_page=50, descending=False,
+        after=request.args.get('after'), before=request.args.get('before'),
+        count_limit=current_app.config['CATALOG_COUNT_LIMIT'],
+    )
+    return render_template("overdue_report.html", current_user=get_current_user(), now=now, overdue_page=overdue_page)
 
 @main_bp.route("/borrow/<int:book_id>")
 @login_required
 def borrow_book(book_id):
     book = Book.query.get_or_404(book_id)
     user = get_current_user()
-    if book.available_copies <= 0:
+    title = book.title
+    result, _ = inventory.borrow(user.id, book.id)
+    if result is BorrowResult.UNAVAILABLE:
         flash("This book is currently unavailable.", "warning")
         return redirect(url_for('main.index'))
-    new_borrowing = Borrowing(user_id=user.id, book_id=book.id, due_date=datetime.utcnow() + timedelta(days=14))
-    book.available_copies -= 1
-    db.session.add(new_borrowing)
-    db.session.commit()
-    flash(f"You have successfully borrowed '{book.title}'.", "success")
+    if result is BorrowResult.ALREADY_BORROWED:
+        flash(f"You already have '{title}' on loan.", "info")
+        return redirect(url_for('main.borrowing_history'))
+    if result is BorrowResult.NOT_FOUND:
+        abort(404)
+    versions.bump("availability")
+    background_tasks.submit(recommendations.record_borrow, user.id, book.id)
+    popularity_counter.record("borrow", book.id)
+    flash(f"You have successfully borrowed '{title}'.", "success")
     return redirect(url_for('main.borrowing_history'))
 
 @main_bp.route("/return/<int:borrow_id>")
 @login_required
 def return_book(borrow_id):
     borrowing_record = Borrowing.query.get_or_404(borrow_id)
-    if borrowing_record.user_id != get_current_user().id and get_current_user().role != 'admin':
+    user = get_current_user()
+    if borrowing_record.user_id != user.id and user.role != 'admin':
         flash("Not authorized to perform this action.", "danger")
         return redirect(url_for('main.borrowing_history'))
-    if not borrowing_record.is_returned:
-        borrowing_record.is_returned = True
-        borrowing_record.returned_date = datetime.utcnow()
-        borrowing_record.book.available_copies += 1
-        db.session.commit()
+    result, _ = inventory.return_borrowing(borrowing_record.id)
+    if result is ReturnResult.RETURNED:
+        versions.bump("availability")
         flash(f"You have successfully returned '{borrowing_record.book.title}'.", "success")
     else:
         flash("This book has already been returned.", "info")
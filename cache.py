@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A small thread-safe LRU cache whose entries also expire after ``ttl`` seconds.
+    It lives in the worker process, so every worker keeps its own copy.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Return the cached value for ``key``, computing it with ``factory()`` on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class VersionRegistry:
+    """
+    Monotonic counters, one per namespace. Cache keys include the current
+    version, so bumping it retires every entry built from the old data.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump(self, *namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+
+# Namespaces used across the app:
+#   "catalog"       books added, edited or deleted
+#   "availability"  available_copies changed by a borrow or return
+versions = VersionRegistry()
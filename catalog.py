@@ -0,0 +1,287 @@
+import csv
+import json
+import os
+import re
+import time
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+
+from extensions import db
+from search import catalog_search
+from validators import validate_book_data
+
+try:
+    import pymarc
+except ImportError:  # optional; only needed for MARC 21 files
+    pymarc = None
+
+IMPORT_FIELDS = (
+    "title", "author", "isbn", "description", "genre", "category",
+    "book_type", "publication_year", "total_copies",
+)
+FORMATS = ("csv", "jsonl", "marc")
+
+
+#==============================================================================
+# READERS
+#==============================================================================
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        for row in csv.DictReader(fh):
+            yield {(key or "").strip().lower(): value for key, value in row.items()}
+
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield {"unparsed": line.rstrip("\n")}  # reported as an invalid record
+
+
+def _marc_value(record, tag, code):
+    fields = record.get_fields(tag)
+    values = fields[0].get_subfields(code) if fields else []
+    return values[0].strip(" /:;,.") if values else None
+
+
+def _read_marc(path):
+    if pymarc is None:
+        raise click.ClickException("Reading MARC files needs pymarc; run 'pip install pymarc'.")
+    with open(path, "rb") as fh:
+        for record in pymarc.MARCReader(fh, to_unicode=True, force_utf8=True):
+            if record is None:  # unreadable record; counted as invalid
+                yield {}
+                continue
+            year = re.search(r"\d{4}", _marc_value(record, "264", "c") or _marc_value(record, "260", "c") or "")
+            title = " ".join(filter(None, (_marc_value(record, "245", "a"), _marc_value(record, "245", "b"))))
+            yield {
+                "title": title,
+                "author": _marc_value(record, "100", "a") or _marc_value(record, "110", "a"),
+                "isbn": _marc_value(record, "020", "a"),
+                "description": _marc_value(record, "520", "a"),
+                "genre": _marc_value(record, "650", "a"),
+                "publication_year": year.group(0) if year else None,
+            }
+
+
+READERS = {"csv": _read_csv, "jsonl": _read_jsonl, "marc": _read_marc}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("json", "ndjson"):
+        return "jsonl"
+    if extension in ("mrc", "marc"):
+        return "marc"
+    if extension in READERS:
+        return extension
+    raise click.ClickException(f"Can't tell the format of {path}; pass --format.")
+
+
+#==============================================================================
+# IMPORT
+#==============================================================================
+
+def normalize_isbn(value):
+    """ISBNs are stored without hyphens or spaces, so '978-0-13-110362-7' and '9780131103627' dedupe."""
+    value = re.sub(r"[\s\-]", "", str(value or "")).upper()
+    return value or None
+
+
+def clean_record(record):
+    """
+    Turn one input record into a ``books`` row, checked with the same rules
+    as the add-book form. Returns ``(row, errors)``; ``row`` is None if invalid.
+    """
+    data = {field: str(record[field]).strip() for field in IMPORT_FIELDS if record.get(field) not in (None, "")}
+    errors = validate_book_data(data)
+    isbn = normalize_isbn(data.get("isbn"))
+    if isbn and len(isbn) > 20:
+        errors.append("ISBN must be at most 20 characters.")
+    if errors:
+        return None, errors
+    copies = int(data.get("total_copies", 1))
+    return {
+        "title": data["title"][:200],
+        "author": data["author"][:150],
+        "isbn": isbn,
+        "description": data.get("description"),
+        "genre": data.get("genre"),
+        "category": data.get("category"),
+        "book_type": data.get("book_type", "Physical"),
+        "publication_year": int(data["publication_year"]) if data.get("publication_year") else None,
+        "total_copies": copies,
+        "available_copies": copies,
+    }, []
+
+
+class ImportStats:
+    def __init__(self, read=0, inserted=0, duplicates=0, invalid=0):
+        self.read, self.inserted, self.duplicates, self.invalid = read, inserted, duplicates, invalid
+        self.started, self.finished = time.perf_counter(), None
+        self._start_read = read
+
+    @property
+    def rate(self):
+        """Records per second processed by this run (not counting resumed-over records)."""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return (self.read - self._start_read) / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {"read": self.read, "inserted": self.inserted, "duplicates": self.duplicates, "invalid": self.invalid}
+
+    def __str__(self):
+        return (f"{self.read:,} read, {self.inserted:,} inserted, {self.duplicates:,} duplicates, "
+                f"{self.invalid:,} invalid ({self.rate:,.0f} records/s)")
+
+
+def _existing_isbns(isbns):
+    from models import Book
+    if not isbns:
+        return set()
+    return set(db.session.scalars(select(Book.isbn).where(Book.isbn.in_(isbns))))
+
+
+def load_checkpoint(name):
+    """Counts saved under ``name`` by an earlier, unfinished import, or None."""
+    from models import ImportCheckpoint
+    saved = db.session.get(ImportCheckpoint, name)
+    if saved is None:
+        return None
+    return ImportStats(read=saved.read, inserted=saved.inserted, duplicates=saved.duplicates, invalid=saved.invalid)
+
+
+def clear_checkpoint(name):
+    from models import ImportCheckpoint
+    db.session.execute(db.delete(ImportCheckpoint).where(ImportCheckpoint.name == name))
+    db.session.commit()
+
+
+def _save_checkpoint(name, stats):
+    # Not committed here: the caller commits it together with the batch it describes
+    from models import ImportCheckpoint
+    saved = db.session.get(ImportCheckpoint, name)
+    if saved is None:
+        saved = ImportCheckpoint(name=name)
+        db.session.add(saved)
+    for field, value in stats.as_dict().items():
+        setattr(saved, field, value)
+
+
+def _insert_batch(rows, stats, publisher_id, checkpoint=None):
+    from models import Book
+    # ISBNs already in the catalog (from earlier files, or an earlier run of this one) are skipped
+    existing = _existing_isbns([row["isbn"] for row in rows if row["isbn"]])
+    new_rows = [dict(row, publisher_id=publisher_id) for row in rows if row["isbn"] not in existing]
+    stats.duplicates += len(rows) - len(new_rows)
+    stats.inserted += len(new_rows)
+    if new_rows:
+        # One multi-row INSERT per batch, bypassing the ORM unit of work
+        db.session.execute(insert(Book.__table__), new_rows)
+    if checkpoint:
+        _save_checkpoint(checkpoint, stats)
+    db.session.commit()
+
+
+def import_catalog(path, fmt=None, batch_size=5000, publisher_id=None,
+                   checkpoint=None, rejects=None, progress=None):
+    """
+    Stream books from a CSV, JSONL or MARC file into the catalog in batches.
+
+    Rows are validated like the add-book form and deduplicated on ISBN, both
+    within the file and against the catalog. If ``checkpoint`` names an
+    import, the counts are saved under that name in the same transaction as
+    each batch, and a later run with the same name skips the records already
+    handled; a crash can't leave a batch committed but not checkpointed.
+    ``rejects``, a text file, receives one JSON line per invalid record.
+    ``progress`` is called with the running ImportStats after every batch.
+    """
+    fmt = fmt or detect_format(path)
+    stats = (load_checkpoint(checkpoint) if checkpoint else None) or ImportStats()
+
+    records = islice(READERS[fmt](path), stats.read, None)
+    batch, batch_isbns = [], set()
+    for record in records:
+        stats.read += 1
+        row, errors = clean_record(record)
+        if row is None:
+            stats.invalid += 1
+            if rejects is not None:
+                rejects.write(json.dumps({"record": stats.read, "errors": errors, "data": record}, default=str) + "\n")
+        elif row["isbn"] and row["isbn"] in batch_isbns:
+            stats.duplicates += 1
+        else:
+            batch.append(row)
+            if row["isbn"]:
+                batch_isbns.add(row["isbn"])
+
+        if len(batch) >= batch_size:
+            _insert_batch(batch, stats, publisher_id, checkpoint)
+            batch, batch_isbns = [], set()
+            if progress:
+                progress(stats)
+
+    # The last, partial batch; also saves the records read since the last full one
+    _insert_batch(batch, stats, publisher_id, checkpoint)
+    stats.finished = time.perf_counter()
+    if progress:
+        progress(stats)
+    return stats
+
+
+#==============================================================================
+# CLI
+#==============================================================================
+
+catalog_cli = AppGroup("catalog", help="Bulk catalog import.")
+
+
+@catalog_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="Input format (default: from the file extension).")
+@click.option("--batch-size", default=5000, show_default=True, help="Rows per INSERT and per commit.")
+@click.option("--publisher", help="Username of the publisher to attribute the books to.")
+@click.option("--checkpoint", help="Name to save progress under for resuming  [default: PATH]")
+@click.option("--restart", is_flag=True, help="Ignore an existing checkpoint and start from the first record.")
+@click.option("--rejects", type=click.File("a"), help="Append invalid records here as JSON lines.")
+@click.option("--no-reindex", is_flag=True, help="Skip rebuilding the search index afterwards.")
+def import_command(path, fmt, batch_size, publisher, checkpoint, restart, rejects, no_reindex):
+    """Import books from a CSV, JSONL or MARC 21 file.
+
+    CSV headers / JSON keys: title, author, isbn, description, genre, category,
+    book_type, publication_year, total_copies. An interrupted import picks up
+    after its last committed batch when run again.
+    """
+    from models import User
+    publisher_id = None
+    if publisher:
+        user = User.query.filter_by(username=publisher).first()
+        if user is None or user.role != "publisher":
+            raise click.ClickException(f"No publisher named {publisher!r}.")
+        publisher_id = user.id
+
+    checkpoint = checkpoint or os.path.abspath(path)
+    if restart:
+        clear_checkpoint(checkpoint)
+    elif load_checkpoint(checkpoint) is not None:
+        click.echo(f"Resuming the import saved as {checkpoint}.")
+
+    stats = import_catalog(
+        path, fmt=fmt, batch_size=batch_size, publisher_id=publisher_id, checkpoint=checkpoint,
+        rejects=rejects, progress=lambda s: click.echo(f"\r{s}", nl=False),
+    )
+    click.echo()
+    clear_checkpoint(checkpoint)
+
+    if not no_reindex and stats.inserted:
+        click.echo(f"Rebuilding the '{catalog_search.backend.name}' search index...")
+        catalog_search.rebuild()
+        db.session.commit()
+    click.echo(f"Done: {stats}.")
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+
+import click
+from flask import abort, current_app, request, url_for
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+from extensions import db
+from storage import content_hash, is_content_key, upload_storage
+from tasks import background_tasks
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it the original covers are served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# name -> (width, height) the cover is fitted into, keeping its aspect ratio
+VARIANTS = {
+    "thumb": (240, 360),   # catalog cards, dashboard tables
+    "medium": (480, 720),  # book detail page
+}
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+VARIANT_DIR = "variants"
+
+
+def variant_filename(cover_hash, variant, ext):
+    return f"{cover_hash}-{variant}.{ext}"
+
+
+def _stream_hash(stream):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    # 16 hex characters is plenty to keep variant names unique
+    return digest.hexdigest()[:16]
+
+
+def build_variants(source, variant_folder, cover_hash=None):
+    """
+    Write every size/format variant of the image in the binary file object
+    ``source`` and return its content hash. Variant names are derived from
+    the hash, so they never change for the same image and existing files
+    are reused.
+    """
+    cover_hash = cover_hash or _stream_hash(source)
+    os.makedirs(variant_folder, exist_ok=True)
+    pending = [
+        (variant, size, ext, fmt)
+        for variant, size in VARIANTS.items()
+        for ext, fmt in FORMATS.items()
+        if not os.path.exists(os.path.join(variant_folder, variant_filename(cover_hash, variant, ext)))
+    ]
+    if not pending:
+        return cover_hash
+
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original).convert("RGB")
+        for variant, size, ext, fmt in pending:
+            image = original.copy()
+            image.thumbnail(size, Image.LANCZOS)
+            target = os.path.join(variant_folder, variant_filename(cover_hash, variant, ext))
+            tmp = target + ".tmp"
+            image.save(tmp, fmt, quality=80, optimize=True)
+            os.replace(tmp, target)
+    return cover_hash
+
+
+def delete_variants(cover_hash):
+    """Remove the variants built for a cover that is no longer stored."""
+    variant_folder = os.path.join(current_app.config["BOOK_COVER_FOLDER"], VARIANT_DIR)
+    for variant in VARIANTS:
+        for ext in FORMATS:
+            try:
+                os.remove(os.path.join(variant_folder, variant_filename(cover_hash, variant, ext)))
+            except FileNotFoundError:
+                pass
+
+
+def process_cover(book_id):
+    """Generate the variants for a book's cover and record their hash on the book."""
+    from models import Book
+    book = db.session.get(Book, book_id)
+    if book is None or not book.cover_image or Image is None:
+        return None
+    key = book.cover_image
+    # Content-addressed keys already carry the hash; legacy filenames get hashed here
+    known_hash = content_hash(key)[:16] if is_content_key(key) else None
+    variant_folder = os.path.join(current_app.config["BOOK_COVER_FOLDER"], VARIANT_DIR)
+    try:
+        with upload_storage.covers.open(key) as source:
+            book.cover_hash = build_variants(source, variant_folder, cover_hash=known_hash)
+    except FileNotFoundError:
+        logger.warning("Cover %s for book %s is missing", key, book_id)
+        return None
+    db.session.commit()
+    return book.cover_hash
+
+
+def schedule_cover_processing(book_id):
+    """Queue variant generation for a freshly uploaded cover, as a tracked job."""
+    from jobs import enqueue_job
+    if Image is None:
+        return None
+    return enqueue_job("cover", book_id)
+
+
+def cover_url(book, variant="thumb", ext="jpg"):
+    """
+    URL of a cover variant for templates. Falls back to the original upload
+    while variants are pending, and to the default cover when there is none.
+    """
+    if not book.cover_image:
+        return url_for("static", filename="images/default_cover.png")
+    if book.cover_hash:
+        return url_for("main.cover_variant", filename=variant_filename(book.cover_hash, variant, ext))
+    return url_for("static", filename="uploads/covers/" + book.cover_image)
+
+
+def send_variant(filename):
+    """
+    Respond with a cover variant. Its name changes whenever the image does,
+    so it is sent with a long max-age and marked immutable instead of the
+    no-cache default the static route uses.
+    """
+    variant_folder = os.path.join(current_app.config["BOOK_COVER_FOLDER"], VARIANT_DIR)
+    path = safe_join(variant_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = send_file(
+        path,
+        request.environ,
+        conditional=True,
+        max_age=current_app.config["COVER_VARIANT_MAX_AGE"],
+        response_class=current_app.response_class,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+covers_cli = AppGroup("covers", help="Manage cover image variants.")
+
+
+@covers_cli.command("backfill")
+@click.option("--all", "redo_all", is_flag=True, help="Also reprocess books that already have variants.")
+def backfill_command(redo_all):
+    """Generate thumbnails and medium variants for existing covers."""
+    from models import Book
+    if Image is None:
+        raise click.ClickException("Pillow is not installed; run 'pip install Pillow'.")
+    query = Book.query.filter(Book.cover_image.isnot(None), Book.cover_image != "")
+    if not redo_all:
+        query = query.filter(Book.cover_hash.is_(None))
+    book_ids = [book_id for (book_id,) in query.with_entities(Book.id)]
+    futures = [background_tasks.submit(process_cover, book_id) for book_id in book_ids]
+    done = sum(1 for future in futures if future.exception() is None and future.result())
+    click.echo(f"Processed {done} of {len(book_ids)} covers.")
@@ -0,0 +1,70 @@
+import os
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import abort, current_app, request
+from werkzeug.utils import send_file
+
+from storage import content_hash, is_content_key, upload_storage
+
+# PDF_DELIVERY modes:
+#   "direct"     the worker streams the file itself (range requests and 304s included)
+#   "x-accel"    nginx streams it from an internal location (X-Accel-Redirect)
+#   "x-sendfile" Apache/lighttpd stream it (X-Sendfile)
+DELIVERY_MODES = ("direct", "x-accel", "x-sendfile")
+
+
+def _cache_privately(response, max_age):
+    # PDFs sit behind a login, so shared caches must not keep them.
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = None
+    response.cache_control.max_age = max_age
+    return response
+
+
+def send_pdf(key, as_attachment=False, download_name=None):
+    """
+    Respond with a stored PDF once the caller has checked access.
+
+    Byte ranges (for in-browser viewers), ETag and Last-Modified validation
+    with 304 responses are handled either here or by the front-end server,
+    depending on PDF_DELIVERY.
+    """
+    try:
+        path = upload_storage.pdfs.local_path(key)
+    except ValueError:
+        abort(404)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    download_name = download_name or os.path.basename(key)
+
+    mode = current_app.config["PDF_DELIVERY"]
+    max_age = current_app.config["PDF_CACHE_MAX_AGE"]
+
+    if mode == "x-accel":
+        response = current_app.response_class(mimetype="application/pdf")
+        response.headers["X-Accel-Redirect"] = current_app.config["PDF_ACCEL_PREFIX"].rstrip("/") + "/" + quote(key)
+        disposition = "attachment" if as_attachment else "inline"
+        response.headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(download_name)}"
+        # nginx answers ranges and conditional requests for the internal location;
+        # these let it (and the browser) validate against the same file.
+        stat = os.stat(path)
+        response.last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        return _cache_privately(response, max_age)
+
+    response = send_file(
+        path,
+        request.environ,
+        mimetype="application/pdf",
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        # A content-addressed key is already a strong validator for its bytes
+        etag=content_hash(key) if is_content_key(key) else True,
+        max_age=max_age,
+        use_x_sendfile=(mode == "x-sendfile"),
+        response_class=current_app.response_class,
+    )
+    response.accept_ranges = "bytes"
+    return _cache_privately(response, max_age)
@@ -0,0 +1,81 @@
+from flask import current_app
+from sqlalchemy import func, literal, union_all
+
+from cache import TTLCache, versions
+from extensions import db
+from search import catalog_search
+
+# Book columns offered as filters in the catalog sidebar.
+FACET_FIELDS = ("category", "genre", "book_type")
+
+_facet_cache = TTLCache(maxsize=512, ttl=300)
+
+
+def _catalog_query(search_query, filters):
+    from models import Book
+    query = Book.query
+    for field in FACET_FIELDS:
+        if filters.get(field):
+            query = query.filter(getattr(Book, field) == filters[field])
+    if filters.get("status") == "available":
+        query = query.filter(Book.available_copies > 0)
+    if search_query:
+        query = catalog_search.apply(query, search_query)
+    return query.order_by(None)
+
+
+def _compute(search_query, filters):
+    from models import Book
+    selects = []
+    for field in FACET_FIELDS:
+        column = getattr(Book, field)
+        # Each facet ignores its own selection so the other options keep their counts.
+        others = {k: v for k, v in filters.items() if k != field}
+        selects.append(
+            _catalog_query(search_query, others)
+            .with_entities(literal(field).label("facet"), column.label("value"), func.count(Book.id).label("count"))
+            .filter(column.isnot(None), column != "")
+            .group_by(column)
+            .statement
+        )
+    counts = {field: [] for field in FACET_FIELDS}
+    for facet, value, count in db.session.execute(union_all(*selects)):
+        counts[facet].append((value, count))
+    for values in counts.values():
+        values.sort()
+    return counts
+
+
+def _scope(search_query, filters):
+    filters = {k: v for k, v in (filters or {}).items() if v}
+    if not current_app.config.get("CATALOG_FACETS_SCOPED", True):
+        return "", {}
+    return search_query, filters
+
+
+def facets_key(search_query="", filters=None):
+    """
+    The cache key of the facets for a search and filters. It changes whenever
+    the counts may have, so pages and fragments built from them can use it too.
+    """
+    search_query, filters = _scope(search_query, filters)
+    return (
+        current_app.config["SQLALCHEMY_DATABASE_URI"],
+        versions.get("catalog"),
+        # Only the availability filter depends on borrows and returns.
+        versions.get("availability") if filters.get("status") else None,
+        search_query,
+        tuple(sorted(filters.items())),
+    )
+
+
+def get_facets(search_query="", filters=None):
+    """
+    Facet values with their book counts, e.g. ``{"category": [("Law", 1204), ...]}``.
+
+    With ``CATALOG_FACETS_SCOPED`` on, counts follow the current search and
+    filters; otherwise they cover the whole catalog. Results are cached until
+    a book is added, edited or deleted.
+    """
+    search_query, filters = _scope(search_query, filters)
+    return _facet_cache.get_or_set(facets_key(search_query, filters), lambda: _compute(search_query, filters))
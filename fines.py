@@ -0,0 +1,162 @@
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_, select
+
+from extensions import db
+
+SWEEP_BATCH = 500
+
+
+def format_amount(amount):
+    """Minor units as a display string, e.g. 1250 -> '₹12.50'."""
+    return f"{current_app.config['FINE_CURRENCY']}{amount / 100:,.2f}"
+
+
+def _overdue_days(due_date, fined_through, through):
+    start = fined_through or due_date.date()
+    return max((through - start).days, 0)
+
+
+def charge_loan(loan, through):
+    """
+    Charge the overdue days of one loan up to the date ``through`` that
+    haven't been charged yet, inside the caller's transaction. ``loan`` needs
+    ``id``, ``user_id``, ``due_date``, ``fined_through`` and ``fine_amount``.
+
+    The loan's ``fined_through`` is advanced with a compare-and-set UPDATE,
+    so two sweeps running at once can't charge the same days twice.
+    Returns the amount charged.
+    """
+    from models import Borrowing, FineEntry, User
+    days = _overdue_days(loan.due_date, loan.fined_through, through)
+    if not days:
+        return 0
+    amount = days * current_app.config["FINE_PER_DAY"]
+    cap = current_app.config["FINE_MAX_PER_LOAN"]
+    if cap is not None:
+        amount = max(min(amount, cap - loan.fine_amount), 0)
+
+    loans = Borrowing.__table__
+    unchanged = (loans.c.fined_through.is_(None) if loan.fined_through is None
+                 else loans.c.fined_through == loan.fined_through)
+    advanced = db.session.execute(
+        loans.update()
+        .where(loans.c.id == loan.id, unchanged)
+        .values(fined_through=through, fine_amount=loans.c.fine_amount + amount)
+    ).rowcount
+    if not advanced or not amount:
+        return 0
+    db.session.add(FineEntry(user_id=loan.user_id, borrowing_id=loan.id, kind="charge", amount=amount, days=days))
+    users = User.__table__
+    db.session.execute(
+        users.update().where(users.c.id == loan.user_id).values(fines_balance=users.c.fines_balance + amount)
+    )
+    return amount
+
+
+def _loan_row(loan_id):
+    from models import Borrowing
+    return db.session.execute(
+        select(Borrowing.id, Borrowing.user_id, Borrowing.due_date, Borrowing.fined_through, Borrowing.fine_amount)
+        .where(Borrowing.id == loan_id)
+    ).one()
+
+
+def charge_on_return(loan_id, returned_at):
+    """Charge the days a returned loan was overdue that the sweep hasn't charged yet."""
+    return charge_loan(_loan_row(loan_id), returned_at.date())
+
+
+def sweep(now=None):
+    """
+    Charge every overdue open loan up to today. Loans are read in batches
+    along ix_borrowings_open_due and each batch is committed on its own.
+    Re-running it the same day charges nothing more.
+    Returns ``(loans charged, total amount)``.
+    """
+    from models import Borrowing
+    now = now or datetime.utcnow()
+    today = now.date()
+    charged = total = 0
+    last = None
+    while True:
+        stmt = (
+            select(Borrowing.id, Borrowing.user_id, Borrowing.due_date, Borrowing.fined_through, Borrowing.fine_amount)
+            .where(Borrowing.is_returned.is_(False), Borrowing.due_date < now)
+            .order_by(Borrowing.due_date, Borrowing.id)
+            .limit(SWEEP_BATCH)
+        )
+        if last is not None:
+            stmt = stmt.where(or_(Borrowing.due_date > last[0],
+                                  and_(Borrowing.due_date == last[0], Borrowing.id > last[1])))
+        batch = db.session.execute(stmt).all()
+        if not batch:
+            break
+        for loan in batch:
+            amount = charge_loan(loan, today)
+            charged += bool(amount)
+            total += amount
+        db.session.commit()
+        last = (batch[-1].due_date, batch[-1].id)
+    return charged, total
+
+
+def record_payment(user_id, amount, kind="payment"):
+    """Credit a payment or waiver of ``amount`` minor units against a user's fines."""
+    from models import FineEntry, User
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    db.session.add(FineEntry(user_id=user_id, kind=kind, amount=-amount))
+    users = User.__table__
+    db.session.execute(
+        users.update().where(users.c.id == user_id).values(fines_balance=users.c.fines_balance - amount)
+    )
+    db.session.commit()
+
+
+def rebuild_balances():
+    """Recompute every user's fines_balance from the ledger in one statement."""
+    from models import FineEntry, User
+    users = User.__table__
+    ledger_sum = (
+        select(db.func.coalesce(db.func.sum(FineEntry.amount), 0))
+        .where(FineEntry.user_id == users.c.id)
+        .scalar_subquery()
+    )
+    db.session.execute(users.update().values(fines_balance=ledger_sum))
+    db.session.commit()
+
+
+fines_cli = AppGroup("fines", help="Overdue fines: sweep, payments and repairs.")
+
+
+@fines_cli.command("sweep")
+def sweep_command():
+    """Charge fines on overdue loans up to today (schedule this, e.g. hourly or daily)."""
+    charged, total = sweep()
+    click.echo(f"Charged {charged} overdue loans a total of {format_amount(total)}.")
+
+
+@fines_cli.command("pay")
+@click.argument("username")
+@click.argument("amount", type=float)
+@click.option("--waive", is_flag=True, help="Record a waiver rather than a payment.")
+def pay_command(username, amount, waive):
+    """Record a payment (or waiver) of AMOUNT, in major units, for USERNAME."""
+    from models import User
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No user named {username!r}.")
+    record_payment(user.id, round(amount * 100), kind="waiver" if waive else "payment")
+    db.session.refresh(user)
+    click.echo(f"{username} now owes {format_amount(user.fines_balance)}.")
+
+
+@fines_cli.command("rebuild-balances")
+def rebuild_balances_command():
+    """Repair users.fines_balance from the fine ledger."""
+    rebuild_balances()
+    click.echo("Rebuilt fine balances.")
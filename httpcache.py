@@ -0,0 +1,77 @@
+import hashlib
+import time
+
+from flask import current_app, request, session
+from flask_wtf.csrf import generate_csrf
+from werkzeug.http import is_resource_modified
+
+from cache import TTLCache
+
+# Rendered template fragments. Keys carry the versions of the rows a fragment
+# shows, so a change retires the old entry instead of invalidating it; the
+# TTL only bounds how long unused entries linger.
+_fragment_cache = TTLCache(maxsize=4096, ttl=3600)
+
+
+def cache_fragment(name, *key, caller):
+    """
+    Jinja helper that renders a block once per key and reuses the HTML::
+
+        {% call cache_fragment("book-card", book.id, book.version) %}...{% endcall %}
+
+    The key must cover everything the block shows. Anything that depends on
+    who is looking (buttons, their name) belongs outside the block.
+    Fragments aren't cached in debug mode, so template edits show up at once.
+    """
+    if current_app.debug:
+        return caller()
+    full_key = (current_app.config["SQLALCHEMY_DATABASE_URI"], name) + key
+    return _fragment_cache.get_or_set(full_key, caller)
+
+
+def _csrf_epoch():
+    # Forms in a page carry a CSRF token that expires; change the ETag at half
+    # its lifetime so a revalidated page never holds a token that has run out.
+    limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    if not current_app.config.get("WTF_CSRF_ENABLED", True) or not limit:
+        return None
+    return int(time.time() // max(limit // 2, 1))
+
+
+class PageValidators:
+    """
+    ETag and Last-Modified for a page built from versioned rows, e.g.
+    ``PageValidators("book", book.id, book.version, last_modified=book.updated_at)``.
+
+    The ETag also covers who is looking and their session's CSRF token, so a
+    304 never gives one user's page to another or revives a stale form.
+    Responses are marked private and must be revalidated every time.
+    """
+
+    def __init__(self, *parts, last_modified=None):
+        from blueprints.auth import get_current_user
+        user = get_current_user()
+        viewer = (user.id, user.username, user.role) if user else None
+        generate_csrf()  # the page's forms will; the token must exist before it is fingerprinted
+        token = session.get(current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token"))
+        fingerprint = repr((viewer, token, _csrf_epoch(), parts))
+        self.etag = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+        self.last_modified = last_modified
+
+    @property
+    def fresh(self):
+        """True when the client's cached copy is still current."""
+        if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+            return False  # pending flash messages would be lost with a 304
+        return not is_resource_modified(request.environ, etag=self.etag, last_modified=self.last_modified)
+
+    def not_modified(self):
+        return self.apply(current_app.response_class(status=304))
+
+    def apply(self, response):
+        response.set_etag(self.etag)
+        if self.last_modified is not None:
+            response.last_modified = self.last_modified
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.vary.add("Cookie")
+        return response
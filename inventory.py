@@ -0,0 +1,99 @@
+import enum
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+import fines
+from extensions import db
+
+LOAN_PERIOD = timedelta(days=14)
+
+
+class BorrowResult(enum.Enum):
+    BORROWED = "borrowed"
+    UNAVAILABLE = "unavailable"
+    ALREADY_BORROWED = "already_borrowed"
+    NOT_FOUND = "not_found"
+
+
+class ReturnResult(enum.Enum):
+    RETURNED = "returned"
+    ALREADY_RETURNED = "already_returned"
+    NOT_FOUND = "not_found"
+
+
+def borrow(user_id, book_id, now=None):
+    """
+    Take one copy of a book and record the loan, committing on success.
+
+    The copy is claimed with a conditional ``UPDATE ... WHERE available_copies > 0``,
+    so concurrent borrowers can never take more copies than exist: whoever loses
+    the race sees zero rows updated and gets ``UNAVAILABLE``. A reader who still
+    has the book on loan gets ``ALREADY_BORROWED``; one who returned it may
+    borrow it again.
+
+    Returns ``(BorrowResult, Borrowing or None)``.
+    """
+    from models import Book, Borrowing
+    now = now or datetime.utcnow()
+    books = Book.__table__
+    claimed = db.session.execute(
+        books.update()
+        .where(books.c.id == book_id, books.c.available_copies > 0)
+        .values(available_copies=books.c.available_copies - 1, borrow_count=books.c.borrow_count + 1)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        if db.session.get(Book, book_id) is None:
+            return BorrowResult.NOT_FOUND, None
+        return BorrowResult.UNAVAILABLE, None
+
+    borrowing = Borrowing(user_id=user_id, book_id=book_id, borrowed_date=now, due_date=now + LOAN_PERIOD)
+    db.session.add(borrowing)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Rolling back also releases the claimed copy
+        db.session.rollback()
+        open_loan = db.session.query(Borrowing.id).filter_by(user_id=user_id, book_id=book_id, open_loan=True).first()
+        if open_loan is None:
+            raise  # not uq_active_borrow_per_user_book
+        return BorrowResult.ALREADY_BORROWED, None
+    return BorrowResult.BORROWED, borrowing
+
+
+def return_borrowing(borrowing_id, now=None):
+    """
+    Mark a loan returned and put its copy back, committing on success.
+
+    Only the request that flips ``is_returned`` from false to true restores the
+    copy, so a double-submitted return can't inflate ``available_copies``.
+
+    Returns ``(ReturnResult, Borrowing or None)``.
+    """
+    from models import Book, Borrowing
+    now = now or datetime.utcnow()
+    borrowing = db.session.get(Borrowing, borrowing_id)
+    if borrowing is None:
+        return ReturnResult.NOT_FOUND, None
+
+    loans, books = Borrowing.__table__, Book.__table__
+    flipped = db.session.execute(
+        loans.update()
+        .where(loans.c.id == borrowing_id, loans.c.is_returned.is_(False))
+        .values(is_returned=True, returned_date=now, open_loan=None)
+    ).rowcount
+    if not flipped:
+        db.session.rollback()
+        return ReturnResult.ALREADY_RETURNED, borrowing
+
+    db.session.execute(
+        books.update()
+        .where(books.c.id == borrowing.book_id)
+        .values(available_copies=books.c.available_copies + 1)
+    )
+    if borrowing.due_date is not None and borrowing.due_date < now:
+        # Late: settle the overdue days since the last sweep in the same transaction
+        fines.charge_on_return(borrowing_id, now)
+    db.session.commit()
+    return ReturnResult.RETURNED, borrowing
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.orm import contains_eager
+
+from extensions import db
+from tasks import background_tasks
+
+
+def _handler(kind):
+    # Imported lazily: the handlers schedule follow-up jobs themselves
+    if kind == "pdf":
+        from pdfs import process_pdf
+        return process_pdf
+    if kind == "cover":
+        return _process_cover
+    raise ValueError(f"Unknown job kind: {kind!r}")
+
+
+def _process_cover(book_id):
+    from covers import process_cover
+    return "Thumbnails ready" if process_cover(book_id) else "Cover left as uploaded"
+
+
+def _set_status(job_id, **values):
+    # An UPDATE rather than an ORM flush: the job row is gone if its book was deleted meanwhile
+    from models import ProcessingJob
+    ProcessingJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+    db.session.commit()
+
+
+def enqueue_job(kind, book_id):
+    """Record a queued job for a book and hand it to the background pool."""
+    from models import ProcessingJob
+    _handler(kind)
+    job = ProcessingJob(book_id=book_id, kind=kind, status="queued")
+    db.session.add(job)
+    db.session.commit()
+    background_tasks.submit(run_job, job.id)
+    return job
+
+
+def run_job(job_id):
+    """Run a queued job, recording its progress and outcome on the job row."""
+    from models import ProcessingJob
+    job = db.session.get(ProcessingJob, job_id)
+    if job is None or job.status != "queued":
+        return None
+    kind, book_id = job.kind, job.book_id
+    _set_status(job_id, status="running", started_at=datetime.utcnow())
+    try:
+        result = _handler(kind)(book_id)
+    except Exception as exc:
+        db.session.rollback()
+        _set_status(job_id, status="failed", detail=str(exc)[:255] or type(exc).__name__,
+                    finished_at=datetime.utcnow())
+        raise
+    _set_status(job_id, status="done", detail=result if isinstance(result, str) else None,
+                finished_at=datetime.utcnow())
+    return result
+
+
+def requeue_stalled(older_than=timedelta(minutes=10)):
+    """
+    Queue again any job left queued or running by a process that exited
+    before finishing it (the pool lives in the web process). Returns the
+    futures of the resubmitted jobs.
+    """
+    from models import ProcessingJob
+    cutoff = datetime.utcnow() - older_than
+    stalled = [
+        job_id for (job_id,) in db.session.query(ProcessingJob.id)
+        .filter(ProcessingJob.status.in_(("queued", "running")), ProcessingJob.created_at < cutoff)
+    ]
+    if stalled:
+        ProcessingJob.query.filter(ProcessingJob.id.in_(stalled)).update(
+            {"status": "queued", "started_at": None}, synchronize_session=False)
+        db.session.commit()
+    return [background_tasks.submit(run_job, job_id) for job_id in stalled]
+
+
+def recent_jobs(publisher_id, limit=10):
+    """The latest jobs on a publisher's books, newest first, with their books loaded."""
+    from models import Book, ProcessingJob
+    return (
+        ProcessingJob.query.join(Book)
+        .filter(Book.publisher_id == publisher_id)
+        .options(contains_eager(ProcessingJob.book))
+        .order_by(ProcessingJob.created_at.desc(), ProcessingJob.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+jobs_cli = AppGroup("jobs", help="Inspect and recover background processing jobs.")
+
+
+@jobs_cli.command("requeue")
+@click.option("--minutes", default=10, show_default=True, help="Only jobs created at least this long ago.")
+def requeue_command(minutes):
+    """Re-run jobs that were interrupted, e.g. by a restart."""
+    futures = requeue_stalled(timedelta(minutes=minutes))
+    failed = sum(1 for future in futures if future.exception() is not None)
+    click.echo(f"Re-ran {len(futures)} jobs; {failed} failed.")
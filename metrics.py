@@ -0,0 +1,245 @@
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import before_render_template, current_app, g, has_app_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram upper bounds: seconds for latency, statements for query counts
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    """What one request did: its statements, their timings and template time."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = {}  # SQL text -> [executions, total seconds, slowest]
+        self.query_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.finished = False
+        self._template_started = None
+
+    def add_query(self, statement, elapsed):
+        self.query_count += 1
+        self.db_time += elapsed
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+    def slowest(self, limit):
+        """The ``limit`` statements with the most total time, as (statement, count, seconds)."""
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [(statement, count, total) for statement, (count, total, _) in ranked[:limit]]
+
+    def repeated(self, threshold):
+        """Statements run at least ``threshold`` times: the shape of an N+1."""
+        return [(statement, entry[0]) for statement, entry in self.statements.items() if entry[0] >= threshold]
+
+
+class Histogram:
+    """Cumulative Prometheus-style buckets for one label set."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _short(statement, width=200):
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= width else statement[:width - 3] + "..."
+
+
+class RequestMetrics:
+    """
+    Per-request SQL and latency instrumentation. Every request records how
+    many statements it ran, the time spent in the database and in templates,
+    and feeds per-endpoint histograms served at /admin/metrics.
+
+    Requests slower than ``SLOW_REQUEST_MS`` are logged with their slowest
+    statements, and a statement repeated ``N_PLUS_ONE_THRESHOLD`` times in one
+    request is logged as a likely N+1. Like the caches, the numbers live in
+    the worker process, so each worker reports its own.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SLOW_REQUEST_MS", 500)
+        app.config.setdefault("N_PLUS_ONE_THRESHOLD", 5)
+        app.config.setdefault("SLOW_REQUEST_STATEMENTS", 3)  # statements quoted in a slow-request log line
+        app.config.setdefault("METRICS_TOKEN", None)  # lets a scraper read /admin/metrics without a session
+        app.extensions["request_metrics"] = self
+        app.before_request(_start_request)
+        app.after_request(_finish_response)
+        app.teardown_request(_finish_failed)
+        before_render_template.connect(_template_starting, app)
+        template_rendered.connect(_template_done, app)
+
+    def reset(self):
+        with self._lock:
+            self._requests = defaultdict(int)  # (endpoint, method, status) -> count
+            self._latency = {}                 # endpoint -> Histogram
+            self._queries = {}                 # endpoint -> Histogram
+            self._db_time = defaultdict(float)
+            self._template_time = defaultdict(float)
+            self._slow = defaultdict(int)
+            self._n_plus_one = defaultdict(int)
+
+    def token_matches(self, authorization):
+        token = current_app.config["METRICS_TOKEN"]
+        return bool(token) and hmac.compare_digest(authorization or "", f"Bearer {token}")
+
+    def record(self, stats, endpoint, method, status):
+        config = current_app.config
+        elapsed = time.perf_counter() - stats.started
+        repeated = stats.repeated(config["N_PLUS_ONE_THRESHOLD"])
+        slow = elapsed * 1000 >= config["SLOW_REQUEST_MS"]
+        with self._lock:
+            self._requests[endpoint, method, status] += 1
+            self._latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self._queries.setdefault(endpoint, Histogram(QUERY_BUCKETS)).observe(stats.query_count)
+            self._db_time[endpoint] += stats.db_time
+            self._template_time[endpoint] += stats.template_time
+            self._slow[endpoint] += slow
+            self._n_plus_one[endpoint] += bool(repeated)
+
+        for statement, count in repeated:
+            logger.warning("Likely N+1 in %s: ran %d times: %s", endpoint, count, _short(statement))
+        if slow:
+            slowest = "; ".join(
+                f"{total * 1000:.1f} ms x{count} {_short(statement, 120)}"
+                for statement, count, total in stats.slowest(config["SLOW_REQUEST_STATEMENTS"])
+            )
+            logger.warning(
+                "Slow request %s %s (%s) took %.0f ms: %d queries in %.0f ms, templates %.0f ms%s",
+                method, request.full_path.rstrip("?"), endpoint, elapsed * 1000, stats.query_count,
+                stats.db_time * 1000, stats.template_time * 1000, f"; slowest: {slowest}" if slowest else "",
+            )
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP kitabghar_requests_total Requests handled, by endpoint, method and status.",
+                "# TYPE kitabghar_requests_total counter",
+            ]
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'kitabghar_requests_total{{endpoint="{_label(endpoint)}",method="{method}",'
+                             f'status="{status}"}} {count}')
+            for name, help_text, histograms in (
+                ("kitabghar_request_duration_seconds", "Request latency by endpoint.", self._latency),
+                ("kitabghar_request_queries", "SQL statements per request by endpoint.", self._queries),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for endpoint, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.lines(name, f'endpoint="{_label(endpoint)}"'))
+            for name, kind, help_text, values, fmt in (
+                ("kitabghar_db_seconds_total", "counter", "Time spent running SQL.", self._db_time, "{:.6f}"),
+                ("kitabghar_template_seconds_total", "counter", "Time spent rendering templates.",
+                 self._template_time, "{:.6f}"),
+                ("kitabghar_slow_requests_total", "counter", "Requests slower than SLOW_REQUEST_MS.", self._slow, "{}"),
+                ("kitabghar_n_plus_one_requests_total", "counter",
+                 "Requests that repeated a statement N_PLUS_ONE_THRESHOLD times or more.", self._n_plus_one, "{}"),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {fmt.format(value)}')
+        return "\n".join(lines) + "\n"
+
+
+#==============================================================================
+# HOOKS
+#==============================================================================
+
+def _current_stats():
+    return g.get("request_stats") if has_app_context() else None
+
+
+def _start_request():
+    g.request_stats = RequestStats()
+
+
+def _finish(status):
+    stats = g.get("request_stats")
+    if stats is None or stats.finished:
+        return
+    stats.finished = True
+    # Unmatched URLs share one label so 404 probes can't grow the series without bound
+    endpoint = request.endpoint or "unmatched"
+    current_app.extensions["request_metrics"].record(stats, endpoint, request.method, status)
+
+
+def _finish_response(response):
+    _finish(response.status_code)
+    return response
+
+
+def _finish_failed(exc):
+    # Only reached unfinished when the request raised before a response was made
+    _finish(500)
+
+
+def _template_starting(sender, template, context, **extra):
+    stats = _current_stats()
+    if stats is not None:
+        stats._template_started = time.perf_counter()
+
+
+def _template_done(sender, template, context, **extra):
+    stats = _current_stats()
+    if stats is not None and stats._template_started is not None:
+        stats.template_time += time.perf_counter() - stats._template_started
+        stats._template_started = None
+
+
+# Listening on the Engine class covers every engine, including ones created lazily
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_starting(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_done(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats()
+    if stats is not None and not stats.finished and context is not None:
+        stats.add_query(statement, time.perf_counter() - context.query_started)
+
+
+request_metrics = RequestMetrics()
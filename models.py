@@ -1,6 +1,6 @@
 from datetime import datetime
-from sqlalchemy import UniqueConstraint, Index, CheckConstraint, ForeignKey
-from sqlalchemy.dialects.mysql import VARCHAR, INTEGER, TINYINT, TEXT
+from sqlalchemy import UniqueConstraint, Index, CheckConstraint, ForeignKey, event
+from sqlalchemy.dialects.mysql import TINYINT
 from sqlalchemy.orm import validates, relationship
 from extensions import db
 
@@ -9,12 +9,14 @@ class User(db.Model):
     __tablename__ = "users"
 
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(VARCHAR(100), unique=True, nullable=False)
-    email = db.Column(VARCHAR(255), unique=True, nullable=False)
-    password_hash = db.Column(VARCHAR(255), nullable=False)
-    role = db.Column(VARCHAR(20), nullable=False, default="user")
+    username = db.Column(db.String(100), unique=True, nullable=False)
+    email = db.Column(db.String(255), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    role = db.Column(db.String(20), nullable=False, default="user", index=True)  # dashboard counts by role
     is_active = db.Column(db.Boolean, default=True)  # Added this field
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Outstanding fines in minor currency units, kept in step with fine_ledger by fines.py
+    fines_balance = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # Relationships
     published_books = db.relationship("Book", backref="publisher", lazy=True, foreign_keys="Book.publisher_id")
@@ -35,7 +37,7 @@ class Category(db.Model):
     __tablename__ = "categories"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(VARCHAR(100), unique=True, nullable=False)
+    name = db.Column(db.String(100), unique=True, nullable=False)
 
     def __repr__(self):
         return f"<Category {self.name}>"
@@ -45,28 +47,62 @@ class Book(db.Model):
     __tablename__ = "books"
 
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(VARCHAR(200), nullable=False)
-    author = db.Column(VARCHAR(150), nullable=False)
-    isbn = db.Column(VARCHAR(20), unique=True, nullable=True) # Kept the VARCHAR version
-    description = db.Column(TEXT)
-    genre = db.Column(VARCHAR(100)) # Kept the VARCHAR version
-    category = db.Column(VARCHAR(100))
-    book_type = db.Column(VARCHAR(20), default="Physical") # Kept the VARCHAR version
-    cover_image = db.Column(VARCHAR(255))
-    pdf_file = db.Column(VARCHAR(255))
+    title = db.Column(db.String(200), nullable=False)
+    author = db.Column(db.String(150), nullable=False)
+    isbn = db.Column(db.String(20), unique=True, nullable=True) # Kept the VARCHAR version
+    description = db.Column(db.Text)
+    genre = db.Column(db.String(100)) # Kept the VARCHAR version
+    category = db.Column(db.String(100))
+    book_type = db.Column(db.String(20), default="Physical") # Kept the VARCHAR version
+    cover_image = db.Column(db.String(255))
+    cover_hash = db.Column(db.String(64))  # set once covers.py has built the resized variants
+    pdf_file = db.Column(db.String(255))
+    page_count = db.Column(db.Integer)  # filled in by the background PDF job
     publication_year = db.Column(db.Integer)
     publisher_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     total_copies = db.Column(db.Integer, nullable=False, default=1)
     available_copies = db.Column(db.Integer, nullable=False, default=1)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped by every UPDATE of the row, ORM or Core: edits, borrows and returns, new
+    # reviews (through the rating aggregates). ETags and fragment cache keys use them.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1",
+                        onupdate=db.literal_column("version") + 1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Loans ever taken out; incremented by inventory.borrow() with the copy it claims
+    borrow_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # Review aggregates, kept in step with the reviews table by the Review events below
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # Relationships
     borrowings = db.relationship("Borrowing", backref="book", lazy=True, cascade="all, delete-orphan")
     reviews = db.relationship("Review", backref="book", lazy=True, cascade="all, delete-orphan")
+    jobs = db.relationship("ProcessingJob", backref="book", lazy=True, cascade="all, delete-orphan")
 
     __table_args__ = (
         Index("ix_books_title", "title"),
         Index("ix_books_author", "author"),
+        Index("ix_books_created_at_id", "created_at", "id"),  # keyset pagination of the catalog
+        # A catalog filter or a publisher's books, still newest first; also serve the facet GROUP BYs
+        Index("ix_books_category_created", "category", "created_at", "id"),
+        Index("ix_books_genre_created", "genre", "created_at", "id"),
+        Index("ix_books_type_created", "book_type", "created_at", "id"),
+        Index("ix_books_publisher_created", "publisher_id", "created_at", "id"),
+        # "Most borrowed" sort of the catalog, overall and within a category
+        Index("ix_books_borrow_count_id", "borrow_count", "id"),
+        Index("ix_books_category_borrow_count", "category", "borrow_count", "id"),
+        # Backs catalog search on MySQL; other databases use search.py's own index.
+        Index(
+            "ft_books_search", "title", "author", "description", "genre", "isbn",
+            mysql_prefix="FULLTEXT",
+        ).ddl_if(dialect="mysql"),
         CheckConstraint("available_copies >= 0", name="ck_books_available_nonneg"),
     )
 
@@ -74,6 +110,15 @@ class Book(db.Model):
     def is_available(self) -> bool:
         return self.available_copies > 0
 
+    @property
+    def average_rating(self) -> float:
+        return self.rating_sum / self.rating_count if self.rating_count else 0.0
+
+    @property
+    def rating_histogram(self) -> dict:
+        """Number of reviews per star, e.g. {5: 12, 4: 3, ...}."""
+        return {stars: getattr(self, f"rating_{stars}") or 0 for stars in range(5, 0, -1)}
+
     def __repr__(self):
         return f"<Book {self.title} by {self.author}>"
 
@@ -88,11 +133,27 @@ class Borrowing(db.Model):
     due_date = db.Column(db.DateTime)  # Added this field
     returned_date = db.Column(db.DateTime)  # Added this field
     is_returned = db.Column(db.Boolean, default=False)  # Added this field
+    # True while the loan is open, NULL once returned. It is part of the unique key below, so a
+    # reader can have one open loan of a book; returned loans never collide, as NULLs don't
+    open_loan = db.Column(db.Boolean, default=True)
+    # Set once the overdue sweep has charged for this loan: the last day charged, and the total
+    fined_through = db.Column(db.Date)
+    fine_amount = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     __table_args__ = (
-        UniqueConstraint("user_id", "book_id", name="uq_active_borrow_per_user_book"),
+        UniqueConstraint("user_id", "book_id", "open_loan", name="uq_active_borrow_per_user_book"),
+        # Open loans by due date: the overdue report and sweep read a range of this
+        Index("ix_borrowings_open_due", "is_returned", "due_date"),
+        # Borrowing history, newest first: all loans, and one user's loans
+        Index("ix_borrowings_borrowed_date_id", "borrowed_date", "id"),
+        Index("ix_borrowings_user_borrowed_date", "user_id", "borrowed_date", "id"),
+        Index("ix_borrowings_book_borrowed_date", "book_id", "borrowed_date", "id"),
     )
 
+    @property
+    def is_overdue(self) -> bool:
+        return not self.is_returned and self.due_date is not None and self.due_date < datetime.utcnow()
+
     def __repr__(self):
         return f"<Borrowing u={self.user_id} b={self.book_id} returned={self.is_returned}>"
 
@@ -103,8 +164,9 @@ class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("books.id"), nullable=False)
-    rating = db.Column(TINYINT(unsigned=True), nullable=False)
-    content = db.Column(TEXT, nullable=False)  # Changed from comment
+    # TINYINT UNSIGNED on MySQL as before; a plain SMALLINT elsewhere, e.g. SQLite
+    rating = db.Column(db.SmallInteger().with_variant(TINYINT(unsigned=True), "mysql"), nullable=False)
+    content = db.Column(db.Text, nullable=False)  # Changed from comment
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     __table_args__ = (
@@ -114,4 +176,167 @@ class Review(db.Model):
     )
 
     def __repr__(self):
-        return f"<Review book={self.book_id} user={self.user_id} ★{self.rating}>"
\ No newline at end of file
+        return f"<Review book={self.book_id} user={self.user_id} ★{self.rating}>"
+
+def _adjust_book_rating(connection, book_id, rating, sign):
+    """Add (sign=1) or remove (sign=-1) one rating in a single UPDATE, so concurrent reviews can't lose counts."""
+    books = Book.__table__
+    star_column = books.c[f"rating_{rating}"]
+    connection.execute(
+        books.update()
+        .where(books.c.id == book_id)
+        .values({
+            books.c.rating_count: books.c.rating_count + sign,
+            books.c.rating_sum: books.c.rating_sum + sign * rating,
+            star_column: star_column + sign,
+        })
+    )
+
+@event.listens_for(Review, "after_insert")
+def _review_inserted(mapper, connection, review):
+    _adjust_book_rating(connection, review.book_id, review.rating, 1)
+
+@event.listens_for(Review, "after_delete")
+def _review_deleted(mapper, connection, review):
+    _adjust_book_rating(connection, review.book_id, review.rating, -1)
+
+@event.listens_for(Review, "after_update")
+def _review_updated(mapper, connection, review):
+    history = db.inspect(review).attrs.rating.history
+    if history.deleted and history.added:
+        _adjust_book_rating(connection, review.book_id, history.deleted[0], -1)
+        _adjust_book_rating(connection, review.book_id, history.added[0], 1)
+
+# ---------------- RECOMMENDATIONS ----------------
+class BookNeighbor(db.Model):
+    """
+    A book often borrowed by the same readers as ``book_id``: the top
+    neighbours per book, written by `flask recommendations rebuild`
+    (see recommendations.py).
+    """
+    __tablename__ = "book_neighbors"
+
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id", ondelete="CASCADE"), primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey("books.id", ondelete="CASCADE"), primary_key=True)
+    co_borrowers = db.Column(db.Integer, nullable=False)  # readers who borrowed both
+    score = db.Column(db.Float, nullable=False)  # cosine similarity of the two books' borrowers
+
+    __table_args__ = (
+        # A book's neighbours, best first: the book page reads the head of this range
+        Index("ix_book_neighbors_book_score", "book_id", "score"),
+    )
+
+    def __repr__(self):
+        return f"<BookNeighbor {self.book_id}->{self.neighbor_id} {self.score:.3f}>"
+
+# ---------------- POPULARITY ----------------
+class BookPopularity(db.Model):
+    """
+    Time-decayed activity per book (borrows, downloads, reviews), flushed from
+    the in-memory counters in popularity.py. Only books with activity have a row.
+    """
+    __tablename__ = "book_popularity"
+
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id", ondelete="CASCADE"), primary_key=True)
+    # Sum of event weights scaled by 2 ** (age of the event in half-lives since popularity.DECAY_EPOCH);
+    # ordering by it orders by the current decayed score without ever rewriting old rows. A DOUBLE,
+    # as the values pass a 4-byte FLOAT's range (2 ** 128) after 128 half-lives
+    trending = db.Column(db.Double, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_book_popularity_trending", "trending"),
+    )
+
+    def __repr__(self):
+        return f"<BookPopularity {self.book_id} {self.trending:.3g}>"
+
+# ---------------- DAILY STATS ----------------
+class DailyStat(db.Model):
+    """One pre-aggregated value per metric per day, filled by `flask stats rollup`."""
+    __tablename__ = "daily_stats"
+
+    metric = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DailyStat {self.metric} {self.day}={self.value}>"
+
+# ---------------- IMPORT CHECKPOINTS ----------------
+class ImportCheckpoint(db.Model):
+    """
+    How far `flask catalog import` got through a file. Saved in the same
+    transaction as each batch (see catalog.py), so a resumed run starts
+    exactly after the last committed batch.
+    """
+    __tablename__ = "import_checkpoints"
+
+    name = db.Column(db.String(255), primary_key=True)  # the input file's path unless --checkpoint names another
+    read = db.Column(db.Integer, nullable=False, default=0)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    duplicates = db.Column(db.Integer, nullable=False, default=0)
+    invalid = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ImportCheckpoint {self.name} read={self.read}>"
+
+# ---------------- PROCESSING JOBS ----------------
+class ProcessingJob(db.Model):
+    """Background work on a book's uploads (see jobs.py), shown on the publisher dashboard."""
+    __tablename__ = "processing_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id", ondelete="CASCADE"), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # "pdf" or "cover"
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    detail = db.Column(db.String(255))  # result summary, or the error for failed jobs
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        Index("ix_processing_jobs_book_id", "book_id"),
+        Index("ix_processing_jobs_status", "status"),
+    )
+
+    @validates("status")
+    def validate_status(self, key, value):
+        if value not in ("queued", "running", "done", "failed"):
+            raise ValueError("status must be one of: queued, running, done, failed")
+        return value
+
+    def __repr__(self):
+        return f"<ProcessingJob {self.kind} b={self.book_id} {self.status}>"
+
+# ---------------- FINE LEDGER ----------------
+class FineEntry(db.Model):
+    """
+    One change to a user's fines: a charge for overdue days (positive), or a
+    payment or waiver (negative). users.fines_balance is the running sum.
+    """
+    __tablename__ = "fine_ledger"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    borrowing_id = db.Column(db.Integer, db.ForeignKey("borrowings.id", ondelete="SET NULL"))
+    kind = db.Column(db.String(20), nullable=False)  # "charge", "payment" or "waiver"
+    amount = db.Column(db.Integer, nullable=False)  # minor currency units
+    days = db.Column(db.Integer)  # overdue days a charge covers
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship("User", backref=db.backref("fine_entries", lazy="dynamic", passive_deletes=True))
+
+    __table_args__ = (
+        Index("ix_fine_ledger_user_created", "user_id", "created_at", "id"),
+    )
+
+    @validates("kind")
+    def validate_kind(self, key, value):
+        if value not in ("charge", "payment", "waiver"):
+            raise ValueError("kind must be one of: charge, payment, waiver")
+        return value
+
+    def __repr__(self):
+        return f"<FineEntry u={self.user_id} {self.kind} {self.amount}>"
@@ -0,0 +1,109 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_, func, select
+
+
+def encode_cursor(values):
+    """Pack a row's sort-key values into an opaque, URL-safe token."""
+    packed = [{"dt": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(packed, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Unpack a token from encode_cursor(); returns None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        packed = json.loads(raw)
+        values = [datetime.fromisoformat(v["dt"]) if isinstance(v, dict) else v for v in packed]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def _seek_condition(columns, values, below):
+    """(c1, c2, ...) below (or above) ``values``, spelled out so every database can use the index."""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        beyond = column < values[i] if below else column > values[i]
+        clauses.append(and_(*equal_prefix, beyond))
+    return or_(*clauses)
+
+
+class KeysetPage:
+    """
+    One page of a keyset-paginated query. ``next_cursor``/``prev_cursor`` are
+    tokens for the neighbouring pages, or None at either end.
+    """
+
+    def __init__(self, items, next_cursor, prev_cursor, total=None, total_is_estimate=False):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, columns, per_page=20, after=None, before=None, count_limit=None, descending=True):
+    """
+    Paginate ``query`` newest-first by ``columns`` (e.g. ``(Book.created_at, Book.id)``),
+    which must end in a unique column and should be covered by one index.
+    ``descending=False`` pages oldest-first instead.
+
+    Pass the ``after`` token to move forward or ``before`` to move back. Each
+    page costs one indexed range scan, however deep it is. The total is only
+    counted when ``count_limit`` is set, and then at most that many rows are
+    counted; ``total_is_estimate`` is True when the limit was hit.
+    """
+    columns = list(columns)
+    after_values = decode_cursor(after, len(columns))
+    before_values = decode_cursor(before, len(columns)) if after_values is None else None
+    backwards = before_values is not None
+
+    page_query = query.order_by(None)
+    if after_values is not None:
+        page_query = page_query.filter(_seek_condition(columns, after_values, below=descending))
+    elif backwards:
+        page_query = page_query.filter(_seek_condition(columns, before_values, below=not descending))
+
+    ordering = [c.asc() for c in columns] if backwards == descending else [c.desc() for c in columns]
+    rows = page_query.order_by(*ordering).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(row):
+        return encode_cursor([getattr(row, c.key) for c in columns])
+
+    if backwards:
+        next_cursor = cursor_for(rows[-1]) if rows else None
+        prev_cursor = cursor_for(rows[0]) if rows and has_more else None
+    else:
+        next_cursor = cursor_for(rows[-1]) if rows and has_more else None
+        prev_cursor = cursor_for(rows[0]) if rows and after_values is not None else None
+
+    total, estimate = None, False
+    if count_limit:
+        capped = query.order_by(None).with_entities(columns[-1]).limit(count_limit + 1).subquery()
+        total = query.session.execute(select(func.count()).select_from(capped)).scalar()
+        if total > count_limit:
+            total, estimate = count_limit, True
+
+    return KeysetPage(rows, next_cursor, prev_cursor, total, estimate)
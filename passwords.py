@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from extensions import db
+from ratelimit import SlidingWindowLimiter
+
+
+class HashingBusy(RuntimeError):
+    """Every hashing slot stayed taken for PASSWORD_HASH_WAIT seconds."""
+
+
+# Passwords per pool task in hash_many(): small enough that a sign-in queued
+# behind a bulk import waits for a few hashes, not for the whole batch.
+BULK_CHUNK = 16
+
+
+def _hash_chunk(passwords, method):
+    return [generate_password_hash(password, method) for password in passwords]
+
+
+def _hash_prefix(password_hash):
+    # Werkzeug hashes look like "method$salt$hash", e.g. "scrypt:32768:8:1$..."
+    return password_hash.split("$", 1)[0]
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and checking on a small process pool, so a burst of
+    logins uses those CPUs instead of holding every request thread (and the
+    GIL) for the length of a hash.
+
+    At most ``PASSWORD_HASH_QUEUE`` hashes wait or run at once. A request that
+    can't get a slot within ``PASSWORD_HASH_WAIT`` seconds gets HashingBusy,
+    so overload turns into quick "try again" answers rather than a queue that
+    starves every other page. With ``PASSWORD_HASH_WORKERS`` set to 0 hashing
+    runs inline, which suits CLI commands and tests.
+
+    ``PASSWORD_HASH_METHOD`` is any Werkzeug method string. Stored hashes
+    made with other parameters are upgraded on the user's next login.
+    """
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._method_prefix = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+        app.config.setdefault("PASSWORD_HASH_WORKERS", min(os.cpu_count() or 1, 4))
+        app.config.setdefault("PASSWORD_HASH_QUEUE", 4 * max(app.config["PASSWORD_HASH_WORKERS"], 1))
+        app.config.setdefault("PASSWORD_HASH_WAIT", 3)
+        # Failed logins allowed per email and per client address in the window
+        app.config.setdefault("LOGIN_FAILURES_PER_EMAIL", 5)
+        app.config.setdefault("LOGIN_FAILURES_PER_IP", 20)
+        app.config.setdefault("LOGIN_FAILURE_WINDOW", 300)
+        app.extensions["password_hasher"] = self
+        app.extensions["login_limiters"] = {}
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                workers = current_app.config["PASSWORD_HASH_WORKERS"]
+                # forkserver/spawn rather than fork: the app process has threads running
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+                self._slots = threading.BoundedSemaphore(current_app.config["PASSWORD_HASH_QUEUE"])
+            return self._executor, self._slots
+
+    def _submit(self, executor, held, func, *args):
+        # ``held`` semaphores are already acquired; they're released once the task is done
+        try:
+            future = executor.submit(func, *args)
+        except BaseException:
+            for semaphore in held:
+                semaphore.release()
+            raise
+        future.add_done_callback(lambda _: [semaphore.release() for semaphore in held])
+        return future
+
+    def _run(self, func, *args):
+        if not current_app.config["PASSWORD_HASH_WORKERS"]:
+            return func(*args)
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=current_app.config["PASSWORD_HASH_WAIT"]):
+            raise HashingBusy()
+        return self._submit(executor, [slots], func, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, current_app.config["PASSWORD_HASH_METHOD"])
+
+    def hash_many(self, passwords, method=None):
+        """
+        Hash a list of passwords, spread over the pool; returns the hashes in
+        the same order. Meant for bulk jobs: it waits for slots rather than
+        failing, and keeps at most one task per worker in flight, so sign-ins
+        sharing the pool still get their turn.
+        """
+        method = method or current_app.config["PASSWORD_HASH_METHOD"]
+        chunks = [passwords[i:i + BULK_CHUNK] for i in range(0, len(passwords), BULK_CHUNK)]
+        workers = current_app.config["PASSWORD_HASH_WORKERS"]
+        if not workers:
+            return _hash_chunk(passwords, method)
+        executor, slots = self._pool()
+        in_flight = threading.BoundedSemaphore(workers)
+        futures = []
+        for chunk in chunks:
+            in_flight.acquire()
+            slots.acquire()
+            futures.append(self._submit(executor, [slots, in_flight], _hash_chunk, chunk, method))
+        return [password_hash for future in futures for password_hash in future.result()]
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if ``password_hash`` wasn't made with the configured method and parameters."""
+        method = current_app.config["PASSWORD_HASH_METHOD"]
+        if method not in self._method_prefix:
+            # Werkzeug fills in defaults (e.g. "scrypt" -> "scrypt:32768:8:1"); hash once to see them
+            self._method_prefix[method] = _hash_prefix(self.hash(""))
+        return _hash_prefix(password_hash) != self._method_prefix[method]
+
+    def upgrade(self, user_id, old_hash, password):
+        """
+        Re-hash a just-verified password with the current parameters. The
+        UPDATE only applies if the stored hash is still ``old_hash``, so it
+        can't undo a password change made meanwhile.
+        """
+        from models import User
+        users = User.__table__
+        db.session.execute(
+            users.update()
+            .where(users.c.id == user_id, users.c.password_hash == old_hash)
+            .values(password_hash=self.hash(password))
+        )
+        db.session.commit()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
+
+
+def _limiter(kind):
+    """The failed-login limiter per "email" or "ip", made from the config on first use."""
+    limiters = current_app.extensions["login_limiters"]
+    if kind not in limiters:
+        limit = current_app.config["LOGIN_FAILURES_PER_EMAIL" if kind == "email" else "LOGIN_FAILURES_PER_IP"]
+        limiters.setdefault(kind, SlidingWindowLimiter(limit, current_app.config["LOGIN_FAILURE_WINDOW"]))
+    return limiters[kind]
+
+
+def login_blocked_for(email, ip):
+    """Seconds the client must wait before trying this email again; 0 if it may try now."""
+    return max(_limiter("email").retry_after((email or "").lower()), _limiter("ip").retry_after(ip))
+
+
+def record_login_failure(email, ip):
+    _limiter("email").hit((email or "").lower())
+    _limiter("ip").hit(ip)
+
+
+def clear_login_failures(email):
+    _limiter("email").reset((email or "").lower())
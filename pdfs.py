@@ -0,0 +1,110 @@
+import io
+import logging
+import re
+
+from extensions import db
+from storage import upload_storage
+
+try:
+    import pypdf
+except ImportError:  # optional; without it PDFs get the basic structural check below
+    pypdf = None
+
+try:
+    import fitz  # PyMuPDF, optional; renders the first-page preview
+except ImportError:
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_ZOOM = 1.5  # renders a typical page at roughly 900x1260 before covers.py resizes it
+_PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+class InvalidPDF(ValueError):
+    """The uploaded file is not a readable PDF."""
+
+
+def _scan_pdf(fileobj):
+    # Header, trailer and a count of page objects. Pages inside compressed
+    # object streams aren't visible this way, so a count of 0 means "unknown".
+    if not fileobj.read(1024).lstrip().startswith(b"%PDF-"):
+        raise InvalidPDF("missing %PDF header")
+    fileobj.seek(0, io.SEEK_END)
+    fileobj.seek(max(fileobj.tell() - 2048, 0))
+    if b"%%EOF" not in fileobj.read():
+        raise InvalidPDF("missing %%EOF trailer; the file may be truncated")
+    fileobj.seek(0)
+    pages, carry = 0, b""
+    for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+        data = carry + chunk
+        # Matches near the end are left for the next round, so one split across chunks counts once
+        cut = max(len(data) - 32, 0)
+        pages += sum(1 for match in _PAGE_RE.finditer(data) if match.start() < cut)
+        carry = data[cut:]
+    pages += len(_PAGE_RE.findall(carry))
+    return {"page_count": pages or None, "title": None, "author": None}
+
+
+def inspect_pdf(fileobj):
+    """
+    Validate a PDF and return ``{"page_count", "title", "author"}`` (any of
+    them may be None). Raises InvalidPDF for files that can't be read.
+    """
+    if pypdf is None:
+        return _scan_pdf(fileobj)
+    try:
+        reader = pypdf.PdfReader(fileobj)
+        if reader.is_encrypted:
+            raise InvalidPDF("the PDF is password protected")
+        metadata = reader.metadata or {}
+        return {
+            "page_count": len(reader.pages),
+            "title": metadata.get("/Title"),
+            "author": metadata.get("/Author"),
+        }
+    except pypdf.errors.PdfReadError as exc:
+        raise InvalidPDF(str(exc)) from exc
+
+
+def render_preview(path):
+    """PNG bytes of the first page, or None when PyMuPDF isn't installed."""
+    if fitz is None:
+        return None
+    with fitz.open(path) as document:
+        if document.page_count == 0:
+            return None
+        pixmap = document[0].get_pixmap(matrix=fitz.Matrix(PREVIEW_ZOOM, PREVIEW_ZOOM))
+        return pixmap.tobytes("png")
+
+
+def process_pdf(book_id):
+    """
+    Validate a book's PDF and record its page count. Books uploaded without
+    a cover get the rendered first page as one. Returns a short summary for
+    the job list; raises InvalidPDF if the file is unusable.
+    """
+    from covers import schedule_cover_processing
+    from models import Book
+    book = db.session.get(Book, book_id)
+    if book is None or not book.pdf_file:
+        return None
+    with upload_storage.pdfs.open(book.pdf_file) as fh:
+        info = inspect_pdf(fh)
+    book.page_count = info["page_count"]
+
+    preview = None
+    path = upload_storage.pdfs.local_path(book.pdf_file)
+    if not book.cover_image and path:
+        try:
+            preview = render_preview(path)
+        except Exception:  # a preview is a nicety; never fail the job over it
+            logger.exception("Could not render a preview of %s", book.pdf_file)
+    if preview:
+        book.cover_image, _ = upload_storage.covers.save(io.BytesIO(preview), "png")
+    db.session.commit()
+    if preview:
+        schedule_cover_processing(book.id)
+
+    summary = f"{info['page_count']} pages" if info["page_count"] else "Valid PDF"
+    return summary + (", preview used as cover" if preview else "")
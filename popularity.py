@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from cache import TTLCache
+from extensions import db
+from pagination import KeysetPage, decode_cursor, encode_cursor
+from tasks import background_tasks
+
+# Trending values are stored relative to this moment (see models.BookPopularity).
+# The DOUBLE column holds up to ~2 ** 1024, so they overflow 1023 half-lives after
+# it: ~19.6 years with the default 7-day half-life, proportionally less with a shorter one.
+DECAY_EPOCH = datetime(2025, 1, 1)
+FETCH_SIZE = 10_000
+
+# Per-category top lists, rebuilt from book_popularity at most once per flush interval
+_top_lists = TTLCache(maxsize=16, ttl=60)
+
+
+def _scale(at):
+    half_life = current_app.config["TRENDING_HALF_LIFE_DAYS"] * 86400
+    return 2.0 ** ((at - DECAY_EPOCH).total_seconds() / half_life)
+
+
+def decayed(stored, now=None):
+    """A stored trending value as a score at ``now``: each event's weight halves every half-life."""
+    return stored / _scale(now or datetime.utcnow())
+
+
+class PopularityCounter:
+    """
+    Collects borrow, download and review events in memory and adds them to
+    book_popularity in one batch every ``POPULARITY_FLUSH_SECONDS``, on the
+    background pool, instead of writing a row per request.
+
+    The first event after a flush starts a timer for the next one, so counts
+    are written within the interval even if the worker then goes quiet.
+    Each worker process keeps its own pending counts and adds them to the
+    stored values, so flushes from several workers sum up. Events a process
+    hadn't flushed when it exits are lost, which a ranking can afford;
+    `flask popularity rebuild` recomputes the borrows and reviews.
+    """
+
+    def __init__(self, app=None):
+        self._pending = defaultdict(float)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("POPULARITY_FLUSH_SECONDS", 60)
+        app.config.setdefault("TRENDING_HALF_LIFE_DAYS", 7)
+        app.config.setdefault("TRENDING_TOP_N", 200)
+        app.config.setdefault("TRENDING_WEIGHTS", {"borrow": 3.0, "review": 2.0, "download": 1.0})
+        app.extensions["popularity"] = self
+
+    def record(self, event, book_id, at=None):
+        """Count one ``event`` ("borrow", "download" or "review") for a book."""
+        value = current_app.config["TRENDING_WEIGHTS"][event] * _scale(at or datetime.utcnow())
+        with self._lock:
+            self._pending[book_id] += value
+            if self._timer is None:
+                self._schedule(current_app._get_current_object())
+
+    def _schedule(self, app):
+        # Called with the lock held, when there are pending counts and no timer
+        delay = max(app.config["POPULARITY_FLUSH_SECONDS"] - (time.monotonic() - self._last_flush), 0)
+        self._timer = threading.Timer(delay, self._flush_due, args=(app,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_due(self, app):
+        with app.app_context():
+            background_tasks.submit(self._timed_flush, app)
+
+    def _timed_flush(self, app):
+        try:
+            return self.flush()
+        finally:
+            with self._lock:
+                self._timer = None
+                if self._pending:  # counted during the flush, or kept after a failed one
+                    self._schedule(app)
+
+    def flush(self):
+        """Add the pending counts to book_popularity now; returns the number of books updated."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = time.monotonic()
+        try:
+            if pending:
+                _add_to_rollup(pending)
+        except Exception:
+            with self._lock:  # keep the counts for the next flush
+                for book_id, value in pending.items():
+                    self._pending[book_id] += value
+            raise
+        return len(pending)
+
+
+popularity_counter = PopularityCounter()
+
+
+def _add_to_rollup(deltas, attempts=3):
+    from models import Book, BookPopularity
+    table = BookPopularity.__table__
+    now = datetime.utcnow()
+    for attempt in range(attempts):
+        existing = set(db.session.scalars(select(table.c.book_id).where(table.c.book_id.in_(deltas))))
+        if existing:
+            # Relative to the stored value, so concurrent flushes from other workers add up
+            db.session.execute(
+                table.update().where(table.c.book_id == bindparam("b_book_id"))
+                .values(trending=table.c.trending + bindparam("b_delta"), updated_at=now),
+                [{"b_book_id": book_id, "b_delta": deltas[book_id]} for book_id in existing],
+            )
+        new = set(deltas) - existing
+        if new:
+            new &= set(db.session.scalars(select(Book.id).where(Book.id.in_(new))))  # skip deleted books
+        try:
+            if new:
+                db.session.execute(insert(table), [
+                    {"book_id": book_id, "trending": deltas[book_id], "updated_at": now} for book_id in new
+                ])
+            db.session.commit()
+            return
+        except IntegrityError:
+            # Another worker created one of these rows first; start over so it is updated instead
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+
+
+#==============================================================================
+# SERVING
+#==============================================================================
+
+def _compute_top_lists(limit):
+    from models import Book, BookPopularity
+    order = (BookPopularity.trending.desc(), BookPopularity.book_id.desc())
+    ranked = (
+        select(
+            BookPopularity.book_id, Book.category,
+            func.row_number().over(partition_by=Book.category, order_by=order).label("position"),
+        )
+        .join(Book, Book.id == BookPopularity.book_id)
+        .subquery()
+    )
+    by_category = defaultdict(list)
+    for book_id, category, _ in db.session.execute(
+        select(ranked).where(ranked.c.position <= limit).order_by(ranked.c.category, ranked.c.position)
+    ):
+        by_category[category].append(book_id)
+    overall = list(db.session.scalars(select(BookPopularity.book_id).order_by(*order).limit(limit)))
+    return {"all": overall, "by_category": dict(by_category)}
+
+
+def trending_ids(category=None):
+    """
+    Ids of the ``TRENDING_TOP_N`` most active books, overall or in one
+    category, best first. All the lists come from one query, cached for the
+    flush interval, so sorting by trend costs an in-memory slice.
+    """
+    key = ("trending", current_app.config["SQLALCHEMY_DATABASE_URI"])
+    lists = _top_lists.get_or_set(
+        key, lambda: _compute_top_lists(current_app.config["TRENDING_TOP_N"]),
+        ttl=current_app.config["POPULARITY_FLUSH_SECONDS"],
+    )
+    return lists["all"] if category is None else lists["by_category"].get(category, [])
+
+
+def trending_page(query, category=None, per_page=20, after=None, before=None):
+    """
+    A page of the books ``query`` matches, in trending order, taken from the
+    precomputed top list (so at most ``TRENDING_TOP_N`` books are ranked).
+    Filters in ``query`` beyond the category are applied to the list with
+    one primary-key lookup. Cursors are positions in the list, in
+    keyset_paginate's format, so the catalog template pages it the same way.
+    """
+    from models import Book
+    ids = trending_ids(category)
+    if ids:
+        matching = {book_id for (book_id,) in query.with_entities(Book.id).filter(Book.id.in_(ids)).order_by(None)}
+        ids = [book_id for book_id in ids if book_id in matching]
+
+    after_position, before_position = decode_cursor(after, 1), decode_cursor(before, 1)
+    if after_position is not None and isinstance(after_position[0], int):
+        start = after_position[0] + 1
+    elif before_position is not None and isinstance(before_position[0], int):
+        start = before_position[0] - per_page
+    else:
+        start = 0
+    start = min(max(start, 0), len(ids))
+    page_ids = ids[start:start + per_page]
+    books = {book.id: book for book in query.filter(Book.id.in_(page_ids)).order_by(None)} if page_ids else {}
+
+    end = start + len(page_ids)
+    return KeysetPage(
+        [books[book_id] for book_id in page_ids if book_id in books],
+        next_cursor=encode_cursor([end - 1]) if end < len(ids) else None,
+        prev_cursor=encode_cursor([start]) if start > 0 else None,
+        total=len(ids),
+    )
+
+
+#==============================================================================
+# REBUILD
+#==============================================================================
+
+def rebuild_popularity(now=None, batch_size=5000):
+    """
+    Recompute book_popularity from the borrowings and reviews of the last ten
+    half-lives (older events add under 0.1%), e.g. after changing the half-life
+    or the weights. Downloads aren't stored anywhere else, so their past share
+    is dropped. Returns the number of books with a score.
+    """
+    from models import Borrowing, BookPopularity, Review
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=10 * current_app.config["TRENDING_HALF_LIFE_DAYS"])
+    weights = current_app.config["TRENDING_WEIGHTS"]
+    scores = defaultdict(float)
+    for event, model, column in (("borrow", Borrowing, Borrowing.borrowed_date), ("review", Review, Review.created_at)):
+        rows = db.session.execute(
+            select(model.book_id, column).where(column >= since).execution_options(yield_per=FETCH_SIZE)
+        )
+        for book_id, at in rows:
+            scores[book_id] += weights[event] * _scale(at)
+
+    table = BookPopularity.__table__
+    db.session.execute(delete(table))
+    rows = [{"book_id": book_id, "trending": score, "updated_at": now} for book_id, score in scores.items()]
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(table), rows[start:start + batch_size])
+    db.session.commit()
+    _top_lists.clear()
+    return len(rows)
+
+
+#==============================================================================
+# CLI
+#==============================================================================
+
+popularity_cli = AppGroup("popularity", help="Trending and popularity rankings.")
+
+
+@popularity_cli.command("rebuild")
+def rebuild_command():
+    """Recompute trending scores from recent borrowings and reviews."""
+    started = time.perf_counter()
+    count = rebuild_popularity()
+    click.echo(f"Scored {count:,} books in {time.perf_counter() - started:.1f}s.")
+
+
+@popularity_cli.command("top")
+@click.option("--category", help="Only this category.")
+@click.option("--limit", default=10, show_default=True)
+def top_command(category, limit):
+    """Show the current trending books with their decayed scores."""
+    from models import Book, BookPopularity
+    ids = trending_ids(category)[:limit]
+    rows = {book.id: book for book in Book.query.filter(Book.id.in_(ids))}
+    scores = dict(db.session.execute(select(BookPopularity.book_id, BookPopularity.trending)
+                                     .where(BookPopularity.book_id.in_(ids))).all())
+    for rank, book_id in enumerate(ids, start=1):
+        book = rows.get(book_id)
+        if book is not None:
+            click.echo(f"{rank:>3}. {decayed(scores[book_id]):8.2f}  {book.title} ({book.category})")
@@ -0,0 +1,217 @@
+import codecs
+import csv
+import io
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from passwords import password_hasher
+from validators import validate_user_data
+
+USER_FIELDS = ("username", "email", "password", "role")
+REQUIRED_FIELDS = ("username", "email", "password")
+REPORT_HEADER = ("row", "username", "email", "errors")
+
+
+def read_user_csv(lines):
+    """
+    Records from CSV text ``lines`` (any iterable of str), with headers
+    normalized like the catalog import's. The header is read at once, and
+    ValueError raised if a required column is missing; the rows are read lazily.
+    """
+    reader = csv.DictReader(lines)
+    headers = {(name or "").strip().lower() for name in reader.fieldnames or ()}
+    missing = [field for field in REQUIRED_FIELDS if field not in headers]
+    if missing:
+        raise ValueError(f"The CSV has no {', '.join(missing)} column.")
+    return ({(key or "").strip().lower(): value for key, value in row.items()} for row in reader)
+
+
+def upload_lines(stream):
+    """Text lines of an uploaded file's binary ``stream``, decoded as it is read."""
+    return codecs.iterdecode(iter(stream.readline, b""), "utf-8-sig")
+
+
+class ProvisionStats:
+    def __init__(self):
+        self.read = self.created = self.duplicates = self.invalid = 0
+        self.started, self.finished = time.perf_counter(), None
+
+    @property
+    def rate(self):
+        """Rows per second over the whole run, hashing included."""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return self.read / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.read:,} read, {self.created:,} created, {self.duplicates:,} duplicates, "
+                f"{self.invalid:,} invalid ({self.rate:,.0f} users/s)")
+
+
+class UserProvisioner:
+    """
+    Creates accounts from a stream of records, a batch at a time.
+
+    Per batch: rows are checked with the registration rules, usernames and
+    emails already taken (earlier in the file, or in ``users``) are found with
+    one ``IN`` query per column, the remaining passwords are hashed across the
+    password pool, and the batch goes in as one multi-row INSERT. Nothing is
+    hashed for a row that is going to be rejected.
+
+    ``run()`` yields ``(row_number, record, errors)`` for every rejected row as
+    it goes, so the report can be streamed; ``stats`` holds the counts.
+    """
+
+    def __init__(self, batch_size=1000, default_role="user", hash_method=None, progress=None):
+        self.batch_size = batch_size
+        self.default_role = default_role
+        self.hash_method = hash_method
+        self.progress = progress
+        self.stats = ProvisionStats()
+        self._seen_usernames, self._seen_emails = set(), set()
+
+    def run(self, records):
+        batch = []
+        for number, record in enumerate(records, start=1):
+            self.stats.read += 1
+            data = {field: (record.get(field) or "").strip() for field in USER_FIELDS}
+            data["role"] = data["role"].lower() or self.default_role
+            errors = validate_user_data(data)
+            if errors:
+                self.stats.invalid += 1
+                yield number, record, errors
+                continue
+            batch.append((number, record, data))
+            if len(batch) >= self.batch_size:
+                yield from self._flush(batch)
+                batch = []
+        if batch:
+            yield from self._flush(batch)
+        self.stats.finished = time.perf_counter()
+        if self.progress:
+            self.progress(self.stats)
+
+    def _taken(self, batch):
+        from models import User
+        usernames = {data["username"] for _, _, data in batch}
+        emails = {data["email"] for _, _, data in batch}
+        # The database's collation decides what counts as the same name; these are
+        # compared as given, and case-insensitively within the file below
+        taken_usernames = {name.lower() for name in db.session.scalars(
+            select(User.username).where(User.username.in_(usernames)))}
+        taken_emails = {email.lower() for email in db.session.scalars(
+            select(User.email).where(User.email.in_(emails)))}
+        return taken_usernames | self._seen_usernames, taken_emails | self._seen_emails
+
+    def _flush(self, batch):
+        from models import User
+        taken_usernames, taken_emails = self._taken(batch)
+        accepted = []
+        for number, record, data in batch:
+            errors = []
+            if data["username"].lower() in taken_usernames:
+                errors.append("That username is already taken.")
+            if data["email"].lower() in taken_emails:
+                errors.append("An account with that email already exists.")
+            if errors:
+                self.stats.duplicates += 1
+                yield number, record, errors
+                continue
+            taken_usernames.add(data["username"].lower())
+            taken_emails.add(data["email"].lower())
+            accepted.append((number, record, data))
+
+        self._seen_usernames.update(data["username"].lower() for _, _, data in accepted)
+        self._seen_emails.update(data["email"].lower() for _, _, data in accepted)
+        hashes = password_hasher.hash_many([data["password"] for _, _, data in accepted], self.hash_method)
+        rows = [
+            dict(username=data["username"], email=data["email"], password_hash=password_hash, role=data["role"])
+            for (_, _, data), password_hash in zip(accepted, hashes)
+        ]
+        if rows:
+            try:
+                db.session.execute(insert(User.__table__), rows)
+                db.session.commit()
+                self.stats.created += len(rows)
+            except IntegrityError:
+                # Someone registered one of these names since the check: insert one by
+                # one so only the clashing rows are rejected
+                db.session.rollback()
+                for (number, record, _), row in zip(accepted, rows):
+                    try:
+                        db.session.execute(insert(User.__table__), row)
+                        db.session.commit()
+                        self.stats.created += 1
+                    except IntegrityError:
+                        db.session.rollback()
+                        self.stats.duplicates += 1
+                        yield number, record, ["That username or email was taken during the import."]
+        if self.progress:
+            self.progress(self.stats)
+
+
+def report_csv(provisioner, records):
+    """
+    Run ``provisioner`` over ``records``, yielding the report as CSV text as it
+    goes: one line per rejected row, then a last line with the totals.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPORT_HEADER)
+    for number, record, errors in provisioner.run(records):
+        writer.writerow((number, record.get("username") or "", record.get("email") or "", " ".join(errors)))
+        if buffer.tell() >= 16 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    writer.writerow(("", "", "", f"Done: {provisioner.stats}."))
+    yield buffer.getvalue()
+
+
+#==============================================================================
+# CLI
+#==============================================================================
+
+users_cli = AppGroup("users", help="Bulk account provisioning.")
+
+
+@users_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=1000, show_default=True, help="Rows per uniqueness check, INSERT and commit.")
+@click.option("--role", "default_role", type=click.Choice(("user", "publisher")), default="user", show_default=True,
+              help="Role for rows without a role column.")
+@click.option("--workers", type=int, help="Hashing processes  [default: one per CPU]")
+@click.option("--hash-method", help="Werkzeug hash method for the imported passwords  [default: PASSWORD_HASH_METHOD]")
+@click.option("--report", type=click.File("w"), help="Write rejected rows and their errors here as CSV.")
+def import_command(path, batch_size, default_role, workers, hash_method, report):
+    """Create accounts from a CSV with username, email, password and optional role columns.
+
+    Rows that are invalid, or whose username or email is taken, are skipped and
+    listed in --report. A cheaper --hash-method makes a large import much faster;
+    those hashes are upgraded to PASSWORD_HASH_METHOD as each user signs in.
+    """
+    workers = workers if workers is not None else os.cpu_count() or 1
+    current_app.config["PASSWORD_HASH_WORKERS"] = workers
+    current_app.config["PASSWORD_HASH_QUEUE"] = max(current_app.config["PASSWORD_HASH_QUEUE"], workers)
+
+    provisioner = UserProvisioner(batch_size, default_role, hash_method,
+                                  progress=lambda s: click.echo(f"\r{s}", nl=False))
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as fh:
+            try:
+                records = read_user_csv(fh)
+            except ValueError as exc:
+                raise click.ClickException(str(exc))
+            for chunk in report_csv(provisioner, records):
+                if report:
+                    report.write(chunk)
+    finally:
+        password_hasher.shutdown()
+    click.echo()
+    click.echo(f"Done: {provisioner.stats}.")
@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class SlidingWindowLimiter:
+    """
+    Counts events per key over the last ``window`` seconds and says when a key
+    has reached ``limit``. Keys are kept LRU-bounded to ``maxkeys`` so a flood
+    of distinct keys can't grow memory without bound. Like the caches, it
+    lives in the worker process.
+    """
+
+    def __init__(self, limit, window, maxkeys=100_000):
+        self.limit = limit
+        self.window = window
+        self.maxkeys = maxkeys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def retry_after(self, key):
+        """Seconds until ``key`` is under its limit again; 0 if it is now."""
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is None or len(events) < self.limit:
+                return 0
+            return max(events[0] + self.window - now, 0)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._recent(key, now)
+            if events is None:
+                # Only the last ``limit`` events decide anything, so no more are kept
+                events = self._events[key] = deque(maxlen=self.limit)
+            events.append(now)
+            self._events.move_to_end(key)
+            while len(self._events) > self.maxkeys:
+                self._events.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
@@ -0,0 +1,44 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, func, select
+
+from extensions import db
+
+STAR_COLUMNS = [f"rating_{stars}" for stars in range(1, 6)]
+
+
+def rebuild_rating_aggregates():
+    """
+    Recompute every book's rating_count, rating_sum and per-star counts from
+    the reviews table in one statement, like stats.rebuild_borrow_counts.
+    Returns the number of books that have reviews.
+    """
+    from models import Book, Review
+    books = Book.__table__
+
+    def reviews_of_book(value):
+        return (
+            select(func.coalesce(func.sum(value), 0))
+            .where(Review.book_id == books.c.id)
+            .scalar_subquery()
+        )
+
+    values = {
+        "rating_count": reviews_of_book(1),
+        "rating_sum": reviews_of_book(Review.rating),
+    }
+    values.update({name: reviews_of_book(case((Review.rating == stars, 1), else_=0))
+                   for stars, name in enumerate(STAR_COLUMNS, start=1)})
+    db.session.execute(books.update().values(values))
+    return db.session.scalar(select(func.count(func.distinct(Review.book_id))))
+
+
+ratings_cli = AppGroup("ratings", help="Maintain the rating aggregates stored on books.")
+
+
+@ratings_cli.command("rebuild")
+def rebuild_command():
+    """Backfill or repair book rating aggregates from the reviews table."""
+    rebuilt = rebuild_rating_aggregates()
+    db.session.commit()
+    click.echo(f"Rebuilt rating aggregates for {rebuilt} reviewed books.")
@@ -0,0 +1,297 @@
+import math
+import time
+from array import array
+from collections import defaultdict
+from heapq import nlargest
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, select
+
+from extensions import db
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional; without them the rebuild runs in pure Python, fine for small libraries
+    np = sparse = None
+
+FETCH_SIZE = 50_000  # borrowings fetched per round trip while loading
+
+
+def _config(name):
+    return current_app.config[f"RECOMMENDATIONS_{name}"]
+
+
+#==============================================================================
+# SERVING
+#==============================================================================
+
+def also_borrowed(book_id, limit=None):
+    """
+    Books most often borrowed by readers of ``book_id``, best match first: the
+    head of one ix_book_neighbors_book_score range, joined to the books.
+    """
+    from models import Book, BookNeighbor
+    return (
+        Book.query.join(BookNeighbor, BookNeighbor.neighbor_id == Book.id)
+        .filter(BookNeighbor.book_id == book_id)
+        .order_by(BookNeighbor.score.desc())
+        .limit(limit or _config("TOP_K"))
+        .all()
+    )
+
+
+#==============================================================================
+# BATCH BUILD
+#==============================================================================
+
+class BuildStats:
+    def __init__(self):
+        self.borrowings = self.readers = self.skipped_readers = self.books = self.pairs = 0
+        self.started, self.finished = time.perf_counter(), None
+
+    def __str__(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return (f"{self.borrowings:,} borrowings by {self.readers:,} readers "
+                f"({self.skipped_readers:,} with more than the basket limit left out); "
+                f"{self.pairs:,} neighbours for {self.books:,} books in {elapsed:.1f}s")
+
+
+def _load_loans(stats):
+    """
+    Every distinct (user_id, book_id) loan, in two parallel int32 arrays read a
+    batch at a time off the covering uq_active_borrow_per_user_book index (a
+    book borrowed again after returning it counts once). 8 bytes per loan is
+    the only memory that grows with the borrowings table.
+    """
+    from models import Borrowing
+    total = db.session.scalar(select(func.count()).select_from(Borrowing))
+    if np is not None:
+        users, books = np.empty(total, dtype=np.int32), np.empty(total, dtype=np.int32)
+    else:
+        users, books = array("i"), array("i")
+    loaded = 0
+    result = db.session.execute(
+        select(Borrowing.user_id, Borrowing.book_id).distinct().order_by(Borrowing.user_id, Borrowing.book_id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+    for rows in result.partitions():
+        if np is not None:
+            chunk = np.array(rows, dtype=np.int32).reshape(-1, 2)[:total - loaded]
+            users[loaded:loaded + len(chunk)], books[loaded:loaded + len(chunk)] = chunk[:, 0], chunk[:, 1]
+            loaded += len(chunk)
+        else:
+            for user_id, book_id in rows:
+                users.append(user_id)
+                books.append(book_id)
+    if np is not None:
+        users, books = users[:loaded], books[:loaded]  # repeat loans and rows deleted since the count
+    stats.borrowings = len(users)
+    return users, books
+
+
+def _top_k(neighbors, scores, counts, top_k):
+    """``[(neighbor, co_borrowers, score), ...]`` for the ``top_k`` best scores."""
+    best = nlargest(top_k, range(len(neighbors)), key=scores.__getitem__)
+    return [(int(neighbors[i]), int(counts[i]), float(scores[i])) for i in best]
+
+
+def _neighbors_scipy(users, books, n_books, stats, top_k, min_co, max_basket, block_pairs):
+    """
+    Item-item cosine similarity from the sparse reader x book matrix X: the
+    co-borrow counts of a block of books are X[:, block]^T @ X. Blocks are cut
+    so each holds at most about ``block_pairs`` partial products, which bounds
+    the memory of the multiplication however popular the books are.
+    """
+    basket = np.bincount(users)
+    keep = basket[users] <= max_basket
+    stats.readers = int(np.count_nonzero(basket))
+    stats.skipped_readers = int(np.count_nonzero(basket > max_basket))
+    users, books = users[keep], books[keep]
+    shape = (int(users.max()) + 1 if len(users) else 0, n_books)
+    ones = np.ones(len(users), dtype=np.int32)
+    by_reader = sparse.csr_matrix((ones, (users, books)), shape=shape)
+    by_book = by_reader.T.tocsr()
+    borrowers = np.diff(by_book.indptr)
+    # Partial products a book's row of the co-borrow matrix takes: its readers' basket sizes, summed
+    work = by_book @ np.diff(by_reader.indptr).astype(np.int64)
+
+    start = 0
+    while start < shape[1]:
+        end = start + 1
+        budget = work[start]
+        while end < shape[1] and budget + work[end] <= block_pairs:
+            budget += work[end]
+            end += 1
+        co = (by_book[start:end] @ by_reader).tocsr()
+        for offset in range(end - start):
+            book_id = start + offset
+            row = slice(co.indptr[offset], co.indptr[offset + 1])
+            neighbors, counts = co.indices[row], co.data[row]
+            mask = (neighbors != book_id) & (counts >= min_co)
+            neighbors, counts = neighbors[mask], counts[mask]
+            if len(neighbors):
+                scores = counts / np.sqrt(borrowers[book_id] * borrowers[neighbors].astype(np.float64))
+                if len(neighbors) > top_k:
+                    best = np.argpartition(-scores, top_k - 1)[:top_k]
+                    neighbors, counts, scores = neighbors[best], counts[best], scores[best]
+                yield book_id, _top_k(neighbors, scores, counts, top_k)
+            else:
+                yield book_id, []
+        start = end
+
+
+def _neighbors_python(users, books, n_books, stats, top_k, min_co, max_basket, block_pairs):
+    """The same computation with dicts, one book at a time; slow past a few hundred thousand loans."""
+    baskets = defaultdict(lambda: array("i"))
+    for user_id, book_id in zip(users, books):
+        baskets[user_id].append(book_id)
+    stats.readers = len(baskets)
+    readers = defaultdict(lambda: array("i"))
+    for user_id, basket in list(baskets.items()):
+        if len(basket) > max_basket:
+            stats.skipped_readers += 1
+            del baskets[user_id]
+            continue
+        for book_id in basket:
+            readers[book_id].append(user_id)
+
+    for book_id in range(n_books):
+        if book_id not in readers:
+            yield book_id, []
+            continue
+        co = defaultdict(int)
+        for user_id in readers[book_id]:
+            for other in baskets[user_id]:
+                co[other] += 1
+        co.pop(book_id, None)
+        neighbors = [other for other, count in co.items() if count >= min_co]
+        counts = [co[other] for other in neighbors]
+        scores = [count / math.sqrt(len(readers[book_id]) * len(readers[other]))
+                  for other, count in zip(neighbors, counts)]
+        yield book_id, _top_k(neighbors, scores, counts, top_k)
+
+
+def rebuild_neighbors(top_k=None, min_co=None, max_basket=None, block_pairs=None, batch_size=5000, progress=None):
+    """
+    Recompute every book's top ``top_k`` co-borrowed neighbours from the
+    borrowings table and replace the book_neighbors rows, a batch of books
+    per commit. A pair needs ``min_co`` shared readers to count. Readers with
+    more than ``max_basket`` loans are left out: they say little about which
+    books go together and their pairs grow with the square of their loans.
+    """
+    from models import BookNeighbor
+    top_k = top_k or _config("TOP_K")
+    min_co = min_co or _config("MIN_CO_BORROWERS")
+    max_basket = max_basket or _config("MAX_BASKET")
+    block_pairs = block_pairs or _config("BLOCK_PAIRS")
+    stats = BuildStats()
+    users, books = _load_loans(stats)
+    n_books = int(max(books)) + 1 if len(books) else 0
+    compute = _neighbors_scipy if sparse is not None else _neighbors_python
+
+    table = BookNeighbor.__table__
+    rows, book_ids = [], []
+
+    def flush():
+        # Only the books in this batch change, so pages keep their old neighbours until then
+        db.session.execute(delete(table).where(table.c.book_id.in_(book_ids)))
+        if rows:
+            db.session.execute(insert(table), rows)
+        db.session.commit()
+        if progress:
+            progress(stats)
+
+    for book_id, neighbors in compute(users, books, n_books, stats, top_k, min_co, max_basket, block_pairs):
+        book_ids.append(book_id)
+        if neighbors:
+            stats.books += 1
+            stats.pairs += len(neighbors)
+            rows.extend(dict(book_id=book_id, neighbor_id=neighbor, co_borrowers=count, score=score)
+                        for neighbor, count, score in neighbors)
+        if len(rows) >= batch_size or len(book_ids) >= batch_size:
+            flush()
+            rows, book_ids = [], []
+    if book_ids:
+        flush()
+    # Every book up to the highest one borrowed was replaced above; later ones have no loans left
+    db.session.execute(delete(table).where(table.c.book_id >= n_books))
+    db.session.commit()
+    stats.finished = time.perf_counter()
+    return stats
+
+
+#==============================================================================
+# INCREMENTAL UPDATES
+#==============================================================================
+
+def record_borrow(user_id, book_id):
+    """
+    Count a new loan in the stored neighbours: every stored pair of this book
+    with another book the reader has borrowed gains a co-borrower, in both
+    directions, and its score is recomputed. Pairs that aren't stored yet
+    appear at the next rebuild, which also trims each book back to its top k.
+    Borrowing a book again after returning it changes nothing.
+    """
+    from models import Book, BookNeighbor, Borrowing
+    loans_of_book = db.session.scalar(
+        select(func.count()).where(Borrowing.user_id == user_id, Borrowing.book_id == book_id)
+    )
+    if loans_of_book > 1:
+        return 0
+    others = db.session.scalars(
+        select(Borrowing.book_id).distinct().where(Borrowing.user_id == user_id, Borrowing.book_id != book_id)
+        .limit(_config("MAX_BASKET") + 1)
+    ).all()
+    if not others or len(others) > _config("MAX_BASKET"):
+        return 0
+    pairs = db.session.execute(
+        select(BookNeighbor.book_id, BookNeighbor.neighbor_id, BookNeighbor.co_borrowers).where(
+            ((BookNeighbor.book_id == book_id) & BookNeighbor.neighbor_id.in_(others))
+            | (BookNeighbor.book_id.in_(others) & (BookNeighbor.neighbor_id == book_id))
+        )
+    ).all()
+    if not pairs:
+        return 0
+    # borrow_count counts loans, which approximates the number of distinct readers
+    borrowers = dict(db.session.execute(
+        select(Book.id, Book.borrow_count).where(Book.id.in_({book_id, *others}))
+    ).all())
+    table = BookNeighbor.__table__
+    for source, neighbor, co_borrowers in pairs:
+        norm = math.sqrt(max(borrowers.get(source, 1), 1) * max(borrowers.get(neighbor, 1), 1))
+        # Relative to the stored count, so two borrows landing at once both count
+        db.session.execute(
+            table.update()
+            .where(table.c.book_id == source, table.c.neighbor_id == neighbor)
+            .values(co_borrowers=table.c.co_borrowers + 1, score=min((co_borrowers + 1) / norm, 1.0))
+        )
+    db.session.commit()
+    return len(pairs)
+
+
+#==============================================================================
+# CLI
+#==============================================================================
+
+recommendations_cli = AppGroup("recommendations", help="\"Also borrowed\" recommendations.")
+
+
+@recommendations_cli.command("rebuild")
+@click.option("--top-k", type=int, help="Neighbours kept per book  [default: RECOMMENDATIONS_TOP_K]")
+@click.option("--min-co-borrowers", type=int, help="Shared readers a pair needs  [default: RECOMMENDATIONS_MIN_CO_BORROWERS]")
+@click.option("--max-basket", type=int, help="Leave out readers with more loans  [default: RECOMMENDATIONS_MAX_BASKET]")
+@click.option("--block-pairs", type=int, help="Partial products per block; bounds memory  [default: RECOMMENDATIONS_BLOCK_PAIRS]")
+def rebuild_command(top_k, min_co_borrowers, max_basket, block_pairs):
+    """Recompute every book's co-borrowed neighbours from the borrowings table.
+
+    Run it nightly, e.g. from cron; borrows in between update the stored pairs.
+    """
+    if sparse is None:
+        click.echo("NumPy/SciPy aren't installed; computing in pure Python, which is slow for large libraries.")
+    stats = rebuild_neighbors(top_k, min_co_borrowers, max_basket, block_pairs,
+                              progress=lambda s: click.echo(f"\r{s.pairs:,} neighbours for {s.books:,} books", nl=False))
+    click.echo()
+    click.echo(f"Done: {stats}.")
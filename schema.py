@@ -0,0 +1,48 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect
+
+from extensions import db
+
+
+def _applies_to(index, dialect_name):
+    # Dialect-restricted indexes, like the MySQL FULLTEXT one, only count where they apply
+    ddl_if = index._ddl_if
+    if ddl_if is None or ddl_if.dialect is None:
+        return True
+    return dialect_name in ((ddl_if.dialect,) if isinstance(ddl_if.dialect, str) else ddl_if.dialect)
+
+
+def missing_indexes():
+    """Indexes declared on the models that the connected database doesn't have yet."""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # create_all() makes the table with its indexes
+        present = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name not in present and _applies_to(index, db.engine.dialect.name):
+                missing.append(index)
+    return missing
+
+
+schema_cli = AppGroup("schema", help="Keep the database schema in step with models.py.")
+
+
+@schema_cli.command("sync-indexes")
+@click.option("--dry-run", is_flag=True, help="Only list the indexes that would be created.")
+def sync_indexes_command(dry_run):
+    """Create indexes declared in models.py that an existing database is missing.
+
+    db.create_all() only adds indexes along with new tables, so run this after
+    upgrading. It never drops anything and is safe to re-run.
+    """
+    missing = missing_indexes()
+    for index in missing:
+        columns = ", ".join(column.name for column in index.columns)
+        click.echo(f"{'Would create' if dry_run else 'Creating'} {index.name} on {index.table.name} ({columns})")
+        if not dry_run:
+            index.create(db.engine)
+    click.echo(f"{len(missing)} missing indexes." if missing else "All indexes are present.")
@@ -0,0 +1,388 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text, case
+
+from extensions import db
+
+# Relative weight of each indexed field when ranking in-process results.
+FIELD_WEIGHTS = {"title": 3.0, "isbn": 3.0, "author": 2.0, "genre": 1.0, "description": 1.0}
+
+# Upper bound on how many ranked ids the in-process backend hands to SQL.
+MAX_CANDIDATES = 1000
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_ISBN_RE = re.compile(r"\b\d[\d\- ]{8,}[\dXx]\b")
+
+
+def _normalize_isbn(value):
+    """Collapse hyphens/spaces so '978-0-13-110362-7' indexes as one token."""
+    return re.sub(r"[\- ]", "", value or "").lower()
+
+
+def tokenize(value):
+    """Lower-cased word tokens of ``value``; hyphenated ISBNs stay whole."""
+    if not value:
+        return []
+    value = _ISBN_RE.sub(lambda m: _normalize_isbn(m.group(0)), value)
+    return _TOKEN_RE.findall(value.lower())
+
+
+def book_document(book):
+    """The searchable fields of a book, keyed like FIELD_WEIGHTS."""
+    return {
+        "title": book.title or "",
+        "author": book.author or "",
+        "description": book.description or "",
+        "genre": book.genre or "",
+        "isbn": _normalize_isbn(book.isbn),
+    }
+
+
+def like_filter(query, search_query):
+    """The old substring match, used when a query has no usable tokens."""
+    from models import Book
+    search_term = f"%{search_query}%"
+    return query.filter(db.or_(Book.title.ilike(search_term), Book.author.ilike(search_term)))
+
+
+#==============================================================================
+# BACKENDS
+#==============================================================================
+
+class SearchBackend:
+    """Base class: keeps an index in sync and ranks a Book query by relevance."""
+
+    name = "base"
+
+    def index_book(self, book):
+        pass
+
+    def remove_book(self, book_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def apply(self, query, search_query):
+        raise NotImplementedError
+
+
+class MySQLFullTextBackend(SearchBackend):
+    """Uses the ``ft_books_search`` FULLTEXT index; MySQL keeps it in sync itself."""
+
+    name = "mysql"
+    min_token_length = 3  # innodb_ft_min_token_size default
+
+    def _boolean_expression(self, tokens):
+        tokens = [t for t in tokens if len(t) >= self.min_token_length]
+        if not tokens:
+            return None
+        terms = [f"+{t}" for t in tokens[:-1]] + [f"+{tokens[-1]}*"]
+        return " ".join(terms)
+
+    def apply(self, query, search_query):
+        from models import Book
+        expression = self._boolean_expression(tokenize(search_query))
+        if expression is None:
+            return like_filter(query, search_query).order_by(Book.created_at.desc())
+        match = db.text(
+            "MATCH (books.title, books.author, books.description, books.genre, books.isbn) "
+            "AGAINST (:search_expr IN BOOLEAN MODE)"
+        ).bindparams(search_expr=expression)
+        return query.filter(match).order_by(db.desc(match), Book.created_at.desc())
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """An FTS5 table keyed by ``books.id`` and ranked with bm25()."""
+
+    name = "sqlite"
+    table = "books_fts"
+
+    def __init__(self):
+        self._ready = False
+
+    def _ensure_table(self):
+        if self._ready:
+            return
+        if self._create_table() or self._is_stale():
+            self._fill()
+            # Commit here: the first search runs inside a GET request, whose
+            # session would otherwise roll the fill back at teardown.
+            db.session.commit()
+        self._ready = True
+
+    def _create_table(self):
+        """Create the FTS table if it is missing; True when it was created."""
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": self.table},
+        ).first()
+        if exists:
+            return False
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE {self.table} USING fts5("
+            "title, author, description, genre, isbn, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        return True
+
+    def _is_stale(self):
+        """Whether the index disagrees with the books table in size or highest id."""
+        indexed = db.session.execute(text(f"SELECT COUNT(*), MAX(rowid) FROM {self.table}")).one()
+        books = db.session.execute(text("SELECT COUNT(*), MAX(id) FROM books")).one()
+        return tuple(indexed) != tuple(books)
+
+    def index_book(self, book):
+        self._ensure_table()
+        doc = book_document(book)
+        db.session.execute(text(f"DELETE FROM {self.table} WHERE rowid = :id"), {"id": book.id})
+        db.session.execute(
+            text(
+                f"INSERT INTO {self.table} (rowid, title, author, description, genre, isbn) "
+                "VALUES (:id, :title, :author, :description, :genre, :isbn)"
+            ),
+            dict(doc, id=book.id),
+        )
+
+    def remove_book(self, book_id):
+        self._ensure_table()
+        db.session.execute(text(f"DELETE FROM {self.table} WHERE rowid = :id"), {"id": book_id})
+
+    def rebuild(self):
+        self._create_table()
+        self._fill()
+        self._ready = True
+
+    def _fill(self):
+        from models import Book
+        db.session.execute(text(f"DELETE FROM {self.table}"))
+        rows = []
+        for book in Book.query.yield_per(1000):
+            rows.append(dict(book_document(book), id=book.id))
+            if len(rows) >= 1000:
+                self._insert_many(rows)
+                rows = []
+        if rows:
+            self._insert_many(rows)
+
+    def _insert_many(self, rows):
+        db.session.execute(
+            text(
+                f"INSERT INTO {self.table} (rowid, title, author, description, genre, isbn) "
+                "VALUES (:id, :title, :author, :description, :genre, :isbn)"
+            ),
+            rows,
+        )
+
+    def apply(self, query, search_query):
+        from models import Book
+        tokens = tokenize(search_query)
+        if not tokens:
+            return like_filter(query, search_query).order_by(Book.created_at.desc())
+        self._ensure_table()
+        # Every token must match; the last one as a prefix so partial words work.
+        expression = " ".join(f'"{t}"' for t in tokens[:-1]) + f' "{tokens[-1]}"*'
+        ranked = (
+            text(
+                f"SELECT rowid AS book_id, bm25({self.table}, 3.0, 2.0, 1.0, 1.0, 3.0) AS score "
+                f"FROM {self.table} WHERE {self.table} MATCH :search_expr"
+            )
+            .bindparams(search_expr=expression.strip())
+            .columns(book_id=db.Integer, score=db.Float)
+            .subquery("fts")
+        )
+        # bm25() is lower-is-better.
+        return query.join(ranked, ranked.c.book_id == Book.id).order_by(ranked.c.score, Book.created_at.desc())
+
+
+class InMemoryBackend(SearchBackend):
+    """
+    A per-process inverted index, for databases without full-text support.
+    Each worker builds its own copy on first search, so changes made by
+    another process only show up after a rebuild or restart.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}    # token -> {book_id: weighted term frequency}
+        self._doc_tokens = {}  # book_id -> set of tokens
+        self._vocabulary = []  # sorted tokens, for prefix lookups
+        self._vocabulary_dirty = False
+        self._loaded = False
+
+    def _load(self):
+        if not self._loaded:
+            self.rebuild()
+
+    def _add(self, book_id, doc):
+        weights = {}
+        for field, value in doc.items():
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0.0) + FIELD_WEIGHTS[field]
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[book_id] = weight
+        self._doc_tokens[book_id] = set(weights)
+        self._vocabulary_dirty = True
+
+    def _discard(self, book_id):
+        for token in self._doc_tokens.pop(book_id, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(book_id, None)
+                if not postings:
+                    del self._postings[token]
+        self._vocabulary_dirty = True
+
+    def index_book(self, book):
+        with self._lock:
+            if not self._loaded:
+                return  # the first search will load the book from the database
+            self._discard(book.id)
+            self._add(book.id, book_document(book))
+
+    def remove_book(self, book_id):
+        with self._lock:
+            if self._loaded:
+                self._discard(book_id)
+
+    def rebuild(self):
+        from models import Book
+        with self._lock:
+            self._postings, self._doc_tokens = {}, {}
+            for book in Book.query.yield_per(1000):
+                self._add(book.id, book_document(book))
+            self._loaded = True
+
+    def _expand_prefix(self, prefix):
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect_left(self._vocabulary, prefix)
+        matches = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def rank(self, tokens, limit=MAX_CANDIDATES):
+        """Ids of books containing every token (the last as a prefix), best first."""
+        with self._lock:
+            self._load()
+            total_docs = max(len(self._doc_tokens), 1)
+            scores = None
+            for position, token in enumerate(tokens):
+                variants = self._expand_prefix(token) if position == len(tokens) - 1 else [token]
+                term_scores = {}
+                for variant in variants:
+                    postings = self._postings.get(variant, {})
+                    idf = math.log(1 + total_docs / max(len(postings), 1))
+                    for book_id, weight in postings.items():
+                        term_scores[book_id] = max(term_scores.get(book_id, 0.0), weight * idf)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {bid: s + term_scores[bid] for bid, s in scores.items() if bid in term_scores}
+                if not scores:
+                    return []
+            return sorted(scores, key=lambda bid: (-scores[bid], -bid))[:limit]
+
+    def apply(self, query, search_query):
+        from models import Book
+        tokens = tokenize(search_query)
+        if not tokens:
+            return like_filter(query, search_query).order_by(Book.created_at.desc())
+        ranked_ids = self.rank(tokens)
+        if not ranked_ids:
+            return query.filter(db.false())
+        ordering = case({book_id: rank for rank, book_id in enumerate(ranked_ids)}, value=Book.id)
+        return query.filter(Book.id.in_(ranked_ids)).order_by(ordering)
+
+
+BACKENDS = {
+    "mysql": MySQLFullTextBackend,
+    "sqlite": SQLiteFTSBackend,
+    "memory": InMemoryBackend,
+}
+
+
+def _sqlite_has_fts5(engine):
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)"))
+            conn.execute(text("DROP TABLE temp.fts5_probe"))
+            return True
+        except Exception:
+            return False
+
+
+#==============================================================================
+# FLASK EXTENSION
+#==============================================================================
+
+class CatalogSearch:
+    """
+    Picks a search backend for the configured database and exposes the hooks
+    the book routes call to keep the index in sync.
+
+    ``SEARCH_BACKEND`` may be ``auto`` (default), ``mysql``, ``sqlite`` or ``memory``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SEARCH_BACKEND", "auto")
+        app.extensions["catalog_search"] = {"backend": None}
+
+    @property
+    def backend(self):
+        state = current_app.extensions["catalog_search"]
+        if state["backend"] is None:
+            state["backend"] = self._select_backend(current_app.config["SEARCH_BACKEND"])
+        return state["backend"]
+
+    def _select_backend(self, name):
+        if name != "auto":
+            return BACKENDS[name]()
+        engine = db.engine
+        if engine.dialect.name in ("mysql", "mariadb"):
+            return MySQLFullTextBackend()
+        if engine.dialect.name == "sqlite" and _sqlite_has_fts5(engine):
+            return SQLiteFTSBackend()
+        return InMemoryBackend()
+
+    def index_book(self, book):
+        """Add or refresh a book; call after flush so ``book.id`` is set."""
+        self.backend.index_book(book)
+
+    def remove_book(self, book_id):
+        self.backend.remove_book(book_id)
+
+    def rebuild(self):
+        self.backend.rebuild()
+
+    def apply(self, query, search_query):
+        """Restrict ``query`` to books matching ``search_query``, best match first."""
+        return self.backend.apply(query, search_query)
+
+
+catalog_search = CatalogSearch()
+
+search_cli = AppGroup("search", help="Manage the catalog search index.")
+
+
+@search_cli.command("rebuild")
+def rebuild_command():
+    """Rebuild the search index from the books table."""
+    catalog_search.rebuild()
+    db.session.commit()
+    click.echo(f"Rebuilt the '{catalog_search.backend.name}' search index.")
@@ -32,3 +32,44 @@ function togglePasswordVisibility(fieldId) {
         icon.classList.add('fa-eye');
     }
 }
+
+/**
+ * Typeahead for search boxes with a data-suggest-url: fills the input's
+ * <datalist> with title and author completions as the user types.
+ */
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-suggest-url]').forEach(function (input) {
+        const list = document.getElementById(input.getAttribute('list'));
+        let timer = null;
+        let pending = null;
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            timer = setTimeout(function() {
+                const query = input.value.trim();
+                if (pending) {
+                    pending.abort(); // only the latest keystroke's answer matters
+                }
+                if (!query) {
+                    list.replaceChildren();
+                    return;
+                }
+                pending = new AbortController();
+                fetch(input.dataset.suggestUrl + '?q=' + encodeURIComponent(input.value), {signal: pending.signal})
+                    .then(function (response) { return response.ok ? response.json() : null; })
+                    .then(function (data) {
+                        if (!data) {
+                            return;
+                        }
+                        const values = new Set(data.titles.map(function (t) { return t.title; }).concat(data.authors));
+                        list.replaceChildren.apply(list, Array.from(values, function (value) {
+                            const option = document.createElement('option');
+                            option.value = value;
+                            return option;
+                        }));
+                    })
+                    .catch(function () {});
+            }, 100);
+        });
+    });
+});
@@ -0,0 +1,136 @@
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+
+from cache import TTLCache
+from extensions import db
+
+_stats_cache = TTLCache(maxsize=32, ttl=60)
+
+# metric name -> (model name, timestamp column) it is rolled up from
+ROLLUP_METRICS = {
+    "borrows": ("Borrowing", "borrowed_date"),
+    "new_users": ("User", "created_at"),
+}
+
+
+def _compute_dashboard_counts():
+    from models import Book, Borrowing, User
+    row = db.session.execute(select(
+        select(func.count(Book.id)).scalar_subquery().label("total_books"),
+        select(func.count(User.id)).where(User.role != "admin").scalar_subquery().label("total_users"),
+        select(func.count(User.id)).where(User.role == "publisher").scalar_subquery().label("total_publishers"),
+        select(func.count(Borrowing.id)).where(Borrowing.is_returned.is_(False)).scalar_subquery().label("total_borrowed"),
+    )).one()
+    return dict(row._mapping)
+
+
+def dashboard_counts():
+    """The admin dashboard headline counts, from one query, cached for ADMIN_STATS_TTL seconds."""
+    key = ("dashboard_counts", current_app.config["SQLALCHEMY_DATABASE_URI"])
+    return _stats_cache.get_or_set(key, _compute_dashboard_counts, ttl=current_app.config["ADMIN_STATS_TTL"])
+
+
+#==============================================================================
+# DAILY ROLLUPS
+#==============================================================================
+
+def _as_date(value):
+    # func.date() gives a date on MySQL and an ISO string on SQLite
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def rollup(days=2, today=None):
+    """
+    Recompute the daily_stats rows for the last ``days`` days (today included)
+    from the base tables. Safe to re-run; each run replaces those days.
+    """
+    import models
+    from models import DailyStat
+    today = today or datetime.utcnow().date()
+    first_day = today - timedelta(days=days - 1)
+    start = datetime.combine(first_day, datetime.min.time())
+    end = datetime.combine(today + timedelta(days=1), datetime.min.time())
+
+    for metric, (model_name, column_name) in ROLLUP_METRICS.items():
+        column = getattr(getattr(models, model_name), column_name)
+        counts = {
+            _as_date(day): count
+            for day, count in db.session.query(func.date(column), func.count())
+            .filter(column >= start, column < end)
+            .group_by(func.date(column))
+        }
+        DailyStat.query.filter(DailyStat.metric == metric, DailyStat.day >= first_day).delete(synchronize_session=False)
+        db.session.add_all([
+            DailyStat(metric=metric, day=first_day + timedelta(days=offset),
+                      value=counts.get(first_day + timedelta(days=offset), 0))
+            for offset in range(days)
+        ])
+    db.session.commit()
+    _stats_cache.clear()
+
+
+def daily_series(metric, days=14, today=None):
+    """``[(day, value), ...]`` for the last ``days`` days; days not rolled up yet count as 0."""
+    from models import DailyStat
+    today = today or datetime.utcnow().date()
+    first_day = today - timedelta(days=days - 1)
+    values = dict(
+        db.session.query(DailyStat.day, DailyStat.value)
+        .filter(DailyStat.metric == metric, DailyStat.day >= first_day)
+    )
+    return [(day, values.get(day, 0)) for day in (first_day + timedelta(days=i) for i in range(days))]
+
+
+def weekly_series(metric, weeks=8, today=None):
+    """``[(week_start, value), ...]`` summed from the daily rollups, weeks starting on Monday."""
+    today = today or datetime.utcnow().date()
+    this_monday = today - timedelta(days=today.weekday())
+    first_monday = this_monday - timedelta(weeks=weeks - 1)
+    totals = {first_monday + timedelta(weeks=i): 0 for i in range(weeks)}
+    for day, value in daily_series(metric, days=(today - first_monday).days + 1, today=today):
+        totals[day - timedelta(days=day.weekday())] += value
+    return sorted(totals.items())
+
+
+def dashboard_series():
+    """The time-series panels for the admin dashboard, cached like the counts."""
+    key = ("dashboard_series", current_app.config["SQLALCHEMY_DATABASE_URI"])
+    return _stats_cache.get_or_set(key, lambda: {
+        "borrows_per_day": daily_series("borrows", days=14),
+        "new_users_per_week": weekly_series("new_users", weeks=8),
+    }, ttl=current_app.config["ADMIN_STATS_TTL"])
+
+
+def rebuild_borrow_counts():
+    """Recompute every book's borrow_count from the borrowings table in one statement."""
+    from models import Book, Borrowing
+    books = Book.__table__
+    loans = (
+        select(func.count(Borrowing.id))
+        .where(Borrowing.book_id == books.c.id)
+        .scalar_subquery()
+    )
+    db.session.execute(books.update().values(borrow_count=loans))
+    db.session.commit()
+
+
+stats_cli = AppGroup("stats", help="Maintain pre-aggregated dashboard statistics.")
+
+
+@stats_cli.command("rollup")
+@click.option("--days", default=2, show_default=True, help="How many days back to recompute.")
+def rollup_command(days):
+    """Roll up daily borrow and sign-up counts (schedule this, e.g. hourly)."""
+    rollup(days=days)
+    click.echo(f"Rolled up {len(ROLLUP_METRICS)} metrics for the last {days} days.")
+
+
+@stats_cli.command("rebuild-counters")
+def rebuild_counters_command():
+    """Backfill or repair the per-book borrow counters from the borrowings table."""
+    rebuild_borrow_counts()
+    click.echo("Rebuilt book borrow counts.")
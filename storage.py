@@ -0,0 +1,339 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+import click
+from flask import Request, current_app
+from flask.cli import AppGroup
+
+from extensions import db
+
+CHUNK_SIZE = 1024 * 1024
+
+# Content-addressed keys look like "3f/3fa9...e1.pdf": a two-character shard
+# directory, then the SHA-256 of the content and the original extension.
+_KEY_RE = re.compile(r"^([0-9a-f]{2})/\1[0-9a-f]{62}\.[a-z0-9]+$")
+
+
+def is_content_key(key):
+    return bool(key and _KEY_RE.match(key))
+
+
+def content_hash(key):
+    """The SHA-256 hex digest a content-addressed key was built from."""
+    return key.split("/", 1)[1].split(".", 1)[0]
+
+
+class HashingUpload:
+    """
+    A temp file that an uploaded file part is written into while the request
+    body is parsed, hashing the bytes as they arrive. LocalStorage.save() can
+    then store it with a rename instead of reading it all again.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self._hashed = 0  # bytes covered by the digest; -1 once it no longer matches the file
+        self.size = 0
+
+    def write(self, data):
+        if self._hashed == self._file.tell():
+            self._digest.update(data)
+            self._hashed += len(data)
+        else:
+            self._hashed = -1
+        self.size = max(self.size, self._file.tell() + len(data))
+        return self._file.write(data)
+
+    def hexdigest(self):
+        """The SHA-256 of the whole file, or None if it was written out of order."""
+        return self._digest.hexdigest() if self._hashed == self.size else None
+
+    def detach(self):
+        """Hand the file over to the caller, who becomes responsible for ``path``."""
+        self._file.close()
+        path, self.path = self.path, None
+        return path
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+            self.path = None
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """
+    Streams uploaded files to disk in chunks as the body is parsed, instead
+    of spooling them in memory and copying them again when they are saved.
+    Unclaimed temp files are removed when the request closes.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUpload(os.path.join(current_app.config["UPLOAD_FOLDER"], ".incoming"))
+
+
+class StorageBackend:
+    """
+    Where uploaded blobs live. Keys are relative paths chosen by the backend;
+    books store them in ``cover_image`` and ``pdf_file``.
+    """
+
+    def save(self, stream, extension):
+        """Store the bytes read from ``stream``; returns ``(key, size)``."""
+        raise NotImplementedError
+
+    def open(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """A filesystem path for ``key``, or None if the backend isn't on local disk."""
+        return None
+
+    def iter_keys(self):
+        """Every content-addressed key in the store, with its last-modified time."""
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """Content-addressed blobs under a directory, so identical uploads share one file."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Storage key escapes the store: {key!r}")
+        return path
+
+    def _key(self, hex_digest, extension):
+        return f"{hex_digest[:2]}/{hex_digest}.{extension.lower()}"
+
+    def _adopt(self, tmp_path, key):
+        """Move a complete temp file to ``key``; returns False if it couldn't be moved."""
+        final_path = self._path(key)
+        if os.path.exists(final_path):
+            # Already stored: refresh its mtime so a concurrent GC sweep leaves it alone
+            os.utime(final_path)
+            os.remove(tmp_path)
+            return True
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.chmod(tmp_path, 0o644)  # mkstemp files are owner-only; the front-end server may serve these
+        try:
+            os.replace(tmp_path, final_path)
+        except OSError:  # e.g. the upload temp dir is on another filesystem
+            return False
+        return True
+
+    def save(self, stream, extension):
+        if isinstance(stream, HashingUpload) and stream.hexdigest():
+            # Streamed to disk and hashed while the request was parsed
+            size, key = stream.size, self._key(stream.hexdigest(), extension)
+            tmp_path = stream.detach()
+            if self._adopt(tmp_path, key):
+                return key, size
+            stream = open(tmp_path, "rb")
+            try:
+                return self.save(stream, extension)
+            finally:
+                stream.close()
+                os.remove(tmp_path)
+
+        tmp_dir = os.path.join(self.root, ".incoming")
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest, size = hashlib.sha256(), 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            # Hash while writing so the upload is read exactly once
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            key = self._key(digest.hexdigest(), extension)
+            if self._adopt(tmp_path, key):
+                tmp_path = None
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return key, size
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        return self._path(key)
+
+    def iter_keys(self):
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                key = f"{shard}/{name}"
+                if is_content_key(key):
+                    yield key, os.path.getmtime(os.path.join(shard_dir, name))
+
+
+BACKENDS = {"local": LocalStorage}
+
+
+class UploadStorage:
+    """
+    The ``covers`` and ``pdfs`` buckets, each a StorageBackend chosen by
+    ``STORAGE_BACKEND`` (only ``local`` ships today).
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("STORAGE_BACKEND", "local")
+        app.config.setdefault("STORAGE_GC_GRACE_SECONDS", 3600)
+        backend = BACKENDS[app.config["STORAGE_BACKEND"]]
+        app.extensions["upload_storage"] = {
+            "covers": backend(app.config["BOOK_COVER_FOLDER"]),
+            "pdfs": backend(app.config["BOOK_PDF_FOLDER"]),
+        }
+
+    def bucket(self, name):
+        return current_app.extensions["upload_storage"][name]
+
+    @property
+    def covers(self):
+        return self.bucket("covers")
+
+    @property
+    def pdfs(self):
+        return self.bucket("pdfs")
+
+
+upload_storage = UploadStorage()
+
+# bucket -> Book column holding its keys
+BUCKET_COLUMNS = {"covers": "cover_image", "pdfs": "pdf_file"}
+
+
+def _referenced(bucket, key):
+    from models import Book
+    column = getattr(Book, BUCKET_COLUMNS[bucket])
+    return db.session.query(Book.query.filter(column == key).exists()).scalar()
+
+
+def release(bucket, key, grace_seconds=None):
+    """
+    Delete a content-addressed blob once no book references it. Blobs written
+    or re-uploaded within the grace period are kept, since another upload
+    may be about to reference them. Returns True if the blob was deleted.
+    """
+    if not is_content_key(key) or _referenced(bucket, key):
+        return False
+    store = upload_storage.bucket(bucket)
+    grace = current_app.config["STORAGE_GC_GRACE_SECONDS"] if grace_seconds is None else grace_seconds
+    path = store.local_path(key)
+    if path and os.path.exists(path) and time.time() - os.path.getmtime(path) < grace:
+        return False
+    store.delete(key)
+    if bucket == "covers":
+        from covers import delete_variants
+        delete_variants(content_hash(key)[:16])
+    return True
+
+
+def _sweep_incoming(grace):
+    """Remove temp files left behind by uploads that never finished."""
+    folders = [os.path.join(current_app.config[name], ".incoming")
+               for name in ("UPLOAD_FOLDER", "BOOK_COVER_FOLDER", "BOOK_PDF_FOLDER")]
+    now, deleted = time.time(), 0
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if now - os.path.getmtime(path) >= grace:
+                os.remove(path)
+                deleted += 1
+    return deleted
+
+
+def collect_garbage(grace_seconds=None):
+    """Sweep both buckets for unreferenced blobs and stale temp files; returns how many were deleted."""
+    from models import Book
+    grace = current_app.config["STORAGE_GC_GRACE_SECONDS"] if grace_seconds is None else grace_seconds
+    deleted = _sweep_incoming(grace)
+    for bucket, column_name in BUCKET_COLUMNS.items():
+        column = getattr(Book, column_name)
+        referenced = {key for (key,) in db.session.query(column).filter(column.isnot(None)).distinct()}
+        now = time.time()
+        for key, mtime in upload_storage.bucket(bucket).iter_keys():
+            if key not in referenced and now - mtime >= grace:
+                deleted += release(bucket, key, grace_seconds=grace)
+    return deleted
+
+
+def import_legacy_file(bucket, filename):
+    """Move a pre-content-addressing upload into the store; returns its new key or None."""
+    store = upload_storage.bucket(bucket)
+    root = current_app.config["BOOK_COVER_FOLDER" if bucket == "covers" else "BOOK_PDF_FOLDER"]
+    path = os.path.join(root, filename)
+    if not os.path.isfile(path):
+        return None
+    extension = filename.rsplit(".", 1)[-1] if "." in filename else "bin"
+    with open(path, "rb") as fh:
+        key, _ = store.save(fh, extension)
+    return key
+
+
+storage_cli = AppGroup("storage", help="Manage content-addressed upload storage.")
+
+
+@storage_cli.command("gc")
+@click.option("--grace", type=int, default=None, help="Keep blobs younger than this many seconds.")
+def gc_command(grace):
+    """Delete stored covers and PDFs that no book references any more, and abandoned uploads."""
+    click.echo(f"Deleted {collect_garbage(grace_seconds=grace)} unreferenced blobs and stale uploads.")
+
+
+@storage_cli.command("migrate")
+def migrate_command():
+    """Move uploads saved under their original names into content-addressed storage."""
+    from models import Book
+    moved = 0
+    for bucket, column_name in BUCKET_COLUMNS.items():
+        column = getattr(Book, column_name)
+        for book in Book.query.filter(column.isnot(None), column != ""):
+            filename = getattr(book, column_name)
+            if is_content_key(filename):
+                continue
+            key = import_legacy_file(bucket, filename)
+            if key:
+                setattr(book, column_name, key)
+                moved += 1
+        db.session.commit()
+    click.echo(f"Moved {moved} uploads into content-addressed storage; the original files were left in place.")
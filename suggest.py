@@ -0,0 +1,370 @@
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from concurrent.futures import Future
+from heapq import nlargest
+from itertools import accumulate, islice
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select
+
+from extensions import db
+from tasks import background_tasks
+
+FETCH_SIZE = 50_000  # books read per round trip while building
+MAX_QUERY_LENGTH = 100
+
+# Prefixes matching up to this many entries are ranked by scanning them; the
+# top entries of broader ones (the first few keystrokes) are remembered
+SCAN_LIMIT = 2048
+MEMO_DEPTH = 64
+MEMO_LIMIT = 20_000
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_MAX_CHAR = "\U0010ffff"
+
+
+def normalize(value):
+    """The form titles and authors are matched in: accent-free, case-folded words joined by single spaces."""
+    if not value:
+        return ""
+    if not value.isascii():
+        value = "".join(c for c in unicodedata.normalize("NFKD", value) if not unicodedata.combining(c))
+    return " ".join(_WORD_RE.findall(value.casefold()))
+
+
+def normalize_prefix(query):
+    """``query`` as typed so far, normalized; a trailing space or punctuation ends the last word."""
+    query = (query or "")[:MAX_QUERY_LENGTH]
+    prefix = normalize(query)
+    if prefix and not _WORD_RE.match(query[-1]):
+        prefix += " "
+    return prefix
+
+
+#==============================================================================
+# PREFIX INDEX
+#==============================================================================
+
+class PrefixIndex:
+    """
+    An immutable, sorted list of strings answering "the best-scored entries
+    starting with this prefix" with two binary searches.
+
+    The texts are kept as given (for display), sorted by their normalized
+    form, and stored back to back in one str with an offsets array; scores
+    and optional integer values sit in parallel arrays. That is about the
+    length of the text plus 8-16 bytes an entry, against ~60 bytes of
+    overhead for a list of separate strings. Keys are normalized on the fly
+    during the ~20 comparisons of a search, which is cheaper than keeping
+    them.
+    """
+
+    def __init__(self, texts, scores, values=None):
+        """Index ``texts`` with parallel sequences of ``scores`` and, optionally, integer ``values``."""
+        keys = [normalize(text) for text in texts]
+        order = sorted(filter(keys.__getitem__, range(len(keys))), key=keys.__getitem__)
+        del keys
+        self._blob = "".join([texts[i] for i in order])
+        self._offsets = array("I", accumulate((len(texts[i]) for i in order), initial=0))
+        self._scores = array("f", [scores[i] for i in order])
+        self._values = array("q", [values[i] for i in order]) if values is not None else None
+        self._top = {}  # prefix -> best MEMO_DEPTH positions, for broad prefixes
+
+    def __len__(self):
+        return len(self._scores)
+
+    @property
+    def nbytes(self):
+        """Memory held by the index itself, not counting the memo."""
+        arrays = (self._offsets, self._scores) + ((self._values,) if self._values is not None else ())
+        return len(self._blob.encode("utf-8", "surrogatepass")) + sum(a.itemsize * len(a) for a in arrays)
+
+    def text(self, i):
+        return self._blob[self._offsets[i]:self._offsets[i + 1]]
+
+    def key(self, i):
+        return normalize(self.text(i))
+
+    def score(self, i):
+        return self._scores[i]
+
+    def value(self, i):
+        return self._values[i]
+
+    def span(self, prefix):
+        """``(lo, hi)``: the positions whose normalized text starts with ``prefix``."""
+        positions = range(len(self))
+        lo = bisect_left(positions, prefix, key=self.key)
+        return lo, bisect_left(positions, prefix + _MAX_CHAR, lo=lo, key=self.key)
+
+    def find(self, key):
+        """Position of an entry whose normalized text is exactly ``key``, or None."""
+        lo = bisect_left(range(len(self)), key, key=self.key)
+        return lo if lo < len(self) and self.key(lo) == key else None
+
+    def top(self, prefix, limit, skip=frozenset()):
+        """
+        Positions of the ``limit`` best-scored entries starting with ``prefix``,
+        best first (ties in alphabetical order), leaving out entries whose
+        value is in ``skip``.
+        """
+        lo, hi = self.span(prefix)
+        if hi - lo > SCAN_LIMIT and limit <= MEMO_DEPTH:
+            best = self._top.get(prefix)
+            if best is None:
+                if len(self._top) >= MEMO_LIMIT:
+                    self._top.clear()
+                best = self._top[prefix] = nlargest(MEMO_DEPTH, range(lo, hi), key=self._scores.__getitem__)
+            found = list(islice((i for i in best if not skip or self._values[i] not in skip), limit))
+            if len(found) < limit and len(best) < hi - lo:
+                # Skipped entries crowd the remembered ones out; remember enough to get past all of them
+                best = self._top[prefix] = nlargest(min(limit + len(skip), hi - lo), range(lo, hi),
+                                                    key=self._scores.__getitem__)
+                found = list(islice((i for i in best if self._values[i] not in skip), limit))
+            return found
+        candidates = range(lo, hi)
+        if skip:
+            candidates = [i for i in candidates if self._values[i] not in skip]
+        return nlargest(limit, candidates, key=self._scores.__getitem__)
+
+    def warm(self, depth=2):
+        """Remember the top entries of every broad prefix up to ``depth`` characters, so no keystroke pays for it."""
+        for length in range(1, depth + 1):
+            lo = 0
+            while lo < len(self):
+                prefix = self.key(lo)[:length]
+                _, hi = self.span(prefix)
+                if hi - lo > SCAN_LIMIT:
+                    self.top(prefix, MEMO_DEPTH)
+                lo = hi
+
+
+#==============================================================================
+# FLASK EXTENSION
+#==============================================================================
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.titles = self.authors = None
+        self.built_at = self.building = None
+        self.retry_at = 0.0
+        self.changes = None  # book changes made while a build runs, replayed onto its result
+        self._reset_overlay()
+
+    def _reset_overlay(self):
+        self.hidden = set()       # ids of books whose indexed title is outdated or deleted
+        self.new_titles = {}      # book id -> (key, title, score), added or edited since the build
+        self.new_keys = []        # sorted (key, book id) of new_titles, for prefix lookups
+        self.new_authors = {}     # key -> author, for authors the build didn't see
+
+
+class Suggestions:
+    """
+    Typeahead completions for the catalog search box: the best titles and
+    authors starting with what has been typed, from prefix indexes held in
+    each worker process (see PrefixIndex).
+
+    The indexes are built from the books table in the background on a
+    worker's first request (``SUGGEST_PRELOAD``), with no suggestions until
+    that first build is done, and rebuilt every
+    ``SUGGEST_REFRESH_SECONDS``, which also picks up new borrow counts and
+    changes made by other processes. Books added, edited or deleted through
+    this worker show up at once: they go into a small overlay checked next to
+    the index, which a rebuild folds in (early, if it passes
+    ``SUGGEST_MAX_OVERLAY`` books). An author whose last book is deleted is
+    still suggested until the next rebuild.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SUGGEST_LIMIT", 8)
+        app.config.setdefault("SUGGEST_REFRESH_SECONDS", 900)
+        app.config.setdefault("SUGGEST_MAX_OVERLAY", 2000)
+        app.config.setdefault("SUGGEST_PRELOAD", True)
+        app.extensions["suggestions"] = _State()
+        app.before_request(self._preload)
+
+    @property
+    def _state(self):
+        return current_app.extensions["suggestions"]
+
+    def _preload(self):
+        state = self._state
+        if state.titles is None and current_app.config["SUGGEST_PRELOAD"]:
+            self._start_build(state)
+
+    def _start_build(self, state):
+        """Start building the indexes in the background unless a build is under way; returns its Future."""
+        with state.lock:
+            if state.building is not None or time.monotonic() < state.retry_at:
+                return state.building
+            state.building = future = Future()
+            state.changes = []
+        background_tasks.submit(self._build, state, future)
+        return future
+
+    def _build(self, state, future=None):
+        from models import Book
+        try:
+            titles, scores, book_ids, authors = [], array("f"), array("q"), {}
+            rows = db.session.execute(
+                select(Book.id, Book.title, Book.author, Book.borrow_count).execution_options(yield_per=FETCH_SIZE)
+            )
+            for book_id, title, author, borrows in rows:
+                titles.append(title or "")
+                scores.append(borrows or 0)
+                book_ids.append(book_id)
+                # An author's score is the borrows of all their books, under any spelling of the name
+                entry = authors.setdefault(normalize(author), [author, 0])
+                entry[1] += borrows or 0
+            title_index = PrefixIndex(titles, scores, book_ids)
+            del titles, scores, book_ids
+            authors.pop("", None)
+            author_index = PrefixIndex([name for name, _ in authors.values()], [score for _, score in authors.values()])
+            del authors
+            title_index.warm()
+            author_index.warm()
+        except Exception as exc:
+            with state.lock:
+                state.building = state.changes = None
+                state.retry_at = time.monotonic() + 60  # don't retry on every request
+            if future is not None:
+                future.set_exception(exc)
+            raise
+        with state.lock:
+            state.titles, state.authors = title_index, author_index
+            state._reset_overlay()
+            # Changes that landed while the books were being read may or may not be in the new index;
+            # applying them again is harmless
+            for change in state.changes:
+                self._apply(state, *change)
+            state.changes, state.building = None, None
+            state.built_at = time.monotonic()
+        if future is not None:
+            future.set_result(len(title_index))
+        return len(title_index)
+
+    def rebuild(self):
+        """Build the indexes now, in this thread; returns the number of titles."""
+        state = self._state
+        with state.lock:
+            if state.changes is None:
+                state.changes = []
+        return self._build(state)
+
+    def _apply(self, state, book_id, title=None, author=None, score=0):
+        state.hidden.add(book_id)
+        previous = state.new_titles.pop(book_id, None)
+        if previous is not None:
+            del state.new_keys[bisect_left(state.new_keys, (previous[0], book_id))]
+        if title is None:
+            return
+        key = normalize(title)
+        if key:
+            state.new_titles[book_id] = (key, title, score)
+            insort(state.new_keys, (key, book_id))
+        author_key = normalize(author)
+        if author_key and author_key not in state.new_authors and state.authors.find(author_key) is None:
+            state.new_authors[author_key] = author
+
+    def _record(self, *change):
+        state = self._state
+        with state.lock:
+            if state.changes is not None:
+                state.changes.append(change)
+            if state.titles is not None:
+                self._apply(state, *change)
+
+    def index_book(self, book):
+        """Add or refresh a book's title and author; call after flush so ``book.id`` is set."""
+        self._record(book.id, book.title or "", book.author or "", book.borrow_count or 0)
+
+    def remove_book(self, book_id):
+        self._record(book_id)
+
+    def suggest(self, query, limit=None):
+        """
+        ``{"titles": [(book_id, title), ...], "authors": [author, ...]}``: up
+        to ``limit`` of each starting with ``query``, most borrowed first.
+        """
+        limit = limit or current_app.config["SUGGEST_LIMIT"]
+        prefix = normalize_prefix(query)
+        if not prefix:
+            return {"titles": [], "authors": []}
+        state = self._state
+        if state.titles is None:
+            # Not waiting for the build, which takes seconds on a large catalog; it may have run inline
+            self._start_build(state)
+            if state.titles is None:
+                return {"titles": [], "authors": []}
+        elif state.building is None and (
+                time.monotonic() - state.built_at > current_app.config["SUGGEST_REFRESH_SECONDS"]
+                or len(state.new_titles) > current_app.config["SUGGEST_MAX_OVERLAY"]):
+            self._start_build(state)
+
+        with state.lock:
+            titles, authors = state.titles, state.authors
+            found = [(titles.score(i), titles.key(i), titles.value(i), titles.text(i))
+                     for i in titles.top(prefix, limit, skip=state.hidden)]
+            for key, book_id in state.new_keys[bisect_left(state.new_keys, (prefix,)):]:
+                if not key.startswith(prefix):
+                    break
+                found.append((state.new_titles[book_id][2], key, book_id, state.new_titles[book_id][1]))
+            found.sort(key=lambda item: (-item[0], item[1]))
+            names = [(authors.score(i), authors.key(i), authors.text(i)) for i in authors.top(prefix, limit)]
+            names += [(0, key, author) for key, author in state.new_authors.items() if key.startswith(prefix)]
+            names.sort(key=lambda item: (-item[0], item[1]))
+        return {
+            "titles": [(book_id, title) for _, _, book_id, title in found[:limit]],
+            "authors": [author for _, _, author in names[:limit]],
+        }
+
+    def stats(self):
+        state = self._state
+        with state.lock:
+            if state.titles is None:
+                return None
+            return {
+                "titles": len(state.titles), "authors": len(state.authors),
+                "bytes": state.titles.nbytes + state.authors.nbytes,
+                "overlay": len(state.new_titles), "age": time.monotonic() - state.built_at,
+            }
+
+
+suggestions = Suggestions()
+
+
+#==============================================================================
+# CLI
+#==============================================================================
+
+suggest_cli = AppGroup("suggest", help="Search box typeahead.")
+
+
+@suggest_cli.command("query")
+@click.argument("text")
+@click.option("--limit", type=int, help="Completions of each kind  [default: SUGGEST_LIMIT]")
+def query_command(text, limit):
+    """Build the prefix indexes and show the completions for TEXT, with timings."""
+    started = time.perf_counter()
+    count = suggestions.rebuild()
+    stats = suggestions.stats()
+    click.echo(f"Indexed {count:,} titles and {stats['authors']:,} authors "
+               f"({stats['bytes'] / 2 ** 20:.1f} MiB) in {time.perf_counter() - started:.1f}s.")
+    started = time.perf_counter()
+    result = suggestions.suggest(text, limit)
+    click.echo(f"{(time.perf_counter() - started) * 1000:.2f} ms")
+    for book_id, title in result["titles"]:
+        click.echo(f"  title   {title} (#{book_id})")
+    for author in result["authors"]:
+        click.echo(f"  author  {author}")
@@ -0,0 +1,70 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from flask import current_app
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTasks:
+    """
+    A bounded thread pool for work that shouldn't hold up a request, such as
+    image resizing. Each task runs inside its own app context, so it gets its
+    own database session.
+
+    With ``BACKGROUND_TASKS_EAGER`` set, tasks run inline instead; that is
+    useful for CLI commands and debugging.
+    """
+
+    def __init__(self, app=None):
+        self._executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BACKGROUND_WORKERS", 4)
+        app.config.setdefault("BACKGROUND_TASKS_EAGER", False)
+        app.extensions["background_tasks"] = self
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=current_app.config["BACKGROUND_WORKERS"], thread_name_prefix="background"
+            )
+        return self._executor
+
+    def submit(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` in the pool; returns a Future."""
+        app = current_app._get_current_object()
+        if app.config["BACKGROUND_TASKS_EAGER"]:
+            return _run_inline(app, func, args, kwargs)
+        return self.executor.submit(_run_in_context, app, func, args, kwargs)
+
+
+def _run_in_context(app, func, args, kwargs):
+    with app.app_context():
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", getattr(func, "__name__", func))
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+def _run_inline(app, func, args, kwargs):
+    future = Future()
+    try:
+        with app.app_context():
+            future.set_result(func(*args, **kwargs))
+    except Exception as exc:
+        logger.exception("Background task %s failed", getattr(func, "__name__", func))
+        future.set_exception(exc)
+    return future
+
+
+background_tasks = BackgroundTasks()
@@ -60,4 +60,26 @@ def validate_book_data(form_data):
         except ValueError:
             errors.append('Total copies must be a valid number.')
     
-    return errors
\ No newline at end of file
+    return errors
+
+def validate_user_data(data):
+    """Validate an account to be created, with the same rules as the registration form"""
+    errors = []
+
+    if not data.get('username') or len(data['username'].strip()) < 3:
+        errors.append('Username must be at least 3 characters long.')
+    elif len(data['username']) > 100:
+        errors.append('Username must be at most 100 characters long.')
+
+    if not data.get('email') or not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', data['email']):
+        errors.append('Please enter a valid email address.')
+    elif len(data['email']) > 255:
+        errors.append('Email must be at most 255 characters long.')
+
+    if not data.get('password') or len(data['password']) < 8:
+        errors.append('Password must be at least 8 characters long.')
+
+    if data.get('role', 'user') not in ('user', 'publisher'):
+        errors.append('Role must be "user" or "publisher".')
+
+    return errors